@@ -4,18 +4,47 @@ Gemini API를 사용하여 이미지에서 옷의 특징을 추출하고 JSON으
 """
 
 import os
+import asyncio
+import base64
+import bisect
+import contextlib
+import contextvars
+import hashlib
+import heapq
 import json
+import math
+import mmap
+import queue
+import random
 import re
-from typing import Any, Dict, List, Optional, Tuple
+import shutil
+import sqlite3
+import string
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from datetime import datetime
+from types import SimpleNamespace
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Request, Response, g, request, jsonify, send_file, stream_with_context
 from flask_cors import CORS
-from PIL import Image
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.security import safe_join
+from PIL import Image, ImageChops
 import io
-import google.generativeai as genai
+import numpy as np
 from dotenv import load_dotenv
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
 # .env 파일 로드
 load_dotenv()
 
@@ -24,12 +53,751 @@ CORS(app)
 
 # Gemini API 설정
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
-if not GEMINI_API_KEY:
+# google: real API | fake: FakeGeminiModel with synthetic responses (load tests without quota)
+GEMINI_BACKEND = os.getenv("GEMINI_BACKEND", "google").lower()
+if not GEMINI_API_KEY and GEMINI_BACKEND != "fake":
     print("Warning: GEMINI_API_KEY 환경변수가 설정되지 않았습니다.")
     print("       .env 파일에 GEMINI_API_KEY를 설정하거나 환경변수로 설정해주세요.")
 
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel('gemini-2.5-flash')
+GEMINI_MODEL_NAME = 'gemini-2.5-flash'
+# The model (and the google-generativeai SDK, ~0.5s of imports) is created on first use: get_gemini_model()
+
+# -----------------------------
+# Metrics (Prometheus text exposition, served at /api/metrics)
+# -----------------------------
+METRICS_PREFIX = "stylist_"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+def _metric_labels(names: Tuple[str, ...], values: Tuple[Any, ...], extra: str = "") -> str:
+    pairs = [f'{n}="{_escape_label(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """Monotonic counter keyed by label values (one small lock per metric; inc is a dict update)"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = METRICS_PREFIX + name
+        self.help = help_text
+        self.labels = labels
+        self._values: Dict[Tuple[Any, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        with self._lock:
+            return self._values.get(tuple(labels.get(n, "") for n in self.labels), 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_metric_labels(self.labels, k)} {v:g}" for k, v in values]
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values; observe is a bisect plus a locked update"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = METRICS_PREFIX + name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series: Dict[Tuple[Any, ...], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(labels.get(n, "") for n in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            snapshot = sorted((k, (list(s[0]), s[1], s[2])) for k, s in self._series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in snapshot:
+            cumulative = 0
+            for bound, c in zip(list(self.buckets) + [float("inf")], counts):
+                cumulative += c
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound:g}"'
+                lines.append(f"{self.name}_bucket{_metric_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_metric_labels(self.labels, key)} {total:.6f}")
+            lines.append(f"{self.name}_count{_metric_labels(self.labels, key)} {count}")
+        return lines
+
+class GaugeCallback:
+    """Gauge read at scrape time from existing state: fn() -> {label values tuple: value}"""
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...], fn: Callable[[], Dict[Tuple[Any, ...], float]],
+                 kind: str = "gauge"):
+        self.name = METRICS_PREFIX + name
+        self.help = help_text
+        self.labels = labels
+        self.fn = fn
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{self.name}{_metric_labels(self.labels, k)} {v:g}" for k, v in sorted(self.fn().items())]
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[Any] = []
+
+    def register(self, metric: Any) -> Any:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            try:
+                lines += metric.render()
+            except Exception as e:  # a broken callback must not take the whole scrape down
+                print(f"Metrics render error ({metric.name}): {e}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+http_request_duration = metrics.register(Histogram(
+    "http_request_duration_seconds", "Request latency by route (URL rule), method and status",
+    ("route", "method", "status")))
+gemini_requests = metrics.register(Counter(
+    "gemini_requests_total", "Gemini model calls by purpose and outcome (ok, error, retry, rejected)",
+    ("purpose", "outcome")))
+gemini_request_duration = metrics.register(Histogram(
+    "gemini_request_duration_seconds", "Latency of individual Gemini model calls by purpose", ("purpose",)))
+extraction_outcomes = metrics.register(Counter(
+    "extraction_outcomes_total",
+    "Attribute extraction results: valid, repaired, retry_valid, retry_invalid, parse_failed, retry_parse_failed, invalid_no_retry",
+    ("outcome",)))
+recommend_methods = metrics.register(Counter(
+    "recommend_responses_total", "Outfit recommendation responses by method", ("method",)))
+recommend_fallbacks = metrics.register(Counter(
+    "recommend_fallbacks_total",
+    "Rule-based fallbacks: breaker_open, saturated, deadline, gemini_error, parse_failed, invalid_response",
+    ("reason",)))
+
+# -----------------------------
+# Request tracing (Server-Timing spans, structured request log, sampling profiler)
+# -----------------------------
+REQUEST_LOG_ENABLED = os.getenv("REQUEST_LOG", "true").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))    # fraction of requests profiled
+PROFILE_ALLOW_HEADER = os.getenv("PROFILE_ALLOW_HEADER", "false").lower() == "true"  # honor X-Profile: 1
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Spans of the current request: [(name, start offset ms, duration ms)]. A ContextVar so work
+# submitted with contextvars.copy_context().run (e.g. the Gemini recommendation) reports too.
+_request_spans: contextvars.ContextVar[Optional[List[Tuple[str, float, float]]]] = \
+    contextvars.ContextVar("request_spans", default=None)
+_request_origin: contextvars.ContextVar[float] = contextvars.ContextVar("request_origin", default=0.0)
+
+@contextlib.contextmanager
+def span(name: str):
+    """Time a stage of the current request (no-op outside a traced request)"""
+    spans = _request_spans.get()
+    if spans is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        t1 = time.perf_counter()
+        spans.append((name, (t0 - _request_origin.get()) * 1000, (t1 - t0) * 1000))
+
+def record_span(name: str, started: float) -> None:
+    """Record a span that began at perf_counter() value `started` and ends now"""
+    spans = _request_spans.get()
+    if spans is not None:
+        now = time.perf_counter()
+        spans.append((name, (started - _request_origin.get()) * 1000, (now - started) * 1000))
+
+def begin_trace() -> List[Tuple[str, float, float]]:
+    spans: List[Tuple[str, float, float]] = []
+    _request_spans.set(spans)
+    _request_origin.set(time.perf_counter())
+    return spans
+
+def server_timing_header(spans: List[Tuple[str, float, float]], total_ms: float) -> str:
+    """Server-Timing value; repeated span names are summed (e.g. several Gemini attempts)"""
+    totals: Dict[str, float] = {}
+    for name, _, duration in list(spans):
+        totals[name] = totals.get(name, 0.0) + duration
+    parts = [f"{name};dur={ms:.1f}" for name, ms in totals.items()]
+    parts.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(parts)
+
+class StackSampler:
+    """
+    Samples one thread's Python stack every interval seconds from a background thread and
+    aggregates collapsed stacks ("outer;inner;leaf count", the flamegraph.pl / speedscope input).
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL_MS / 1000):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks: Dict[str, int] = {}
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            key = ";".join(reversed(names))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+            self.samples += 1
+
+    def stop(self) -> Dict[str, int]:
+        self._stop.set()
+        self._thread.join()
+        return self.stacks
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+def should_profile(headers: Any) -> bool:
+    if PROFILE_ALLOW_HEADER and headers.get("X-Profile", "").lower() in ("1", "true"):
+        return True
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+def write_profile(sampler: StackSampler, route: str) -> str:
+    """Write collapsed stacks to PROFILE_DIR and return the file path"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe_route = re.sub(r"[^A-Za-z0-9]+", "_", route).strip("_") or "root"
+    path = os.path.join(PROFILE_DIR, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{safe_route}_{uuid.uuid4().hex[:8]}.collapsed")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(sampler.collapsed())
+    return path
+
+# -----------------------------
+# Gemini client (rate limit, retry, circuit breaker)
+# -----------------------------
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "60"))          # 0 = unlimited
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", "1000000"))     # 0 = unlimited
+GEMINI_RATE_WAIT_MAX = float(os.getenv("GEMINI_RATE_WAIT_MAX", "10"))
+GEMINI_MAX_RETRIES = int(os.getenv("GEMINI_MAX_RETRIES", "3"))
+GEMINI_BACKOFF_BASE = float(os.getenv("GEMINI_BACKOFF_BASE", "0.5"))
+GEMINI_BACKOFF_MAX = float(os.getenv("GEMINI_BACKOFF_MAX", "8"))
+GEMINI_BREAKER_THRESHOLD = int(os.getenv("GEMINI_BREAKER_THRESHOLD", "5"))
+GEMINI_BREAKER_RESET = float(os.getenv("GEMINI_BREAKER_RESET", "30"))
+
+_retryable_gemini_errors: Optional[Tuple[type, ...]] = None
+
+def retryable_gemini_errors() -> Tuple[type, ...]:
+    """Quota and transient server errors; anything else (bad request, safety block) is not retried.
+    google.api_core (grpc, protobuf) is imported on the first failed call, not at startup."""
+    global _retryable_gemini_errors
+    if _retryable_gemini_errors is None:
+        from google.api_core import exceptions as google_exceptions
+        _retryable_gemini_errors = (
+            google_exceptions.TooManyRequests,
+            google_exceptions.ResourceExhausted,
+            google_exceptions.InternalServerError,
+            google_exceptions.BadGateway,
+            google_exceptions.ServiceUnavailable,
+            google_exceptions.GatewayTimeout,
+            google_exceptions.DeadlineExceeded,
+        )
+    return _retryable_gemini_errors
+
+def _fake_service_unavailable() -> Exception:
+    from google.api_core import exceptions as google_exceptions
+    return google_exceptions.ServiceUnavailable("fake 503")
+
+GEMINI_TOKENS_PER_IMAGE_TILE = 258  # Gemini bills images as 768x768 tiles of 258 tokens
+
+class GeminiUnavailableError(Exception):
+    """Raised without calling Gemini when the circuit is open or the rate limit wait is too long"""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at rate_per_minute, holding one minute of budget.
+
+    acquire() reserves tokens up front (the balance may go negative) and returns how long the
+    caller must sleep, so concurrent callers queue fairly instead of spinning.
+    """
+
+    def __init__(self, rate_per_minute: float, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.clock = clock
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount: float, max_wait: float) -> float:
+        """Reserve amount tokens; returns the wait in seconds or raises GeminiUnavailableError"""
+        if self.rate <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            wait = max(0.0, (amount - self.tokens) / self.rate)
+            if wait > max_wait:
+                raise GeminiUnavailableError(f"Gemini rate limit: would wait {wait:.1f}s", retry_after=wait)
+            self.tokens -= amount
+            return wait
+
+    def adjust(self, amount: float) -> None:
+        """Give back (positive) or charge (negative) tokens once the real usage is known"""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+class CircuitBreaker:
+    """closed -> open after `threshold` consecutive failures -> half-open probe after reset_timeout"""
+
+    def __init__(self, threshold: int = GEMINI_BREAKER_THRESHOLD, reset_timeout: float = GEMINI_BREAKER_RESET,
+                 clock: Callable[[], float] = time.monotonic):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            return "half_open" if self.clock() - self.opened_at >= self.reset_timeout else "open"
+
+    def allow(self) -> None:
+        """Raise GeminiUnavailableError unless a call may go through (one probe at a time when half-open)"""
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.reset_timeout - (self.clock() - self.opened_at)
+            if remaining > 0 or self.probing:
+                raise GeminiUnavailableError("Gemini circuit open", retry_after=max(remaining, 1.0))
+            self.probing = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.threshold:
+                if self.opened_at is None or self.probing:
+                    self.trips += 1
+                self.opened_at = self.clock()
+            self.probing = False
+
+    def release(self) -> None:
+        """End a half-open probe that failed for a non-transient reason (keeps the current state)"""
+        with self._lock:
+            self.probing = False
+
+def estimate_gemini_tokens(contents: Any, generation_config: Optional[Dict[str, Any]] = None) -> int:
+    """Rough pre-call token estimate (~4 chars/token, tiles per image) used to reserve TPM budget"""
+    parts = contents if isinstance(contents, list) else [contents]
+    tokens = 0
+    for part in parts:
+        if isinstance(part, str):
+            tokens += len(part) // 4 + 1
+        else:
+            size = part.size if isinstance(part, Image.Image) else (GEMINI_IMAGE_MAX_SIDE, GEMINI_IMAGE_MAX_SIDE)
+            tiles = max(1, -(-size[0] // 768)) * max(1, -(-size[1] // 768))
+            tokens += GEMINI_TOKENS_PER_IMAGE_TILE * tiles
+    tokens += int((generation_config or {}).get("max_output_tokens", 1024))
+    return tokens
+
+class GeminiClient:
+    """
+    Wraps a GenerativeModel (or FakeGeminiModel) with:
+    - request/minute and token/minute token buckets (waits up to rate_wait_max, else fails fast)
+    - exponential backoff with full jitter on 429/5xx, up to max_retries
+    - a circuit breaker that rejects calls immediately after repeated transient failures
+    Without a model it uses the shared one from get_gemini_model(), built on the first call.
+    sleep and clock (time.monotonic for the buckets and the default breaker) are injectable for tests.
+    """
+
+    def __init__(self, model: Any = None, rpm: float = GEMINI_RPM, tpm: float = GEMINI_TPM,
+                 max_retries: int = GEMINI_MAX_RETRIES, backoff_base: float = GEMINI_BACKOFF_BASE,
+                 backoff_max: float = GEMINI_BACKOFF_MAX, rate_wait_max: float = GEMINI_RATE_WAIT_MAX,
+                 breaker: Optional[CircuitBreaker] = None, sleep: Callable[[float], None] = time.sleep,
+                 clock: Callable[[], float] = time.monotonic):
+        self._model = model
+        self.requests = TokenBucket(rpm, clock)
+        self.tokens = TokenBucket(tpm, clock)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.rate_wait_max = rate_wait_max
+        self.breaker = breaker or CircuitBreaker(clock=clock)
+        self.sleep = sleep
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.rejected = 0
+        self.throttled_seconds = 0.0
+
+    @property
+    def model(self) -> Any:
+        return self._model if self._model is not None else get_gemini_model()
+
+    @model.setter
+    def model(self, model: Any) -> None:
+        self._model = model
+
+    def available(self) -> bool:
+        return self.breaker.state != "open"
+
+    def _count(self, **deltas: float) -> None:
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _admit(self, purpose: str) -> None:
+        try:
+            self.breaker.allow()
+        except GeminiUnavailableError:
+            self._count(rejected=1)
+            gemini_requests.inc(purpose=purpose, outcome="rejected")
+            raise
+
+    def _reserve(self, estimate: int, purpose: str) -> float:
+        """Take rate budget for one attempt; returns how long to wait before sending it"""
+        try:
+            wait = self.requests.acquire(1, self.rate_wait_max)
+            try:
+                wait = max(wait, self.tokens.acquire(estimate, self.rate_wait_max))
+            except GeminiUnavailableError:
+                self.requests.adjust(1)  # not sent: give the request back
+                raise
+        except GeminiUnavailableError:
+            self.breaker.release()
+            self._count(rejected=1)
+            gemini_requests.inc(purpose=purpose, outcome="rejected")
+            raise
+        if wait > 0:
+            self._count(throttled_seconds=wait)
+        self._count(calls=1)
+        return wait
+
+    def _after_error(self, e: Exception, attempt: int, purpose: str, t0: float, estimate: int) -> Optional[float]:
+        """Bookkeeping for a failed attempt: backoff delay if it should be retried, None to re-raise"""
+        gemini_request_duration.observe(time.perf_counter() - t0, purpose=purpose)
+        record_span("gemini", t0)
+        self.tokens.adjust(estimate)  # a failed attempt generated nothing; its request still counts
+        retryable = isinstance(e, retryable_gemini_errors())
+        if retryable and attempt < self.max_retries:
+            delay = self._backoff(attempt)
+            print(f"Gemini transient error ({type(e).__name__}), retry {attempt + 1} in {delay:.2f}s")
+            self._count(retries=1)
+            gemini_requests.inc(purpose=purpose, outcome="retry")
+            return delay
+        self._count(failures=1)
+        gemini_requests.inc(purpose=purpose, outcome="error")
+        if retryable:
+            self.breaker.record_failure()
+        else:
+            self.breaker.release()
+        return None
+
+    def _after_success(self, response: Any, purpose: str, t0: float, estimate: int, stream: bool) -> None:
+        # For stream=True this is the time to the response object, not to the last chunk
+        gemini_request_duration.observe(time.perf_counter() - t0, purpose=purpose)
+        record_span("gemini", t0)
+        gemini_requests.inc(purpose=purpose, outcome="ok")
+        self.breaker.record_success()
+        # Streamed responses only know their usage once fully consumed
+        usage = None if stream else getattr(getattr(response, "usage_metadata", None), "total_token_count", None)
+        if usage:
+            self.tokens.adjust(estimate - usage)
+
+    def generate_content(self, contents: Any, purpose: str = "other", **kwargs: Any) -> Any:
+        """purpose labels the call in metrics (extract / recommend); kwargs go to the model"""
+        self._admit(purpose)
+        estimate = estimate_gemini_tokens(contents, kwargs.get("generation_config"))
+        attempt = 0
+        while True:
+            wait = self._reserve(estimate, purpose)
+            if wait > 0:
+                self.sleep(wait)
+            t0 = time.perf_counter()
+            try:
+                response = self.model.generate_content(contents, **kwargs)
+            except Exception as e:
+                delay = self._after_error(e, attempt, purpose, t0, estimate)
+                if delay is None:
+                    raise
+                self.sleep(delay)
+                attempt += 1
+                continue
+            self._after_success(response, purpose, t0, estimate, bool(kwargs.get("stream")))
+            return response
+
+    async def generate_content_async(self, contents: Any, purpose: str = "other", **kwargs: Any) -> Any:
+        """generate_content on the model's generate_content_async: same limits, retries and breaker,
+        but rate-limit waits and backoff are asyncio sleeps, so no thread is held"""
+        self._admit(purpose)
+        estimate = estimate_gemini_tokens(contents, kwargs.get("generation_config"))
+        attempt = 0
+        while True:
+            wait = self._reserve(estimate, purpose)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            t0 = time.perf_counter()
+            try:
+                response = await self.model.generate_content_async(contents, **kwargs)
+            except Exception as e:
+                delay = self._after_error(e, attempt, purpose, t0, estimate)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self._after_success(response, purpose, t0, estimate, bool(kwargs.get("stream")))
+            return response
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.breaker.state,
+                "trips": self.breaker.trips,
+                "calls": self.calls,
+                "retries": self.retries,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "throttled_seconds": round(self.throttled_seconds, 3)
+            }
+
+class FakeGeminiModel:
+    """
+    Local stand-in for GenerativeModel: fixed or computed response text, injectable latency and
+    errors. `errors` is consumed first (one exception per call, None = succeed), then each call
+    fails with probability error_rate using error_factory. latency is seconds or a
+    callable(random.Random) -> seconds (see parse_latency_spec).
+    """
+
+    def __init__(self, text: Any = None, latency: Any = 0.0, error_rate: float = 0.0,
+                 errors: Optional[List[Optional[Exception]]] = None,
+                 error_factory: Callable[[], Exception] = _fake_service_unavailable,
+                 seed: Optional[int] = None, chunk_size: int = 16, chunk_latency: float = 0.0):
+        self.text = text if text is not None else json.dumps(DEFAULT_OBJ)
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.chunk_latency = chunk_latency
+        self.chunks_served = 0
+        self.error_rate = error_rate
+        self.errors = list(errors or [])
+        self.error_factory = error_factory
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _next_call(self) -> Tuple[Optional[Exception], float]:
+        with self._lock:
+            self.calls += 1
+            error = self.errors.pop(0) if self.errors else None
+            if error is None and self.error_rate and self._random.random() < self.error_rate:
+                error = self.error_factory()
+            delay = self.latency(self._random) if callable(self.latency) else self.latency
+        return error, delay
+
+    def _response(self, contents: Any, stream: bool) -> Any:
+        text = self.text(contents) if callable(self.text) else self.text
+        if stream:
+            return self._stream(text)
+        return SimpleNamespace(text=text, usage_metadata=SimpleNamespace(total_token_count=len(text) // 4 + 1))
+
+    def generate_content(self, contents: Any, **kwargs: Any) -> Any:
+        error, delay = self._next_call()
+        if delay:
+            time.sleep(delay)
+        if error is not None:
+            raise error
+        return self._response(contents, bool(kwargs.get("stream")))
+
+    async def generate_content_async(self, contents: Any, **kwargs: Any) -> Any:
+        error, delay = self._next_call()
+        if delay:
+            await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return self._response(contents, False)
+
+    def _stream(self, text: str):
+        """stream=True: chunk_size characters per chunk, chunk_latency seconds apart"""
+        for i in range(0, len(text), max(1, self.chunk_size)):
+            if i and self.chunk_latency:
+                time.sleep(self.chunk_latency)
+            with self._lock:
+                self.chunks_served += 1
+            yield SimpleNamespace(text=text[i:i + max(1, self.chunk_size)])
+
+def parse_latency_spec(spec: str) -> Any:
+    """
+    Latency distribution for FakeGeminiModel, in seconds:
+    "0.5" / "fixed:0.5", "uniform:0.2,1.5", "normal:0.8,0.2" (mean, stddev) or
+    "lognormal:0.8,0.4" (median, sigma of the underlying normal; long right tail like real APIs)
+    """
+    kind, _, params = spec.strip().partition(":")
+    if not params:
+        return float(kind)
+    args = [float(x) for x in params.split(",")]
+    if kind == "fixed":
+        return args[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(args[0], args[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(args[0], args[1]))
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(args[0]), args[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+class FakeGeminiResponder:
+    """
+    Response text for FakeGeminiModel, picked by prompt type:
+    - recommendation prompts ("Tops: [...]" / "Bottoms: [...]"): a JSON array pairing the listed ids
+    - anything else (attribute extraction): a random schema-valid attribute object
+    Canned responses override the generated ones: {"extract": text|[text], "recommend": text|[text]},
+    with $top_id, $bottom_id and $count substituted in recommendation templates.
+    """
+
+    def __init__(self, canned: Optional[Dict[str, Any]] = None, seed: Optional[int] = None):
+        self.canned = {kind: (v if isinstance(v, list) else [v]) for kind, v in (canned or {}).items()}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _prompt(contents: Any) -> str:
+        parts = contents if isinstance(contents, (list, tuple)) else [contents]
+        return "\n".join(p for p in parts if isinstance(p, str))
+
+    def __call__(self, contents: Any) -> str:
+        prompt = self._prompt(contents)
+        with self._lock:
+            if "Tops:" in prompt and "Bottoms:" in prompt:
+                return self._recommendation(prompt)
+            return self._extraction()
+
+    def _extraction(self) -> str:
+        if self.canned.get("extract"):
+            return self._random.choice(self.canned["extract"])
+        rng = self._random
+        obj = json.loads(json.dumps(DEFAULT_OBJ))
+        obj["category"].update({"main": rng.choice(["top", "bottom", "outer", "shoes"]),
+                                "sub": rng.choice(ENUMS["category_sub"]), "confidence": round(rng.uniform(0.6, 1), 2)})
+        obj["color"].update({"primary": rng.choice(ENUMS["color"]), "tone": rng.choice(ENUMS["tone"]),
+                             "confidence": round(rng.uniform(0.6, 1), 2)})
+        obj["style_tags"] = rng.sample(ENUMS["style_tags"], rng.randint(1, 3))
+        obj["scores"].update({"formality": round(rng.random(), 2), "warmth": round(rng.random(), 2),
+                              "season": rng.sample(ENUMS["season"], rng.randint(1, 3))})
+        obj["confidence"] = round(rng.uniform(0.6, 1), 2)
+        return json.dumps(obj, ensure_ascii=False)
+
+    def _recommendation(self, prompt: str) -> str:
+        def ids(label: str) -> List[str]:
+            m = re.search(label + r":\s*(\[.*?\])\s*$", prompt, re.MULTILINE)
+            try:
+                return [x["id"] for x in json.loads(m.group(1))] if m else []
+            except (ValueError, KeyError, TypeError):
+                return []
+
+        tops, bottoms = ids("Tops"), ids("Bottoms")
+        m = re.search(r"Recommend (\d+)", prompt)
+        count = int(m.group(1)) if m else 1
+        recs = []
+        for i in range(min(count, len(tops) * len(bottoms))):
+            top_id, bottom_id = tops[i % len(tops)], bottoms[(i // len(tops)) % len(bottoms)]
+            if self.canned.get("recommend"):
+                template = string.Template(self._random.choice(self.canned["recommend"]))
+                return template.safe_substitute(top_id=top_id, bottom_id=bottom_id, count=count)
+            recs.append({"top_id": top_id, "bottom_id": bottom_id, "score": round(self._random.uniform(0.6, 0.95), 2),
+                         "reasoning": "색상과 스타일이 잘 어울림", "style_description": "데일리 코디"})
+        return json.dumps(recs, ensure_ascii=False)
+
+GEMINI_FAKE_LATENCY = os.getenv("GEMINI_FAKE_LATENCY", "lognormal:0.8,0.4")
+GEMINI_FAKE_ERROR_RATE = float(os.getenv("GEMINI_FAKE_ERROR_RATE", "0"))
+GEMINI_FAKE_RESPONSES = os.getenv("GEMINI_FAKE_RESPONSES", "")  # JSON file with canned responses
+GEMINI_FAKE_SEED = os.getenv("GEMINI_FAKE_SEED")
+
+def build_fake_gemini_model() -> FakeGeminiModel:
+    """FakeGeminiModel configured from the GEMINI_FAKE_* environment variables"""
+    canned = None
+    if GEMINI_FAKE_RESPONSES:
+        with open(GEMINI_FAKE_RESPONSES, "r", encoding="utf-8") as f:
+            canned = json.load(f)
+    seed = int(GEMINI_FAKE_SEED) if GEMINI_FAKE_SEED else None
+    return FakeGeminiModel(text=FakeGeminiResponder(canned, seed), latency=parse_latency_spec(GEMINI_FAKE_LATENCY),
+                           error_rate=GEMINI_FAKE_ERROR_RATE, seed=seed)
+
+def build_gemini_model() -> Any:
+    """The GEMINI_BACKEND model; only the google backend imports and configures the SDK"""
+    if GEMINI_BACKEND == "fake":
+        print(f"Gemini backend: fake (latency={GEMINI_FAKE_LATENCY}, error_rate={GEMINI_FAKE_ERROR_RATE})")
+        return build_fake_gemini_model()
+    import google.generativeai as genai
+    genai.configure(api_key=GEMINI_API_KEY)
+    return genai.GenerativeModel(GEMINI_MODEL_NAME)
+
+_gemini_model: Optional[Any] = None
+_gemini_model_lock = threading.Lock()
+
+def get_gemini_model() -> Any:
+    """Process-wide model, built on first use; concurrent first requests build it exactly once"""
+    global _gemini_model
+    if _gemini_model is None:
+        with _gemini_model_lock:
+            if _gemini_model is None:
+                _gemini_model = build_gemini_model()
+    return _gemini_model
+
+gemini_client = GeminiClient()
 
 # -----------------------------
 # Enums
@@ -199,13 +967,19 @@ def _first_balanced_json_array(s: str) -> Optional[str]:
                     return s[start:i+1]
     return None
 
+def _starts_with_array(text: str) -> bool:
+    """True if the first bracket in text opens an array rather than an object. An extraction
+    response {"color": {"secondary": ["navy"]}, ...} must parse as the object, not ["navy"]."""
+    array_start, object_start = text.find("["), text.find("{")
+    return array_start != -1 and (object_start == -1 or array_start < object_start)
+
 def parse_json_from_text(text: str) -> Tuple[Optional[Any], str]:
     """
     Parse JSON from text, supporting both dict and list.
     Returns: (parsed_object or None, repaired_text)
     """
-    # Try to find JSON array first (for recommendations)
-    array_candidate = _first_balanced_json_array(text)
+    # Try to find JSON array first (for recommendations), unless an object starts earlier
+    array_candidate = _first_balanced_json_array(text) if _starts_with_array(text) else None
     if array_candidate:
         repaired = _repair_json_like(array_candidate)
         try:
@@ -226,6 +1000,82 @@ def parse_json_from_text(text: str) -> Tuple[Optional[Any], str]:
     except Exception:
         return None, repaired
 
+class IncrementalJsonObjectScanner:
+    """
+    Resumable _first_balanced_json_object: feed() text chunks as they stream in and get the
+    first balanced {...} substring back as soon as it closes, scanning each character once.
+    Each top-level member ("key": value) is also parsed and passed to on_field(key, value)
+    as soon as it is complete, so callers can show partial results.
+    """
+
+    def __init__(self, on_field: Optional[Callable[[str, Any], None]] = None):
+        self.on_field = on_field
+        self.text = ""
+        self.result: Optional[str] = None
+        self._pos = 0
+        self._start = -1
+        self._depth = 0   # braces only, exactly like _first_balanced_json_object
+        self._level = 0   # braces + brackets, to find top-level member boundaries
+        self._in_str = False
+        self._esc = False
+        self._member_start = 0
+
+    def _emit(self, end: int) -> None:
+        segment = self.text[self._member_start:end].strip()
+        self._member_start = end + 1
+        if not segment or self.on_field is None:
+            return
+        try:
+            member = json.loads(_repair_json_like("{" + segment + "}"))
+        except Exception:
+            return
+        for key, value in member.items():
+            self.on_field(key, value)
+
+    def feed(self, chunk: str) -> Optional[str]:
+        """Add a chunk; returns the complete object text once available (then ignores input)"""
+        if self.result is not None:
+            return self.result
+        self.text += chunk
+        s = self.text
+        for i in range(self._pos, len(s)):
+            ch = s[i]
+            if self._start == -1:
+                if ch == "{":
+                    self._start = i
+                    self._depth = self._level = 1
+                    self._member_start = i + 1
+                continue
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif ch == "\\":
+                    self._esc = True
+                elif ch == '"':
+                    self._in_str = False
+                continue
+            if ch == '"':
+                self._in_str = True
+            elif ch == "{":
+                self._depth += 1
+                self._level += 1
+            elif ch == "}":
+                self._depth -= 1
+                self._level -= 1
+                if self._depth == 0:
+                    self._emit(i)
+                    self._pos = i + 1
+                    self.result = s[self._start:i + 1]
+                    return self.result
+            elif ch == "[":
+                self._level += 1
+            elif ch == "]":
+                self._level -= 1
+            elif ch == "," and self._level == 1:
+                self._emit(i)
+        self._pos = len(s)
+        return None
+
 # -----------------------------
 # Schema validation
 # -----------------------------
@@ -323,6 +1173,121 @@ def validate_schema(obj: Dict[str, Any]) -> Tuple[bool, List[str]]:
 
     return (len(errs) == 0), errs
 
+# -----------------------------
+# Local schema repair (before asking Gemini to fix its own output)
+# -----------------------------
+SCHEMA_REPAIR_ENABLED = os.getenv("SCHEMA_REPAIR", "true").lower() == "true"
+
+CONFIDENCE_FIELDS = [
+    ("category", "confidence"), ("color", "confidence"), ("pattern", "confidence"),
+    ("material", "confidence"), ("fit", "confidence"),
+    (None, "confidence"),
+]
+# Scores may come on another scale (formality 5 of 10); only strings ("85%", "0.7") are repaired,
+# bare numbers outside [0,1] are left to validation
+SCORE_FIELDS = [("scores", "formality"), ("scores", "warmth"), ("scores", "versatility")]
+STRING_LIST_FIELDS = [("details", "closure"), ("scores", "season"), ("color", "secondary"), (None, "style_tags")]
+
+def _split_tokens(s: str) -> List[str]:
+    return [t.strip() for t in re.split(r"[,/|]", s) if t.strip()]
+
+def _repair_extra_top_keys(obj: Dict[str, Any]) -> bool:
+    extra = [k for k in obj if k not in REQUIRED_TOP_KEYS]
+    for k in extra:
+        del obj[k]
+    return bool(extra)
+
+def _repair_missing_meta(obj: Dict[str, Any]) -> bool:
+    meta = obj.get("meta")
+    if not isinstance(meta, dict):
+        obj["meta"] = dict(DEFAULT_OBJ["meta"])
+        return True
+    changed = False
+    for k, v in DEFAULT_OBJ["meta"].items():
+        if k not in meta:
+            meta[k] = v
+            changed = True
+    return changed
+
+def _repair_string_lists(obj: Dict[str, Any]) -> bool:
+    changed = False
+    for parent, key in STRING_LIST_FIELDS:
+        container = obj if parent is None else obj.get(parent)
+        if isinstance(container, dict) and isinstance(container.get(key), str):
+            container[key] = _split_tokens(container[key]) or ["unknown"]
+            changed = True
+    return changed
+
+def _repair_percent_confidences(obj: Dict[str, Any]) -> bool:
+    changed = False
+    for parent, key in CONFIDENCE_FIELDS + SCORE_FIELDS:
+        container = obj if parent is None else obj.get(parent)
+        if not isinstance(container, dict):
+            continue
+        v = container.get(key)
+        if isinstance(v, str):
+            m = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*(%?)\s*", v)
+            if not m:
+                continue
+            v = float(m.group(1)) / (100.0 if m.group(2) else 1.0)
+        elif key == "confidence" and _is_num(v) and not isinstance(v, bool) and 1.0 < float(v) <= 100.0:
+            v = float(v) / 100.0
+        if v is not container[key] and _in_01(v):
+            container[key] = round(float(v), 4)
+            changed = True
+    return changed
+
+# (rule name, fn mutating the object in place and returning True if it changed anything)
+SCHEMA_REPAIR_RULES: List[Tuple[str, Callable[[Dict[str, Any]], bool]]] = [
+    ("extra_top_keys", _repair_extra_top_keys),
+    ("missing_meta", _repair_missing_meta),
+    ("string_to_array", _repair_string_lists),
+    ("percent_confidence", _repair_percent_confidences),
+]
+
+def repair_schema(obj: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """Apply the local repair rules to a copy of obj; returns (repaired, names of rules that fired)"""
+    if not isinstance(obj, dict):
+        return obj, []
+    repaired = json.loads(json.dumps(obj))
+    applied = [name for name, rule in SCHEMA_REPAIR_RULES if rule(repaired)]
+    return repaired, applied
+
+class SchemaRepairStats:
+    """Counts schema-invalid first responses and how many were fixed without a second Gemini call"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.invalid = 0
+        self.retries_avoided = 0
+        self.retries = 0
+        self.rules = {name: 0 for name, _ in SCHEMA_REPAIR_RULES}
+
+    def record(self, applied: List[str], repaired: bool) -> None:
+        with self._lock:
+            self.invalid += 1
+            for name in applied:
+                self.rules[name] = self.rules.get(name, 0) + 1
+            if repaired:
+                self.retries_avoided += 1
+
+    def record_retry(self) -> None:
+        with self._lock:
+            self.retries += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": SCHEMA_REPAIR_ENABLED,
+                "invalid_responses": self.invalid,
+                "retries_avoided": self.retries_avoided,
+                "retries": self.retries,
+                "repair_rate": round(self.retries_avoided / self.invalid, 4) if self.invalid else 0.0,
+                "rules": dict(self.rules),
+            }
+
+schema_repair_stats = SchemaRepairStats()
+
 # -----------------------------
 # normalization helpers
 # -----------------------------
@@ -443,6 +1408,225 @@ def load_image_from_bytes(image_bytes: bytes) -> Image.Image:
     img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
     return img
 
+# Pre-inference preprocessing: what is sent to Gemini instead of the full-resolution upload
+GEMINI_IMAGE_PREPROCESS = os.getenv("GEMINI_IMAGE_PREPROCESS", "true").lower() == "true"
+GEMINI_IMAGE_MAX_SIDE = int(os.getenv("GEMINI_IMAGE_MAX_SIDE", "1024"))
+GEMINI_IMAGE_FORMAT = os.getenv("GEMINI_IMAGE_FORMAT", "jpeg").lower()  # jpeg | webp
+GEMINI_IMAGE_TARGET_KB = int(os.getenv("GEMINI_IMAGE_TARGET_KB", "200"))
+GEMINI_IMAGE_CROP = os.getenv("GEMINI_IMAGE_CROP", "false").lower() == "true"
+
+class ImagePreprocessStats:
+    """Aggregate per-stage timings and byte savings of preprocess_image"""
+
+    STAGES = ("decode", "crop", "resize", "orient", "encode")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.stage_ms = {stage: 0.0 for stage in self.STAGES}
+
+    def record(self, report: Dict[str, Any]) -> None:
+        with self._lock:
+            self.count += 1
+            self.bytes_in += report["bytes_in"]
+            self.bytes_out += report["bytes_out"]
+            for stage, ms in report["stage_ms"].items():
+                self.stage_ms[stage] += ms
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "count": self.count,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "savings_ratio": round(1 - self.bytes_out / self.bytes_in, 4) if self.bytes_in else 0.0,
+                "avg_stage_ms": {
+                    stage: round(total / self.count, 2) if self.count else 0.0
+                    for stage, total in self.stage_ms.items()
+                }
+            }
+
+image_preprocess_stats = ImagePreprocessStats()
+
+# Same mapping as PIL.ImageOps.exif_transpose
+EXIF_ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+def _to_rgb(img: Image.Image) -> Image.Image:
+    """Convert to RGB, flattening transparency onto white instead of black"""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        rgba = img.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+class DecodedImage:
+    """
+    An upload decoded once and shared by the dHash, Gemini preprocessing and thumbnail variants.
+    Consumers must not modify `image` in place (convert/copy first). release() drops the bitmap
+    once the Gemini request is built, so it is not held while waiting for the response.
+    """
+
+    def __init__(self, image: Image.Image, orientation: int, size_in: Tuple[int, int], decode_ms: float,
+                 bytes_in: int = 0):
+        self.image: Optional[Image.Image] = image
+        self.orientation = orientation
+        self.size_in = size_in
+        self.decode_ms = decode_ms
+        self.bytes_in = bytes_in  # size of the encoded source
+
+    def release(self) -> None:
+        self.image = None
+
+def decode_image(image_bytes: Any, max_side: int) -> DecodedImage:
+    """Decode and bound the long side to max_side right away (JPEG via DCT scaling), so only the
+    bounded bitmap outlives the call. Crops (GEMINI_IMAGE_CROP) are then taken from that bitmap.
+    image_bytes may also be a binary file object positioned at the start, read incrementally."""
+    t0 = time.perf_counter()
+    if isinstance(image_bytes, (bytes, bytearray)):
+        bytes_in = len(image_bytes)
+        image_bytes = io.BytesIO(image_bytes)
+    else:
+        bytes_in = image_bytes.seek(0, os.SEEK_END)
+        image_bytes.seek(0)
+    img = Image.open(image_bytes)
+    size_in = img.size
+    if img.format == "JPEG":
+        img.draft("RGB", (max_side, max_side))  # DCT scaling: decode at 1/2, 1/4 or 1/8 size
+    orientation = img.getexif().get(0x0112, 1)
+    img.load()
+    if img.mode not in ("RGB", "RGBA", "L", "LA"):  # reduce() does not take palette/CMYK images
+        img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+    factor = max(img.size) // max_side
+    if factor >= 2:
+        img = img.reduce(factor)  # fast integer box downscale
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.Resampling.BICUBIC)
+    return DecodedImage(img, orientation, size_in, (time.perf_counter() - t0) * 1000, bytes_in)
+
+def _garment_bbox(img: Image.Image, threshold: int = 24, margin: float = 0.05) -> Optional[Tuple[int, int, int, int]]:
+    """Bounding box of pixels that differ from the (corner-sampled) background color"""
+    small = img.copy()
+    small.thumbnail((256, 256))
+    w, h = small.size
+    corners = [small.getpixel((0, 0)), small.getpixel((w - 1, 0)), small.getpixel((0, h - 1)), small.getpixel((w - 1, h - 1))]
+    background = tuple(sorted(c[i] for c in corners)[1] for i in range(3))  # robust to one odd corner
+
+    diff = ImageChops.difference(small, Image.new("RGB", small.size, background)).convert("L")
+    box = diff.point(lambda v: 255 if v > threshold else 0).getbbox()
+    if box is None:
+        return None
+    left, top, right, bottom = box
+    if (right - left) * (bottom - top) < 0.1 * w * h:
+        return None  # too small to be the garment; keep the full frame
+
+    sx, sy = img.width / w, img.height / h
+    pad_x, pad_y = (right - left) * margin, (bottom - top) * margin
+    return (
+        max(0, int((left - pad_x) * sx)),
+        max(0, int((top - pad_y) * sy)),
+        min(img.width, int((right + pad_x) * sx) + 1),
+        min(img.height, int((bottom + pad_y) * sy) + 1),
+    )
+
+def _encode_to_target(img: Image.Image, fmt: str, target_bytes: int) -> bytes:
+    """Encode with the highest quality (40-90) whose output fits target_bytes"""
+    pil_format = "WEBP" if fmt == "webp" else "JPEG"
+
+    def encode(quality: int) -> bytes:
+        buf = io.BytesIO()
+        img.save(buf, format=pil_format, quality=quality, optimize=pil_format == "JPEG")
+        return buf.getvalue()
+
+    best = encode(90)
+    if len(best) <= target_bytes:
+        return best
+    lo, hi = 40, 89
+    best = encode(lo)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        data = encode(mid)
+        if len(data) <= target_bytes:
+            lo, best = mid, data
+        else:
+            hi = mid - 1
+    return best
+
+def preprocess_image(image_bytes: Optional[bytes], max_side: int = GEMINI_IMAGE_MAX_SIDE, fmt: str = GEMINI_IMAGE_FORMAT,
+                     target_kb: int = GEMINI_IMAGE_TARGET_KB, crop: bool = GEMINI_IMAGE_CROP,
+                     decoded: Optional[DecodedImage] = None) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Bound the longest side, fix EXIF orientation, optionally crop to the garment and
+    re-encode to a size-targeted JPEG/WebP. decoded: the upload's shared decode, if any
+    (image_bytes is then not needed). Returns (blob part for generate_content, report with per-stage timings and byte counts).
+    """
+    stage_ms: Dict[str, float] = {}
+    if decoded is None or decoded.image is None:
+        decoded = decode_image(image_bytes, max_side)
+    t = time.perf_counter()
+
+    def lap(stage: str) -> None:
+        nonlocal t
+        now = time.perf_counter()
+        stage_ms[stage] = round((now - t) * 1000, 2)
+        t = now
+
+    size_in, orientation = decoded.size_in, decoded.orientation
+    img = _to_rgb(decoded.image)  # always a new image, the shared decode stays untouched
+    lap("decode")
+    stage_ms["decode"] = round(stage_ms["decode"] + decoded.decode_ms, 2)
+
+    # Crop and resize before applying EXIF orientation so the rotation runs on the small image
+    if crop:
+        box = _garment_bbox(img)
+        if box is not None:
+            img = img.crop(box)
+    lap("crop")
+
+    factor = max(img.size) // max_side
+    if factor >= 2:
+        img = img.reduce(factor)  # fast integer box downscale
+    if max(img.size) > max_side:
+        img.thumbnail((max_side, max_side), Image.Resampling.BICUBIC)
+    lap("resize")
+
+    transpose = EXIF_ORIENTATION_TRANSPOSE.get(orientation)
+    if transpose is not None:
+        img = img.transpose(transpose)
+    lap("orient")
+
+    data = _encode_to_target(img, fmt, target_kb * 1024)
+    lap("encode")
+
+    report = {
+        "stage_ms": stage_ms,
+        "bytes_in": decoded.bytes_in,
+        "bytes_out": len(data),
+        "size_in": list(size_in),
+        "size_out": list(img.size),
+    }
+    image_preprocess_stats.record(report)
+    return {"mime_type": "image/webp" if fmt == "webp" else "image/jpeg", "data": data}, report
+
+def prepare_image_for_gemini(image_bytes: Optional[bytes], decoded: Optional[DecodedImage] = None) -> Any:
+    """Image part for generate_content: preprocessed blob, or the decoded image if disabled"""
+    if not GEMINI_IMAGE_PREPROCESS:
+        return load_image_from_bytes(image_bytes)
+    part, report = preprocess_image(image_bytes, decoded=decoded)
+    print(f"Image preprocess: {report['size_in']} -> {report['size_out']}, "
+          f"{report['bytes_in']} -> {report['bytes_out']} bytes, stages(ms)={report['stage_ms']}")
+    return part
+
 def build_retry_prompt(errors: List[str]) -> str:
     return f"""Fix your output to be VALID JSON and match the schema EXACTLY.
 
@@ -462,134 +1646,1735 @@ MUST:
 Return corrected JSON ONLY.
 """
 
-def generate_with_gemini(image: Image.Image, prompt: str) -> str:
+# Read the first extraction response as a stream and stop at the end of the JSON object
+GEMINI_STREAM_EXTRACTION = os.getenv("GEMINI_STREAM_EXTRACTION", "false").lower() == "true"
+
+def generate_with_gemini(image: Any, prompt: str) -> str:
     """Generate response using Gemini API"""
     try:
-        response = model.generate_content([prompt, image])
+        response = gemini_client.generate_content([prompt, image], purpose="extract")
         return response.text
+    except GeminiUnavailableError:
+        raise
     except Exception as e:
         raise Exception(f"Gemini API error: {str(e)}")
 
-def extract_attributes(image_bytes: bytes, retry_on_schema_fail: bool = True) -> Dict[str, Any]:
-    """Extract clothing attributes from image"""
-    image = load_image_from_bytes(image_bytes)
-    
+def generate_with_gemini_streaming(image: Any, prompt: str,
+                                   on_field: Optional[Callable[[str, Any], None]] = None) -> str:
+    """Stream the response and stop reading as soon as the first JSON object is complete"""
+    scanner = IncrementalJsonObjectScanner(on_field)
+    try:
+        response = gemini_client.generate_content([prompt, image], purpose="extract", stream=True)
+        for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:  # chunk without text parts (e.g. only a finish reason)
+                continue
+            if scanner.feed(text) is not None:
+                break
+    except GeminiUnavailableError:
+        raise
+    except Exception as e:
+        raise Exception(f"Gemini API error: {str(e)}")
+    return scanner.result or scanner.text
+
+async def generate_with_gemini_async(image: Any, prompt: str) -> str:
+    """generate_with_gemini on the async client"""
+    try:
+        response = await gemini_client.generate_content_async([prompt, image], purpose="extract")
+        return response.text
+    except GeminiUnavailableError:
+        raise
+    except Exception as e:
+        raise Exception(f"Gemini API error: {str(e)}")
+
+def run_gemini_steps(steps: Any, call: Callable[[str], str]) -> Any:
+    """Drive a steps generator: send each yielded prompt to call(), feed back the text or the error"""
+    try:
+        prompt = next(steps)
+        while True:
+            try:
+                text = call(prompt)
+            except Exception as e:
+                prompt = steps.throw(e)
+            else:
+                prompt = steps.send(text)
+    except StopIteration as done:
+        return done.value
+
+def _advance_steps(steps: Any, method: str, arg: Any = None) -> Tuple[bool, Any]:
+    """One generator step as (finished, value); StopIteration cannot cross an asyncio future"""
+    try:
+        return False, (steps.send(arg) if method == "send" else steps.throw(arg))
+    except StopIteration as done:
+        return True, done.value
+
+async def run_gemini_steps_async(steps: Any, call: Callable[[str], Any]) -> Any:
+    """
+    run_gemini_steps with an awaitable call(). The CPU work between calls (pre-filtering,
+    parsing) runs in the default thread pool; only the Gemini wait stays on the event loop.
+    """
+    finished, value = await asyncio.to_thread(_advance_steps, steps, "send")
+    while not finished:
+        try:
+            text = await call(value)
+        except Exception as e:
+            finished, value = await asyncio.to_thread(_advance_steps, steps, "throw", e)
+        else:
+            finished, value = await asyncio.to_thread(_advance_steps, steps, "send", text)
+    return value
+
+def extract_attributes(image_bytes: Optional[bytes], retry_on_schema_fail: bool = True, stream: Optional[bool] = None,
+                       on_field: Optional[Callable[[str, Any], None]] = None,
+                       decoded: Optional[DecodedImage] = None) -> Dict[str, Any]:
+    """Extract clothing attributes from image (stream: first response read incrementally, see
+    GEMINI_STREAM_EXTRACTION; on_field receives raw top-level fields as they arrive).
+    image_bytes may be None when decoded is given, see UploadedImage.bytes_for."""
+    with span("preprocess"):
+        image = prepare_image_for_gemini(image_bytes, decoded)
+    if decoded is not None:
+        decoded.release()  # not held while waiting on Gemini
+    streaming = stream if stream is not None else GEMINI_STREAM_EXTRACTION
+
+    def call(prompt: str) -> str:
+        # Only the first response is streamed; the retry prompt is answered in one piece
+        if streaming and prompt == USER_PROMPT:
+            return generate_with_gemini_streaming(image, prompt, on_field)
+        return generate_with_gemini(image, prompt)
+    return run_gemini_steps(extraction_steps(retry_on_schema_fail), call)
+
+async def extract_attributes_async(image_bytes: Optional[bytes], retry_on_schema_fail: bool = True,
+                                   decoded: Optional[DecodedImage] = None) -> Dict[str, Any]:
+    """extract_attributes awaiting generate_content_async (preprocessing runs in a worker thread)"""
+    with span("preprocess"):
+        image = await asyncio.to_thread(prepare_image_for_gemini, image_bytes, decoded)
+    if decoded is not None:
+        decoded.release()
+    return await run_gemini_steps_async(extraction_steps(retry_on_schema_fail),
+                                        lambda prompt: generate_with_gemini_async(image, prompt))
+
+def extraction_steps(retry_on_schema_fail: bool = True):
+    """
+    Parse / validate / repair / retry logic of an extraction, without I/O: yields each prompt,
+    receives Gemini's response text and returns the normalized attributes.
+    """
     # First try
-    raw1 = generate_with_gemini(image, USER_PROMPT)
-    parsed1, repaired1 = parse_json_from_text(raw1)
+    raw1 = yield USER_PROMPT
+    with span("parse"):
+        parsed1, repaired1 = parse_json_from_text(raw1)
 
     if parsed1 is None:
         out = json.loads(json.dumps(DEFAULT_OBJ))
         out["meta"]["notes"] = f"JSON_PARSE_FAILED. repaired_head={repaired1[:160]}"
         out["confidence"] = 0.1
+        extraction_outcomes.inc(outcome="parse_failed")
         return out
 
     ok1, errs1 = validate_schema(parsed1)
     if ok1:
+        extraction_outcomes.inc(outcome="valid")
         return normalize(parsed1)
 
+    # Local repair: most schema errors are mechanical and do not need a second round trip
+    if SCHEMA_REPAIR_ENABLED:
+        fixed1, applied = repair_schema(parsed1)
+        ok_fixed, errs_fixed = validate_schema(fixed1) if applied else (False, errs1)
+        schema_repair_stats.record(applied, ok_fixed)
+        if ok_fixed:
+            print(f"Schema repaired locally: {applied}")
+            extraction_outcomes.inc(outcome="repaired")
+            return normalize(fixed1)
+        if applied:
+            parsed1, errs1 = fixed1, errs_fixed
+
     # Retry
     if retry_on_schema_fail:
+        schema_repair_stats.record_retry()
         prompt2 = build_retry_prompt(errs1)
-        raw2 = generate_with_gemini(image, prompt2)
+        raw2 = yield prompt2
         parsed2, repaired2 = parse_json_from_text(raw2)
 
         if parsed2 is None:
             out = json.loads(json.dumps(DEFAULT_OBJ))
             out["meta"]["notes"] = f"RETRY_JSON_PARSE_FAILED. repaired_head={repaired2[:160]}"
             out["confidence"] = 0.1
+            extraction_outcomes.inc(outcome="retry_parse_failed")
             return out
 
         ok2, errs2 = validate_schema(parsed2)
+        if not ok2 and SCHEMA_REPAIR_ENABLED:
+            fixed2, applied2 = repair_schema(parsed2)
+            if applied2:
+                parsed2 = fixed2
+                ok2, errs2 = validate_schema(parsed2)
         if ok2:
+            extraction_outcomes.inc(outcome="retry_valid")
             return normalize(parsed2)
 
         out = normalize(parsed2)
         out["meta"]["notes"] = (out["meta"]["notes"] or "")
         out["meta"]["notes"] = (out["meta"]["notes"] + f" | SCHEMA_INVALID_AFTER_RETRY: {errs2[:3]}")[:300]
+        extraction_outcomes.inc(outcome="retry_invalid")
         return out
 
     # no retry
     out = normalize(parsed1)
     out["meta"]["notes"] = (out["meta"]["notes"] or "")
     out["meta"]["notes"] = (out["meta"]["notes"] + f" | SCHEMA_INVALID_NO_RETRY: {errs1[:3]}")[:300]
+    extraction_outcomes.inc(outcome="invalid_no_retry")
     return out
 
 # -----------------------------
-# Wardrobe & Recommendation Functions
+# Extraction cache (content-addressed)
 # -----------------------------
-def load_wardrobe_items() -> List[Dict[str, Any]]:
-    """Load all clothing items from extracted_attributes/ folder"""
-    items = []
-    output_dir = "extracted_attributes"
-    
-    if not os.path.exists(output_dir):
-        return items
-    
-    try:
-        for filename in os.listdir(output_dir):
-            if filename.endswith('.json'):
-                filepath = os.path.join(output_dir, filename)
-                try:
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        attributes = json.load(f)
-                        item_id = filename.replace('.json', '')
-                        
-                        # Check if corresponding image exists
-                        image_extensions = ['.jpg', '.jpeg', '.png', '.gif', '.webp']
-                        image_path = None
-                        for ext in image_extensions:
-                            potential_image = os.path.join(output_dir, f"{item_id}{ext}")
-                            if os.path.exists(potential_image):
-                                image_path = f"/api/images/{item_id}{ext}"
-                                break
-                        
-                        items.append({
-                            "id": item_id,
-                            "filename": filename,
-                            "attributes": attributes,
-                            "image_url": image_path
-                        })
-                except Exception as e:
-                    print(f"Error loading {filename}: {e}")
-                    continue
-    except Exception as e:
-        print(f"Error reading wardrobe directory: {e}")
-    
-    return items
+EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", "extraction_cache")
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE", "true").lower() == "true"
 
-# -----------------------------
-# Color Harmony Functions
-# -----------------------------
-COLOR_WHEEL = {
-    "black": 0, "white": 0, "gray": 0,
-    "red": 0, "orange": 30, "yellow": 60,
-    "green": 120, "skyblue": 180, "blue": 210,
-    "navy": 240, "purple": 270, "pink": 300,
-    "beige": 45, "brown": 25, "khaki": 90,
-    "cream": 50, "other": None, "unknown": None
-}
+# Changing the prompt, enums or model invalidates every cached entry
+EXTRACTION_CACHE_VERSION = hashlib.sha256(
+    json.dumps([GEMINI_MODEL_NAME, USER_PROMPT, ENUMS], sort_keys=True, ensure_ascii=False).encode("utf-8")
+).hexdigest()[:16]
 
-def get_color_hue(color: str) -> Optional[float]:
-    """Get hue value for a color (0-360 degrees)"""
-    return COLOR_WHEEL.get(color.lower(), None)
+def _is_degraded_extraction(attributes: Dict[str, Any]) -> bool:
+    """True for fallback outputs (parse failure / schema still invalid) that should not be cached"""
+    notes = (attributes.get("meta") or {}).get("notes") or ""
+    return "JSON_PARSE_FAILED" in notes or "SCHEMA_INVALID" in notes
 
-def calculate_color_harmony(color1: str, color2: str) -> float:
+class ExtractionCache:
     """
-    Calculate color harmony score between two colors (0.0-1.0)
-    Returns higher scores for complementary, analogous, or monochromatic combinations
+    SHA-256(image bytes) -> normalized attributes, persisted as one JSON file per entry
+    under EXTRACTION_CACHE_DIR/<version>/ so re-uploads of the same image skip Gemini.
     """
-    hue1 = get_color_hue(color1)
-    hue2 = get_color_hue(color2)
-    
-    # Neutral colors (black, white, gray) go with everything
-    if color1.lower() in ["black", "white", "gray"] or color2.lower() in ["black", "white", "gray"]:
-        return 0.8
-    
-    # Unknown or other colors
-    if hue1 is None or hue2 is None:
-        return 0.5
-    
+
+    def __init__(self, cache_dir: str = EXTRACTION_CACHE_DIR, version: str = EXTRACTION_CACHE_VERSION):
+        self.cache_dir = os.path.join(cache_dir, version)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, digest[:2], f"{digest}.json")
+
+    def get(self, digest: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._path(digest), 'r', encoding='utf-8') as f:
+                attributes = json.load(f)
+        except FileNotFoundError:
+            attributes = None
+        except Exception as e:
+            print(f"Error reading extraction cache entry {digest}: {e}")
+            attributes = None
+        with self._lock:
+            if attributes is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return attributes
+
+    def put(self, digest: str, attributes: Dict[str, Any]) -> None:
+        path = self._path(digest)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(attributes, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing extraction cache entry {digest}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "version": os.path.basename(self.cache_dir)
+            }
+
+extraction_cache = ExtractionCache()
+
+def extract_attributes_cached(upload: "UploadedImage", on_field: Optional[Callable[[str, Any], None]] = None,
+                              decoded: Optional[DecodedImage] = None) -> Tuple[Dict[str, Any], bool]:
+    """extract_attributes with the content-addressed cache; returns (attributes, cache_hit).
+    Passing on_field switches the Gemini call to streaming."""
+    stream = True if on_field is not None else None
+    if not EXTRACTION_CACHE_ENABLED:
+        return extract_attributes(upload.bytes_for(decoded), stream=stream, on_field=on_field, decoded=decoded), False
+
+    digest = upload.digest
+    cached = extraction_cache.get(digest)
+    if cached is not None:
+        return cached, True
+
+    attributes = extract_attributes(upload.bytes_for(decoded), stream=stream, on_field=on_field, decoded=decoded)
+    if not _is_degraded_extraction(attributes):
+        extraction_cache.put(digest, attributes)
+    return attributes, False
+
+async def extract_attributes_cached_async(upload: "UploadedImage",
+                                          decoded: Optional[DecodedImage] = None) -> Tuple[Dict[str, Any], bool]:
+    """extract_attributes_cached for the async serving path (hashing and cache file I/O in worker threads)"""
+    if not EXTRACTION_CACHE_ENABLED:
+        return await extract_attributes_async(await asyncio.to_thread(upload.bytes_for, decoded), decoded=decoded), False
+
+    digest = await asyncio.to_thread(lambda: upload.digest)
+    cached = await asyncio.to_thread(extraction_cache.get, digest)
+    if cached is not None:
+        return cached, True
+
+    attributes = await extract_attributes_async(await asyncio.to_thread(upload.bytes_for, decoded), decoded=decoded)
+    if not _is_degraded_extraction(attributes):
+        await asyncio.to_thread(extraction_cache.put, digest, attributes)
+    return attributes, False
+
+# -----------------------------
+# Wardrobe & Recommendation Functions
+# -----------------------------
+OUTPUT_DIR = "extracted_attributes"
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp']
+
+# How often (seconds) the store may stat the directory to pick up changes made by other processes
+WARDROBE_REFRESH_INTERVAL = float(os.getenv("WARDROBE_REFRESH_INTERVAL", "2.0"))
+
+# Columnar mmap snapshot shared by worker processes (see WardrobeSnapshot)
+WARDROBE_SNAPSHOT_ENABLED = os.getenv("WARDROBE_SNAPSHOT", "true").lower() == "true"
+
+# Saves are appended to a delta log next to the snapshot that other processes replay; once
+# the log passes this size the snapshot is rebuilt in the background and the log starts over
+WARDROBE_DELTA_COMPACT_BYTES = int(os.getenv("WARDROBE_DELTA_COMPACT_KB", "1024")) * 1024
+
+def _image_url(item_id: str, ext: Optional[str], namespace: str = "") -> Optional[str]:
+    """URL of an item's image. <img> cannot send headers: with NAMESPACE_QUERY_PARAM the namespace goes
+    in the query, otherwise the gateway sets the header on image requests like on any other"""
+    if not ext:
+        return None
+    if namespace and NAMESPACE_QUERY_PARAM:
+        return f"/api/images/{item_id}{ext}?{NAMESPACE_PARAM}={namespace}"
+    return f"/api/images/{item_id}{ext}"
+
+def _matches_filters(item: Dict[str, Any], category: str, season: Optional[str], formality: Optional[float]) -> bool:
+    """Reference (dict-based) version of the filters applied by WardrobeStore.select"""
+    attrs = item.get("attributes", {})
+    if attrs.get("category", {}).get("main") != category:
+        return False
+    if season and season.lower() not in attrs.get("scores", {}).get("season", []):
+        return False
+    if formality is not None and abs(attrs.get("scores", {}).get("formality", 0.5) - formality) > 0.3:
+        return False
+    return True
+
+def _matches_query(item: Dict[str, Any], category: Optional[str], colors: Optional[List[str]],
+                   season: Optional[str], formality_min: Optional[float], formality_max: Optional[float],
+                   style: Optional[str]) -> bool:
+    """Reference (dict-based) version of the filters applied by WardrobeStore.query"""
+    attrs = item.get("attributes", {})
+    scores = attrs.get("scores", {})
+    if category is not None and attrs.get("category", {}).get("main") != category:
+        return False
+    if colors and _color_index(attrs.get("color", {}).get("primary", "unknown")) not in {_color_index(c) for c in colors}:
+        return False
+    if season and season.lower() not in scores.get("season", []):
+        return False
+    if style and style not in attrs.get("style_tags", []):
+        return False
+    formality = scores.get("formality", 0.5)
+    if formality_min is not None and not formality >= formality_min:
+        return False
+    if formality_max is not None and not formality <= formality_max:
+        return False
+    return True
+
+def wardrobe_attributes_error(attributes: Any) -> Optional[str]:
+    """
+    Why a stored attributes JSON cannot be indexed, or None. Only checks the fields the
+    filters and scoring read; everything else may be missing (older files).
+    """
+    if not isinstance(attributes, dict):
+        return f"expected an object, got {type(attributes).__name__}"
+    for key in ("category", "color", "scores"):
+        if not isinstance(attributes.get(key, {}), dict):
+            return f"'{key}' is not an object"
+    scores = attributes.get("scores", {})
+    for name, values in (("style_tags", attributes.get("style_tags", [])), ("scores.season", scores.get("season", []))):
+        if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+            return f"'{name}' is not a list of strings"
+    formality = scores.get("formality", 0.5)
+    if isinstance(formality, bool) or not isinstance(formality, (int, float)):
+        return "'scores.formality' is not a number"
+    return None
+
+class WardrobeStore:
+    """
+    Process-wide in-memory index of extracted_attributes/ (or of one namespace's directory,
+    see WardrobeNamespaces).
+
+    Backed by a WardrobeSnapshot (mmap) when possible: a process whose directory state
+    matches the snapshot starts without parsing any JSON file, and item dicts are decoded
+    lazily on first access. Otherwise the directory is scanned with a single os.scandir
+    pass, re-parsing only new or modified JSON files, and the snapshot is rewritten.
+    The directory is re-checked only when its mtime changes. Items saved through this
+    store are added to the in-memory index directly and appended to a delta log
+    (.snapshot/wardrobe.delta.jsonl, like PhashIndex's phash.jsonl): other processes replay
+    the log instead of rescanning, and the snapshot is rebuilt from memory in the background
+    once the log passes WARDROBE_DELTA_COMPACT_KB, so a save never costs O(wardrobe size).
+    """
+
+    def __init__(self, output_dir: str = OUTPUT_DIR, refresh_interval: float = WARDROBE_REFRESH_INTERVAL,
+                 use_snapshot: bool = WARDROBE_SNAPSHOT_ENABLED, namespace: str = ""):
+        self.output_dir = output_dir
+        self.namespace = namespace
+        self.refresh_interval = refresh_interval
+        self.snapshot_path = os.path.join(output_dir, ".snapshot", "wardrobe.snap") if use_snapshot else None
+        self.delta_path = os.path.join(output_dir, ".snapshot", "wardrobe.delta.jsonl") if use_snapshot else None
+        self._lock = threading.Lock()
+        self._snap: Optional[WardrobeSnapshot] = None
+        self._ids: List[str] = []
+        self._row_of: Dict[str, int] = {}
+        # Category/feature columns aligned with _ids: views of the snapshot columns, copied
+        # on the first add(); _vocab may grow past the snapshot's for added items
+        self._columns: Dict[str, np.ndarray] = {}
+        self._vocab: Optional[OutfitFeatureVocab] = None
+        self._json_mtimes: Dict[str, int] = {}
+        self._image_exts: Dict[str, Optional[str]] = {}
+        # Materialized items (every item when there is no snapshot)
+        self._items: Dict[str, Dict[str, Any]] = {}
+        self._dir_mtime: Optional[int] = None
+        self._last_check = 0.0
+        self._loaded = False
+        # Position in the delta log (inode, bytes of complete lines read)
+        self._delta_inode: Optional[int] = None
+        self._delta_offset = 0
+        self._compacting = False
+
+    def _item(self, item_id: str) -> Optional[Dict[str, Any]]:
+        """Return (materializing from the snapshot if needed) one item; caller holds the lock"""
+        item = self._items.get(item_id)
+        if item is None and self._snap is not None:
+            row = self._row_of.get(item_id)
+            if row is None:
+                return None
+            item = {
+                "id": item_id,
+                "filename": f"{item_id}.json",
+                "attributes": self._snap.attributes(row),
+                "image_url": _image_url(item_id, self._image_exts.get(item_id), self.namespace)
+            }
+            self._items[item_id] = item
+        return item
+
+    def _clear(self) -> None:
+        self._snap = None
+        self._ids = []
+        self._row_of = {}
+        self._columns = {}
+        self._vocab = None
+        self._json_mtimes = {}
+        self._image_exts = {}
+        self._items = {}
+        self._dir_mtime = None
+
+    def _adopt(self, snap: "WardrobeSnapshot") -> None:
+        """Switch to a snapshot, keeping materialized items whose JSON did not change"""
+        ids = snap.ids()
+        json_mtimes = dict(zip(ids, snap.columns["json_mtime"].tolist()))
+        image_exts = {
+            item_id: (IMAGE_EXTENSIONS[e] if e >= 0 else None)
+            for item_id, e in zip(ids, snap.columns["image_ext"].tolist())
+        }
+        items = {}
+        for item_id, item in self._items.items():
+            if item_id in json_mtimes and json_mtimes[item_id] == self._json_mtimes.get(item_id):
+                item["image_url"] = _image_url(item_id, image_exts[item_id], self.namespace)
+                items[item_id] = item
+
+        self._snap = snap
+        self._ids = ids
+        self._row_of = {item_id: row for row, item_id in enumerate(ids)}
+        self._columns = {name: snap.columns[name] for name in ("category",) + WardrobeSnapshot.FEATURE_COLUMNS}
+        self._vocab = OutfitFeatureVocab(OutfitFeatureVocab.tokens(snap.vocab.style_bits),
+                                         OutfitFeatureVocab.tokens(snap.vocab.season_bits))
+        self._json_mtimes = json_mtimes
+        self._image_exts = image_exts
+        self._items = items
+        self._dir_mtime = snap.dir_mtime
+
+    def _scan(self, dir_mtime: int) -> None:
+        """Scan the directory once, re-parsing only new or changed JSON files"""
+        json_entries: Dict[str, os.DirEntry] = {}
+        image_exts: Dict[str, str] = {}
+        try:
+            with os.scandir(self.output_dir) as it:
+                for entry in it:
+                    item_id, ext = os.path.splitext(entry.name)
+                    if ext == '.json':
+                        json_entries[item_id] = entry
+                    elif ext in IMAGE_EXTENSIONS:
+                        # Keep the same priority order as IMAGE_EXTENSIONS
+                        current = image_exts.get(item_id)
+                        if current is None or IMAGE_EXTENSIONS.index(ext) < IMAGE_EXTENSIONS.index(current):
+                            image_exts[item_id] = ext
+        except Exception as e:
+            print(f"Error reading wardrobe directory: {e}")
+            return
+
+        # (item_id, source, json_mtime, image_ext); source is a snapshot row or an attributes dict
+        rows: List[Tuple[str, Any, int, Optional[str]]] = []
+        fresh: Dict[str, Dict[str, Any]] = {}
+        for item_id in sorted(json_entries):
+            entry = json_entries[item_id]
+            try:
+                mtime = entry.stat().st_mtime_ns
+            except OSError:
+                continue
+
+            if self._json_mtimes.get(item_id) == mtime:
+                if item_id in self._row_of:
+                    rows.append((item_id, self._row_of[item_id], mtime, image_exts.get(item_id)))
+                    continue
+                if item_id in self._items:
+                    rows.append((item_id, self._items[item_id]["attributes"], mtime, image_exts.get(item_id)))
+                    continue
+
+            try:
+                with open(entry.path, 'r', encoding='utf-8') as f:
+                    attributes = json.load(f)
+            except Exception as e:
+                print(f"Error loading {entry.name}: {e}")
+                continue
+            error = wardrobe_attributes_error(attributes)
+            if error:
+                print(f"Skipping {entry.name}: {error}")
+                continue
+            fresh[item_id] = attributes
+            rows.append((item_id, attributes, mtime, image_exts.get(item_id)))
+
+        if self.snapshot_path:
+            try:
+                data = WardrobeSnapshot.build(rows, dir_mtime, base=self._snap)
+            except ValueError as e:
+                print(f"Wardrobe snapshot disabled: {e}")
+            else:
+                self._adopt(WardrobeSnapshot.save(data, self.snapshot_path))
+                self._write_delta(b"")
+                for item_id, attributes in fresh.items():
+                    if item_id not in self._row_of:
+                        continue  # dropped by WardrobeSnapshot.build
+                    self._items[item_id] = {
+                        "id": item_id,
+                        "filename": f"{item_id}.json",
+                        "attributes": attributes,
+                        "image_url": _image_url(item_id, self._image_exts.get(item_id), self.namespace)
+                    }
+                return
+
+        # No snapshot: keep every item materialized
+        items = {}
+        for item_id, source, _, ext in rows:
+            attributes = self._snap.attributes(source) if isinstance(source, int) else source
+            items[item_id] = {
+                "id": item_id,
+                "filename": f"{item_id}.json",
+                "attributes": attributes,
+                "image_url": _image_url(item_id, ext, self.namespace)
+            }
+        self._snap = None
+        self._ids = [row[0] for row in rows]
+        self._row_of = {}
+        self._columns = {}
+        self._vocab = None
+        self._json_mtimes = {row[0]: row[2] for row in rows}
+        self._image_exts = {row[0]: row[3] for row in rows}
+        self._items = items
+        self._dir_mtime = dir_mtime
+
+    def _sync_delta(self) -> None:
+        """Apply delta log entries that continue from the current directory state; caller holds the lock"""
+        try:
+            with open(self.delta_path, "rb") as f:
+                st = os.fstat(f.fileno())
+                if st.st_ino != self._delta_inode or st.st_size < self._delta_offset:
+                    self._delta_inode, self._delta_offset = st.st_ino, 0  # rewritten since the last read
+                f.seek(self._delta_offset)
+                data = f.read()
+        except OSError:
+            return
+        # A line without its newline is still being appended; it is read again next time
+        end = data.rfind(b"\n") + 1
+        self._delta_offset += end
+        for line in data[:end].splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("prev") != self._dir_mtime:
+                continue  # already applied (e.g. our own save) or from before the last snapshot
+            item = {
+                "id": entry["id"],
+                "filename": f"{entry['id']}.json",
+                "attributes": entry["attributes"],
+                "image_url": _image_url(entry["id"], entry["ext"], self.namespace)
+            }
+            if not self._insert(item, entry["json_mtime"], entry["ext"]):
+                return
+            self._dir_mtime = entry["dir_mtime"]
+
+    def _append_delta(self, item_id: str, attributes: Dict[str, Any], image_ext: Optional[str],
+                      dir_mtimes: Tuple[int, int]) -> int:
+        """Log one save for other processes; caller holds the process lock. Returns the log size."""
+        try:
+            json_mtime = os.stat(os.path.join(self.output_dir, f"{item_id}.json")).st_mtime_ns
+            entry = {"id": item_id, "ext": image_ext, "json_mtime": json_mtime,
+                     "prev": dir_mtimes[0], "dir_mtime": dir_mtimes[1], "attributes": attributes}
+            with open(self.delta_path, "ab") as f:
+                f.write((json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8"))
+                return f.tell()
+        except OSError as e:
+            print(f"Error appending to wardrobe delta log: {e}")  # readers fall back to a scan
+            return 0
+
+    def _write_delta(self, data: bytes) -> None:
+        """Replace the delta log (new inode, so readers start over); caller holds the process lock"""
+        tmp_path = f"{self.delta_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.delta_path)
+        except OSError as e:
+            print(f"Error resetting wardrobe delta log: {e}")
+        self._delta_inode, self._delta_offset = None, 0
+
+    def _compact(self) -> None:
+        """Fold the delta log into a new snapshot, built from memory without holding either lock"""
+        try:
+            with self._lock:
+                base, dir_mtime = self._snap, self._dir_mtime
+                if base is None:
+                    return
+                rows = [
+                    (item_id, self._row_of[item_id] if item_id in self._row_of else self._items[item_id]["attributes"],
+                     self._json_mtimes.get(item_id, 0), self._image_exts.get(item_id))
+                    for item_id in self._ids
+                ]
+            with span("wardrobe_compact"):
+                data = WardrobeSnapshot.build(rows, dir_mtime, base=base)
+
+            with self._process_lock():
+                # Keep the entries saved while the snapshot was being built
+                try:
+                    with open(self.delta_path, "rb") as f:
+                        lines = f.read().splitlines(keepends=True)
+                except OSError:
+                    lines = []
+                kept, state = [], dir_mtime
+                for line in lines:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    if entry.get("prev") == state:
+                        kept.append(line)
+                        state = entry.get("dir_mtime")
+                if state != os.stat(self.output_dir).st_mtime_ns:
+                    return  # changed outside the log; the next refresh rescans and rewrites both
+                snap = WardrobeSnapshot.save(data, self.snapshot_path)
+                self._write_delta(b"".join(kept))
+
+            with self._lock:
+                if self._dir_mtime == dir_mtime:
+                    self._adopt(snap)
+        except (OSError, ValueError) as e:
+            print(f"Wardrobe snapshot compaction failed: {e}")
+        finally:
+            self._compacting = False
+
+    @contextlib.contextmanager
+    def _process_lock(self):
+        """Serialize snapshot rebuilds across worker processes (no-op without fcntl)"""
+        if not self.snapshot_path or fcntl is None:
+            yield
+            return
+        with open(f"{self.snapshot_path}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def refresh(self, force: bool = False) -> None:
+        """Pick up changes on disk (throttled to one directory stat per refresh_interval)"""
+        now = time.monotonic()
+        with self._lock:
+            if not force and self._loaded and now - self._last_check < self.refresh_interval:
+                return
+            self._last_check = now
+            try:
+                dir_mtime = os.stat(self.output_dir).st_mtime_ns
+            except FileNotFoundError:
+                self._clear()
+                self._loaded = True
+                return
+            if not force and self._loaded and dir_mtime == self._dir_mtime:
+                return
+            if not force and self._loaded and self.delta_path:
+                # Saves by other processes: replay their log entries instead of rescanning
+                self._sync_delta()
+                if self._dir_mtime == dir_mtime:
+                    return
+
+            if self.snapshot_path:
+                snapshot_dir = os.path.dirname(self.snapshot_path)
+                if not os.path.isdir(snapshot_dir):
+                    os.makedirs(snapshot_dir, exist_ok=True)
+                    dir_mtime = os.stat(self.output_dir).st_mtime_ns
+
+            with self._process_lock():
+                if self.snapshot_path:
+                    # Writers hold this lock, so the state cannot move while we catch up to it
+                    dir_mtime = os.stat(self.output_dir).st_mtime_ns
+                    # Another process may already have captured this directory state
+                    snap = WardrobeSnapshot.open(self.snapshot_path)
+                    if snap is not None and (snap.dir_mtime == dir_mtime or not force):
+                        with span("wardrobe_snapshot"):
+                            self._adopt(snap)
+                            self._delta_inode, self._delta_offset = None, 0
+                            self._sync_delta()
+                        if self._dir_mtime == dir_mtime:
+                            self._loaded = True
+                            return
+                with span("wardrobe_scan"):
+                    self._scan(dir_mtime)
+            self._loaded = True
+
+    def items(self) -> List[Dict[str, Any]]:
+        """Return all items sorted by id"""
+        self.refresh()
+        with self._lock:
+            return [self._item(item_id) for item_id in self._ids]
+
+    def get(self, item_id: str) -> Optional[Dict[str, Any]]:
+        """Return a single item by id (O(1))"""
+        self.refresh()
+        with self._lock:
+            return self._item(item_id)
+
+    def _category_mask(self, category: str) -> np.ndarray:
+        """Snapshot rows whose category.main equals `category`; caller holds the lock"""
+        if category in ENUMS["category_main"]:
+            return self._columns["category"] == ENUMS["category_main"].index(category)
+        # Non-enum categories share index -1; check those few rows' attributes
+        mask = self._columns["category"] == -1
+        for row in np.flatnonzero(mask).tolist():
+            mask[row] = self._item(self._ids[row])["attributes"].get("category", {}).get("main") == category
+        return mask
+
+    def count(self, category: str) -> int:
+        """Number of items whose category.main equals `category`"""
+        self.refresh()
+        with self._lock:
+            if self._snap is not None:
+                return int(np.count_nonzero(self._category_mask(category)))
+            return sum(1 for item_id in self._ids if _matches_filters(self._items[item_id], category, None, None))
+
+    def select(self, category: str, season: Optional[str] = None,
+               formality: Optional[float] = None) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, np.ndarray]]]:
+        """
+        Items of one category.main, optionally filtered by season and formality (within 0.3).
+        With a snapshot the filters run on its columns, and the matching rows' encoded
+        features (for top_outfit_pairs) are returned alongside; otherwise features are None.
+        """
+        self.refresh()
+        with self._lock:
+            snap = self._snap
+            if snap is None:
+                items = [self._items[item_id] for item_id in self._ids]
+                return [item for item in items if _matches_filters(item, category, season, formality)], None
+
+            columns = self._columns
+            mask = self._category_mask(category)
+            if season:
+                bit = self._vocab.season_bits.get(season.lower())
+                if bit is None:
+                    mask[:] = False
+                else:
+                    mask &= (columns["season"] & np.uint64(1 << bit)) != 0
+            if formality is not None:
+                mask &= np.abs(columns["formality"] - formality) <= 0.3
+
+            rows = np.flatnonzero(mask)
+            items = [self._item(self._ids[row]) for row in rows.tolist()]
+            features = {key: columns[key][rows] for key in ("color", "style", "formality", "season")}
+            return items, features
+
+    def version(self) -> str:
+        """Changes whenever the directory contents change; identical across worker processes"""
+        self.refresh()
+        with self._lock:
+            return f"{self._dir_mtime}:{len(self._ids)}"
+
+    def query(self, category: Optional[str] = None, colors: Optional[List[str]] = None,
+              season: Optional[str] = None, formality_min: Optional[float] = None,
+              formality_max: Optional[float] = None, style: Optional[str] = None,
+              after: Optional[str] = None, limit: Optional[int] = None,
+              with_attributes: bool = True) -> Tuple[List[Dict[str, Any]], int, Optional[str]]:
+        """
+        Filtered page of items in id order: (items, total matches, id to pass as `after` for the
+        next page or None). Colors match color.primary (non-palette colors count as "other").
+        With a snapshot the filters run on its columns. with_attributes=False returns
+        id/filename/image_url only (without decoding any attribute JSON from the snapshot).
+        """
+        self.refresh()
+        with self._lock:
+            start = bisect.bisect_right(self._ids, after) if after is not None else 0
+            snap = self._snap
+            if snap is None:
+                matches = [
+                    item_id for item_id in self._ids
+                    if _matches_query(self._items[item_id], category, colors, season, formality_min, formality_max, style)
+                ]
+                total = len(matches)
+                first = bisect.bisect_right(matches, after) if after is not None else 0
+                page = matches[first:first + limit] if limit is not None else matches[first:]
+                has_more = limit is not None and first + limit < total
+            else:
+                columns = self._columns
+                mask = np.ones(len(self._ids), dtype=bool)
+                if category is not None:
+                    mask &= self._category_mask(category)
+                if colors:
+                    mask &= np.isin(columns["color"], [_color_index(color) for color in colors])
+                if season:
+                    bit = self._vocab.season_bits.get(season.lower())
+                    mask &= (columns["season"] & np.uint64(1 << bit)) != 0 if bit is not None else False
+                if style:
+                    bit = self._vocab.style_bits.get(style)
+                    mask &= (columns["style"] & np.uint64(1 << bit)) != 0 if bit is not None else False
+                if formality_min is not None:
+                    mask &= columns["formality"] >= formality_min
+                if formality_max is not None:
+                    mask &= columns["formality"] <= formality_max
+
+                total = int(np.count_nonzero(mask))
+                rows = np.flatnonzero(mask[start:]) + start
+                page = [self._ids[row] for row in (rows[:limit] if limit is not None else rows).tolist()]
+                has_more = limit is not None and len(rows) > limit
+
+            if with_attributes:
+                items = [self._item(item_id) for item_id in page]
+            else:
+                items = [{
+                    "id": item_id,
+                    "filename": f"{item_id}.json",
+                    "image_url": _image_url(item_id, self._image_exts.get(item_id), self.namespace)
+                } for item_id in page]
+            return items, total, (page[-1] if has_more and page else None)
+
+    def add(self, item_id: str, attributes: Dict[str, Any], image_ext: Optional[str],
+            dir_mtimes: Optional[Tuple[int, int]] = None) -> Dict[str, Any]:
+        """
+        Register an item that was just written to disk by /api/extract, in memory only.
+        dir_mtimes is the directory mtime (before, after) the write: when `before` is the
+        state this store last loaded, `after` is adopted so the write does not cause a rescan.
+        """
+        json_path = os.path.join(self.output_dir, f"{item_id}.json")
+        item = {
+            "id": item_id,
+            "filename": f"{item_id}.json",
+            "attributes": attributes,
+            "image_url": _image_url(item_id, image_ext, self.namespace)
+        }
+        try:
+            json_mtime = os.stat(json_path).st_mtime_ns
+        except OSError:
+            json_mtime = None
+        with self._lock:
+            if not self._loaded:
+                return item  # the first refresh() loads it from disk
+            if self._insert(item, json_mtime, image_ext) and dir_mtimes and dir_mtimes[0] == self._dir_mtime:
+                self._dir_mtime = dir_mtimes[1]
+        return item
+
+    def _insert(self, item: Dict[str, Any], json_mtime: Optional[int], image_ext: Optional[str]) -> bool:
+        """Add or replace one item in the index; caller holds the lock. False if its features
+        cannot be encoded against the snapshot vocabulary (the next refresh rescans instead)."""
+        item_id = item["id"]
+        pos = bisect.bisect_left(self._ids, item_id)
+        exists = pos < len(self._ids) and self._ids[pos] == item_id
+        if self._snap is not None:
+            try:
+                encoded = WardrobeSnapshot._encode([(0, item["attributes"])], self._vocab)
+            except (TypeError, AttributeError, ValueError) as e:
+                print(f"Wardrobe index update deferred to the next scan for {item_id}: {e}")
+                return False
+            for name, column in self._columns.items():
+                if exists:
+                    if not column.flags.writeable:  # still a view of the mmap'd snapshot
+                        column = column.copy()
+                    column[pos] = encoded[name][0]
+                else:
+                    column = np.insert(column, pos, encoded[name][0])
+                self._columns[name] = column
+            self._row_of.pop(item_id, None)  # the snapshot row holds the old attributes
+        if not exists:
+            self._ids.insert(pos, item_id)
+        self._items[item_id] = item
+        self._image_exts[item_id] = image_ext
+        if json_mtime is not None:
+            self._json_mtimes[item_id] = json_mtime
+        else:
+            self._json_mtimes.pop(item_id, None)
+        return True
+
+    def save(self, item_id: str, attributes: Dict[str, Any], image_bytes: Optional[bytes],
+             image_ext: str, move_from: Optional[str] = None) -> Tuple[Dict[str, Any], str]:
+        """Write image + JSON (each via temp file + rename, JSON last so it only ever appears
+        with its image) and register the item; returns (item, path of the JSON file)"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        image_path = os.path.join(self.output_dir, f"{item_id}{image_ext}")
+        json_path = os.path.join(self.output_dir, f"{item_id}.json")
+        if self.snapshot_path:
+            os.makedirs(os.path.dirname(self.snapshot_path), exist_ok=True)
+        # Writers of this directory serialize here, so (before, after) spans only this write
+        with self._process_lock():
+            before = os.stat(self.output_dir).st_mtime_ns
+            _atomic_write(image_path, image_bytes, move_from)
+            _atomic_write(json_path, json.dumps(attributes, ensure_ascii=False, indent=2).encode("utf-8"))
+            after = os.stat(self.output_dir).st_mtime_ns
+            delta_size = self._append_delta(item_id, attributes, image_ext, (before, after)) if self.delta_path else 0
+        item = self.add(item_id, attributes, image_ext, (before, after))
+        with self._lock:
+            compact = delta_size >= WARDROBE_DELTA_COMPACT_BYTES and not self._compacting
+            self._compacting = self._compacting or compact
+        if compact:
+            threading.Thread(target=self._compact, name="wardrobe-compact", daemon=True).start()
+        return item, json_path
+
+def _atomic_write(path: str, data: Optional[bytes], move_from: Optional[str] = None) -> None:
+    """Write data to path via temp file + rename; move_from is an already written temp file
+    (a spooled upload) that is renamed into place instead, data is then not needed"""
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    if move_from is not None:
+        try:
+            os.replace(move_from, path)
+            return
+        except OSError as e:  # e.g. spool directory on another filesystem
+            print(f"Spool rename failed, writing a copy: {e}")
+        try:
+            shutil.copyfile(move_from, tmp)
+        finally:
+            with contextlib.suppress(OSError):
+                os.remove(move_from)
+        os.replace(tmp, path)
+        return
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+class SqliteWardrobeStore:
+    """
+    Wardrobe in a single SQLite database (WAL mode) instead of one JSON file per item.
+
+    Same interface as WardrobeStore. category.main, color.primary (normalized to the scoring
+    palette), formality, seasons and style tags are stored in indexed columns / side tables, so
+    count/select/query run as SQL instead of scans. Images stay in output_dir; the row keeps
+    the image path. An empty database is filled once from the existing JSON directory.
+    Decoded items are cached per process until the database version changes.
+    """
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS items (
+            id TEXT PRIMARY KEY,
+            category_main TEXT,
+            color_primary TEXT,
+            formality REAL,
+            image_path TEXT,
+            attributes TEXT NOT NULL,
+            created_at REAL NOT NULL
+        )""",
+        "CREATE TABLE IF NOT EXISTS item_seasons (item_id TEXT NOT NULL, season TEXT NOT NULL, PRIMARY KEY (item_id, season))",
+        "CREATE TABLE IF NOT EXISTS item_style_tags (item_id TEXT NOT NULL, tag TEXT NOT NULL, PRIMARY KEY (item_id, tag))",
+        "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS items_category ON items (category_main, id)",
+        "CREATE INDEX IF NOT EXISTS items_color ON items (color_primary, id)",
+        "CREATE INDEX IF NOT EXISTS items_formality ON items (formality)",
+        "CREATE INDEX IF NOT EXISTS item_seasons_season ON item_seasons (season, item_id)",
+        "CREATE INDEX IF NOT EXISTS item_style_tags_tag ON item_style_tags (tag, item_id)",
+    )
+
+    def __init__(self, output_dir: str = OUTPUT_DIR, db_path: Optional[str] = None, namespace: str = ""):
+        self.output_dir = output_dir
+        self.namespace = namespace
+        self.db_path = db_path or os.path.join(output_dir, "wardrobe.db")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._items: Dict[str, Dict[str, Any]] = {}
+        self._cache_version: Optional[str] = None
+        self._ready = False
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    for statement in self.SCHEMA:
+                        conn.execute(statement)
+                    self._migrate(conn)
+                    self._ready = True
+        return conn
+
+    @staticmethod
+    def _columns(attributes: Dict[str, Any]) -> Tuple[Any, str, Optional[float], List[str], List[str]]:
+        """Indexed values of one item: category.main, palette color, formality, seasons, style tags"""
+        scores = attributes.get("scores", {})
+        formality = scores.get("formality", 0.5)
+        formality = float(formality) if isinstance(formality, (int, float)) and formality == formality else None
+        seasons = scores.get("season", [])
+        tags = attributes.get("style_tags", [])
+        return (
+            attributes.get("category", {}).get("main"),
+            ENUMS["color"][_color_index(attributes.get("color", {}).get("primary", "unknown"))],
+            formality,
+            sorted({v for v in seasons if isinstance(v, str)}) if isinstance(seasons, list) else [],
+            sorted({v for v in tags if isinstance(v, str)}) if isinstance(tags, list) else [],
+        )
+
+    def _write(self, conn: sqlite3.Connection, item_id: str, attributes: Dict[str, Any],
+               image_path: Optional[str], created_at: float) -> None:
+        category, color, formality, seasons, tags = self._columns(attributes)
+        conn.execute(
+            "INSERT OR REPLACE INTO items (id, category_main, color_primary, formality, image_path, attributes, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (item_id, category, color, formality, image_path,
+             json.dumps(attributes, ensure_ascii=False, separators=(",", ":")), created_at))
+        conn.execute("DELETE FROM item_seasons WHERE item_id = ?", (item_id,))
+        conn.execute("DELETE FROM item_style_tags WHERE item_id = ?", (item_id,))
+        conn.executemany("INSERT INTO item_seasons (item_id, season) VALUES (?, ?)", [(item_id, v) for v in seasons])
+        conn.executemany("INSERT INTO item_style_tags (item_id, tag) VALUES (?, ?)", [(item_id, v) for v in tags])
+
+    @staticmethod
+    def _bump_version(conn: sqlite3.Connection) -> None:
+        conn.execute("INSERT INTO meta (key, value) VALUES ('version', '1') "
+                     "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+
+    def _migrate(self, conn: sqlite3.Connection) -> None:
+        """One-shot import of extracted_attributes/*.json (files are left in place)"""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_from_json'").fetchone():
+                conn.execute("COMMIT")
+                return
+            image_paths: Dict[str, str] = {}
+            json_paths: Dict[str, str] = {}
+            if os.path.isdir(self.output_dir):
+                with os.scandir(self.output_dir) as it:
+                    for entry in it:
+                        item_id, ext = os.path.splitext(entry.name)
+                        if ext == '.json':
+                            json_paths[item_id] = entry.path
+                        elif ext in IMAGE_EXTENSIONS:
+                            current = image_paths.get(item_id)
+                            if current is None or IMAGE_EXTENSIONS.index(ext) < IMAGE_EXTENSIONS.index(os.path.splitext(current)[1]):
+                                image_paths[item_id] = entry.path
+            migrated = 0
+            for item_id in sorted(json_paths):
+                try:
+                    with open(json_paths[item_id], 'r', encoding='utf-8') as f:
+                        attributes = json.load(f)
+                    created_at = os.stat(json_paths[item_id]).st_mtime
+                except Exception as e:
+                    print(f"Error loading {json_paths[item_id]}: {e}")
+                    continue
+                error = wardrobe_attributes_error(attributes)
+                if error:
+                    print(f"Skipping {json_paths[item_id]}: {error}")
+                    continue
+                self._write(conn, item_id, attributes, image_paths.get(item_id), created_at)
+                migrated += 1
+            conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_from_json', ?)", (str(migrated),))
+            self._bump_version(conn)
+            conn.execute("COMMIT")
+            if migrated:
+                print(f"Migrated {migrated} wardrobe items from {self.output_dir}/ into {self.db_path}")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _item_from_row(self, item_id: str, attributes: Optional[str], image_path: Optional[str]) -> Dict[str, Any]:
+        ext = os.path.splitext(image_path)[1] if image_path else None
+        item = {"id": item_id, "filename": f"{item_id}.json", "image_url": _image_url(item_id, ext, self.namespace)}
+        if attributes is not None:
+            item["attributes"] = json.loads(attributes)
+        return item
+
+    def _items_for(self, rows: List[Tuple[str, Optional[str], Optional[str]]]) -> List[Dict[str, Any]]:
+        """Decode (id, attributes, image_path) rows, reusing items decoded at the current version"""
+        version = self.version()
+        with self._lock:
+            if version != self._cache_version:
+                self._items = {}
+                self._cache_version = version
+            items = []
+            for item_id, attributes, image_path in rows:
+                item = self._items.get(item_id)
+                if item is None:
+                    item = self._items[item_id] = self._item_from_row(item_id, attributes, image_path)
+                items.append(item)
+            return items
+
+    def refresh(self, force: bool = False) -> None:
+        """Nothing to rescan: every process reads the same database"""
+        self._conn()
+
+    def version(self) -> str:
+        row = self._conn().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        return f"sqlite:{row[0] if row else 0}"
+
+    def items(self) -> List[Dict[str, Any]]:
+        """Return all items sorted by id"""
+        rows = self._conn().execute("SELECT id, attributes, image_path FROM items ORDER BY id").fetchall()
+        return self._items_for(rows)
+
+    def get(self, item_id: str) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT id, attributes, image_path FROM items WHERE id = ?", (item_id,)).fetchone()
+        return self._items_for([row])[0] if row else None
+
+    def count(self, category: str) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM items WHERE category_main = ?", (category,)).fetchone()[0]
+
+    @staticmethod
+    def _where(category: Optional[str] = None, colors: Optional[List[str]] = None, season: Optional[str] = None,
+               formality_min: Optional[float] = None, formality_max: Optional[float] = None,
+               style: Optional[str] = None) -> Tuple[str, List[Any]]:
+        clauses: List[str] = []
+        params: List[Any] = []
+        if category is not None:
+            clauses.append("category_main = ?")
+            params.append(category)
+        if colors:
+            palette = sorted({ENUMS["color"][_color_index(color)] for color in colors})
+            clauses.append(f"color_primary IN ({', '.join('?' * len(palette))})")
+            params.extend(palette)
+        if season:
+            clauses.append("id IN (SELECT item_id FROM item_seasons WHERE season = ?)")
+            params.append(season.lower())
+        if style:
+            clauses.append("id IN (SELECT item_id FROM item_style_tags WHERE tag = ?)")
+            params.append(style)
+        if formality_min is not None:
+            clauses.append("formality >= ?")
+            params.append(formality_min)
+        if formality_max is not None:
+            clauses.append("formality <= ?")
+            params.append(formality_max)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def select(self, category: str, season: Optional[str] = None,
+               formality: Optional[float] = None) -> Tuple[List[Dict[str, Any]], None]:
+        """Same filters as WardrobeStore.select, evaluated in SQL (formality within 0.3)"""
+        where, params = self._where(
+            category, season=season,
+            formality_min=formality - 0.3 if formality is not None else None,
+            formality_max=formality + 0.3 if formality is not None else None)
+        rows = self._conn().execute(f"SELECT id, attributes, image_path FROM items{where} ORDER BY id", params).fetchall()
+        items = self._items_for(rows)
+        if formality is not None:
+            # The SQL range is a prefilter; keep the exact comparison used everywhere else
+            items = [item for item in items if _matches_filters(item, category, season, formality)]
+        return items, None
+
+    def query(self, category: Optional[str] = None, colors: Optional[List[str]] = None,
+              season: Optional[str] = None, formality_min: Optional[float] = None,
+              formality_max: Optional[float] = None, style: Optional[str] = None,
+              after: Optional[str] = None, limit: Optional[int] = None,
+              with_attributes: bool = True) -> Tuple[List[Dict[str, Any]], int, Optional[str]]:
+        """Same contract as WardrobeStore.query, with filters, cursor and limit pushed down to SQL"""
+        conn = self._conn()
+        where, params = self._where(category, colors, season, formality_min, formality_max, style)
+        total = conn.execute(f"SELECT COUNT(*) FROM items{where}", params).fetchone()[0]
+        if after is not None:
+            where += (" AND " if where else " WHERE ") + "id > ?"
+            params = params + [after]
+        sql = f"SELECT id, {'attributes' if with_attributes else 'NULL'}, image_path FROM items{where} ORDER BY id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params = params + [limit + 1]
+        rows = conn.execute(sql, params).fetchall()
+        has_more = limit is not None and len(rows) > limit
+        rows = rows[:limit] if limit is not None else rows
+        items = self._items_for(rows) if with_attributes else [self._item_from_row(*row) for row in rows]
+        return items, total, (rows[-1][0] if has_more and rows else None)
+
+    def add(self, item_id: str, attributes: Dict[str, Any], image_ext: Optional[str]) -> Dict[str, Any]:
+        """Insert or replace one item whose image is already in output_dir"""
+        image_path = os.path.join(self.output_dir, f"{item_id}{image_ext}") if image_ext else None
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._write(conn, item_id, attributes, image_path, time.time())
+            self._bump_version(conn)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return self.get(item_id)
+
+    def save(self, item_id: str, attributes: Dict[str, Any], image_bytes: Optional[bytes],
+             image_ext: str, move_from: Optional[str] = None) -> Tuple[Dict[str, Any], str]:
+        """Write the image (temp file + rename), then insert the row in one transaction;
+        the image is removed again if the insert fails"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        image_path = os.path.join(self.output_dir, f"{item_id}{image_ext}")
+        _atomic_write(image_path, image_bytes, move_from)
+        try:
+            item = self.add(item_id, attributes, image_ext)
+        except Exception:
+            with contextlib.suppress(OSError):
+                os.remove(image_path)
+            raise
+        return item, f"{self.db_path}#{item_id}"
+
+# files: one JSON per item in extracted_attributes/ (+ mmap snapshot); sqlite: SqliteWardrobeStore
+WARDROBE_BACKEND = os.getenv("WARDROBE_BACKEND", "files").lower()
+WARDROBE_DB = os.getenv("WARDROBE_DB", os.path.join(OUTPUT_DIR, "wardrobe.db"))
+
+wardrobe_store = SqliteWardrobeStore(db_path=WARDROBE_DB) if WARDROBE_BACKEND == "sqlite" else WardrobeStore()
+
+def load_wardrobe_items(namespace: str = "") -> List[Dict[str, Any]]:
+    """Load all clothing items of one namespace (default: extracted_attributes/ folder), served from its store"""
+    return wardrobe_namespaces.get(namespace).store.items()
+
+# -----------------------------
+# Near-duplicate detection (perceptual hash)
+# -----------------------------
+# offer: call Gemini anyway and return the match alongside the result
+# reuse: copy the matched item's attributes without calling Gemini, only if the colors also match
+#        (dHash is grayscale: a navy and a red shirt of the same outline hash alike)
+# off:   disabled
+PHASH_MODE = os.getenv("PHASH_MODE", "offer").lower()
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "4"))
+# reuse: max mean absolute difference (0-255, per channel) between 4x4 RGB color grids
+PHASH_COLOR_TOLERANCE = float(os.getenv("PHASH_COLOR_TOLERANCE", "24"))
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """64-bit difference hash of a downscaled grayscale image"""
+    gray = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = gray.tobytes()
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+def image_dhash(image_bytes: bytes) -> int:
+    img = Image.open(io.BytesIO(image_bytes))
+    img.draft("L", (64, 64))  # JPEG: decode at reduced scale
+    return dhash(img)
+
+def color_grid(image: Image.Image, size: int = 4) -> np.ndarray:
+    """Average RGB of each cell of a size x size grid (what dhash cannot see)"""
+    rgb = image.convert("RGB").resize((size, size), Image.Resampling.BOX)
+    return np.asarray(rgb, dtype=np.float32)
+
+def image_color_grid(image_bytes: bytes) -> np.ndarray:
+    img = Image.open(io.BytesIO(image_bytes))
+    img.draft("RGB", (64, 64))
+    return color_grid(img)
+
+def colors_match(a: np.ndarray, b: np.ndarray, tolerance: float = PHASH_COLOR_TOLERANCE) -> bool:
+    return float(np.abs(a - b).mean()) <= tolerance
+
+class MultiIndexHash:
+    """
+    Exact Hamming-radius search over 64-bit hashes (multi-index hashing).
+    The hash is split into max_distance + 1 disjoint bit ranges; by pigeonhole any hash
+    within max_distance equals the query on at least one range, so only those buckets are
+    compared instead of walking the whole index.
+    """
+
+    def __init__(self, max_distance: int = PHASH_MAX_DISTANCE):
+        self.max_distance = max_distance
+        parts = max_distance + 1
+        bounds = [round(i * 64 / parts) for i in range(parts + 1)]
+        # (shift, mask) per bit range
+        self._ranges = [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(bounds, bounds[1:])]
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in self._ranges]
+        self._ids: Dict[int, List[str]] = {}
+        self.size = 0
+
+    def add(self, value: int, item_id: str) -> None:
+        self.size += 1
+        ids = self._ids.get(value)
+        if ids is not None:
+            ids.append(item_id)
+            return
+        self._ids[value] = [item_id]
+        for (shift, mask), table in zip(self._ranges, self._tables):
+            table.setdefault((value >> shift) & mask, []).append(value)
+
+    def search(self, value: int, max_distance: Optional[int] = None) -> List[Tuple[int, str]]:
+        """All (distance, item_id) within max_distance, closest first"""
+        if max_distance is None:
+            max_distance = self.max_distance
+        if max_distance > self.max_distance:
+            candidates = self._ids.keys()  # wider than the index was built for: full scan
+        else:
+            candidates = set()
+            for (shift, mask), table in zip(self._ranges, self._tables):
+                candidates.update(table.get((value >> shift) & mask, ()))
+
+        results = []
+        for candidate in candidates:
+            d = (candidate ^ value).bit_count()
+            if d <= max_distance:
+                results.extend((d, item_id) for item_id in self._ids[candidate])
+        results.sort()
+        return results
+
+class PhashIndex:
+    """
+    dHash of every wardrobe image in a MultiIndexHash, persisted as an append-only JSONL file so
+    other worker processes can tail it. Items missing from the file are hashed once from
+    their stored image by a background thread started on first use.
+    """
+
+    def __init__(self, store: WardrobeStore, path: Optional[str] = None):
+        self.store = store
+        self.path = path or os.path.join(store.output_dir, ".snapshot", "phash.jsonl")
+        self._lock = threading.Lock()
+        self._hashes = MultiIndexHash()
+        self._known: set = set()
+        self._offset = 0
+        self._backfilled = False
+
+    def _append(self, item_id: str, value: int) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "ab") as f:
+                f.write((json.dumps({"id": item_id, "dhash": f"{value:016x}"}) + "\n").encode("utf-8"))
+        except OSError as e:
+            print(f"Error writing phash index: {e}")
+
+    def _insert(self, item_id: str, value: int) -> None:
+        if item_id not in self._known:
+            self._known.add(item_id)
+            self._hashes.add(value, item_id)
+
+    def _sync(self) -> None:
+        """Read lines appended (by any process) since the last sync; caller holds the lock"""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break  # partially written line, retry next time
+                    self._offset += len(line)
+                    try:
+                        entry = json.loads(line)
+                        self._insert(entry["id"], int(entry["dhash"], 16))
+                    except (ValueError, KeyError):
+                        continue
+        except FileNotFoundError:
+            pass
+
+        if not self._backfilled:
+            self._backfilled = True
+            threading.Thread(target=self._backfill, name="phash-backfill", daemon=True).start()
+
+    def _backfill(self) -> None:
+        """
+        Hash stored images of items missing from the file. Runs in the background so uploads
+        are not held behind it; until it finishes, nearest() only sees the items hashed so far.
+        """
+        items = self.store.items()
+        with self._lock:
+            missing = [item for item in items if item["id"] not in self._known and item.get("image_url")]
+        if missing:
+            print(f"Hashing {len(missing)} wardrobe images for near-duplicate detection...")
+        for item in missing:
+            image_path = self.image_path(item)
+            try:
+                with open(image_path, "rb") as f:
+                    value = image_dhash(f.read())
+            except Exception as e:
+                print(f"Error hashing {image_path}: {e}")
+                continue
+            with self._lock:
+                self._sync()  # another process may have hashed it meanwhile
+                if item["id"] not in self._known:
+                    self._insert(item["id"], value)
+                    self._append(item["id"], value)
+
+    def image_path(self, item: Dict[str, Any]) -> str:
+        """Stored image of an indexed item"""
+        return os.path.join(self.store.output_dir, os.path.basename(item["image_url"].split("?", 1)[0]))
+
+    def add(self, item_id: str, value: int) -> None:
+        with self._lock:
+            self._sync()
+            if item_id not in self._known:
+                self._insert(item_id, value)
+                self._append(item_id, value)
+
+    def nearest(self, value: int, max_distance: int = PHASH_MAX_DISTANCE) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """Closest existing wardrobe item within max_distance as (distance, item)"""
+        with self._lock:
+            self._sync()
+            matches = self._hashes.search(value, max_distance)
+        for distance, item_id in matches:
+            item = self.store.get(item_id)  # skip items deleted since they were indexed
+            if item is not None:
+                return distance, item
+        return None
+
+phash_index = PhashIndex(wardrobe_store)
+
+# -----------------------------
+# Image variants (thumbnails)
+# -----------------------------
+# 긴 변 기준 픽셀; ?size=thumb|medium|original 또는 ?w=<px> (가장 가까운 큰 변형으로 올림)
+IMAGE_VARIANT_SIZES = {"thumb": 256, "medium": 768}
+IMAGE_VARIANT_WORKERS = max(1, int(os.getenv("IMAGE_VARIANT_WORKERS", "2")))
+IMAGE_VARIANT_MAX_PENDING = int(os.getenv("IMAGE_VARIANT_MAX_PENDING", "32"))
+IMAGE_VARIANT_PREGENERATE = os.getenv("IMAGE_VARIANT_PREGENERATE", "true").lower() == "true"
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"  # item ids are never reused
+
+def resolve_image_variant(size: Optional[str], width: Optional[int]) -> Optional[int]:
+    """Map ?size= / ?w= to a variant max side; None means the original. Raises ValueError."""
+    if size:
+        if size == "original":
+            return None
+        if size not in IMAGE_VARIANT_SIZES:
+            raise ValueError(f"size must be one of: original, {', '.join(IMAGE_VARIANT_SIZES)}")
+        return IMAGE_VARIANT_SIZES[size]
+    if width is not None:
+        if width <= 0:
+            raise ValueError("w must be positive")
+        for side in sorted(IMAGE_VARIANT_SIZES.values()):
+            if side >= width:
+                return side
+    return None
+
+def render_image_variant(image_bytes: bytes, max_side: int) -> bytes:
+    """Downscaled, orientation-corrected WebP copy of an uploaded image"""
+    img = Image.open(io.BytesIO(image_bytes))
+    if img.format == "JPEG":
+        img.draft("RGB", (max_side, max_side))
+    orientation = img.getexif().get(0x0112, 1)
+    return encode_image_variants(img, orientation, [max_side])[max_side]
+
+def encode_image_variants(img: Image.Image, orientation: int, sizes: List[int]) -> Dict[int, bytes]:
+    """WebP variants of a decoded image, largest first, each downscaled from the previous one
+    (img is downscaled in place)"""
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "A" in img.getbands() or "transparency" in img.info else "RGB")
+    transpose = EXIF_ORIENTATION_TRANSPOSE.get(orientation)
+    variants = {}
+    for max_side in sorted(sizes, reverse=True):
+        img.thumbnail((max_side, max_side), Image.Resampling.BICUBIC)
+        buf = io.BytesIO()
+        (img.transpose(transpose) if transpose is not None else img).save(buf, format="WEBP", quality=80, method=4)
+        variants[max_side] = buf.getvalue()
+    return variants
+
+class ImageVariantStore:
+    """
+    Thumbnail/medium variants in a .thumbnails/ directory next to each image, generated once and
+    reused. Filenames are relative to output_dir (namespaced images live in subdirectories).
+
+    Rendering runs on a small dedicated thread pool so image decoding can use at most
+    IMAGE_VARIANT_WORKERS cores regardless of how many request threads ask for variants.
+    Concurrent requests for the same variant share one render. When more than max_pending
+    renders are queued, callers get None and serve the original instead of waiting.
+    """
+
+    def __init__(self, output_dir: str = OUTPUT_DIR, workers: int = IMAGE_VARIANT_WORKERS,
+                 max_pending: int = IMAGE_VARIANT_MAX_PENDING):
+        self.output_dir = output_dir
+        self.variant_dir = os.path.join(output_dir, ".thumbnails")
+        self.max_pending = max_pending
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-variant")
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Future] = {}
+        self._prerendering = 0
+        self.generated = 0
+        self.served = 0
+        self.overloaded = 0
+
+    def variant_path(self, filename: str, max_side: int) -> str:
+        directory, name = os.path.split(filename)
+        stem, _ = os.path.splitext(name)
+        if not directory:
+            return os.path.join(self.variant_dir, f"{stem}.{max_side}.webp")
+        return os.path.join(self.output_dir, directory, ".thumbnails", f"{stem}.{max_side}.webp")
+
+    def _write(self, target: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, target)
+        with self._lock:
+            self.generated += 1
+
+    def _render(self, source: str, target: str, max_side: int) -> str:
+        try:
+            with open(source, "rb") as f:
+                data = render_image_variant(f.read(), max_side)
+            self._write(target, data)
+            return target
+        finally:
+            with self._lock:
+                self._pending.pop(target, None)
+
+    def _submit(self, filename: str, max_side: int) -> Optional[Future]:
+        source = os.path.join(self.output_dir, filename)
+        target = self.variant_path(filename, max_side)
+        with self._lock:
+            future = self._pending.get(target)
+            if future is None:
+                if len(self._pending) >= self.max_pending:
+                    self.overloaded += 1
+                    return None
+                future = self._executor.submit(self._render, source, target, max_side)
+                self._pending[target] = future
+            return future
+
+    def get(self, filename: str, max_side: int, timeout: float = 30.0) -> Optional[str]:
+        """Path of the variant, rendering it on first request; None if the pool is saturated"""
+        target = self.variant_path(filename, max_side)
+        if os.path.exists(target):
+            with self._lock:
+                self.served += 1
+            return target
+        future = self._submit(filename, max_side)
+        if future is None:
+            return None
+        path = future.result(timeout=timeout)
+        with self._lock:
+            self.served += 1
+        return path
+
+    def prerender(self, decoded: DecodedImage) -> Optional[Future]:
+        """
+        Start encoding every variant from an upload's shared decode while the upload is still
+        being extracted (its filename is not known yet); pregenerate() stores the results.
+        Only taken when a worker is idle, so queued tasks never pin bitmaps; otherwise None and
+        the variants are rendered from the saved file as usual.
+        """
+        with self._lock:
+            if len(self._pending) + self._prerendering >= self.workers:
+                return None
+            self._prerendering += 1
+        return self._executor.submit(self._prerender, decoded.image, decoded.orientation)
+
+    def _prerender(self, image: Image.Image, orientation: int) -> Dict[int, bytes]:
+        try:
+            return encode_image_variants(image.copy(), orientation, list(IMAGE_VARIANT_SIZES.values()))
+        finally:
+            with self._lock:
+                self._prerendering -= 1
+
+    def _store_prerendered(self, rendered: Future, filename: str) -> None:
+        try:
+            variants = rendered.result()
+        except Exception as e:
+            print(f"Image variant error ({filename}): {e}")
+            variants = {}
+        for max_side in IMAGE_VARIANT_SIZES.values():
+            if max_side in variants:
+                self._write(self.variant_path(filename, max_side), variants[max_side])
+            else:
+                self._submit(filename, max_side)  # render from the saved file instead
+
+    def pregenerate(self, filename: str, rendered: Optional[Future] = None) -> None:
+        """Queue every variant of a freshly saved upload without waiting for it
+        (rendered: a prerender() future, written out when it finishes instead of decoding the file again)"""
+        if rendered is not None:
+            rendered.add_done_callback(lambda f: self._store_prerendered(f, filename))
+            return
+        for max_side in IMAGE_VARIANT_SIZES.values():
+            if not os.path.exists(self.variant_path(filename, max_side)):
+                self._submit(filename, max_side)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "generated": self.generated,
+                "served": self.served,
+                "pending": len(self._pending) + self._prerendering,
+                "overloaded": self.overloaded
+            }
+
+image_variants = ImageVariantStore()
+
+def send_immutable_file(path: str):
+    """send_file with a strong ETag, conditional GET (304) and Range support"""
+    st = os.stat(path)
+    etag = hashlib.sha256(f"{os.path.basename(path)}:{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()[:32]
+    response = send_file(os.path.abspath(path), conditional=True, etag=etag, max_age=31536000)
+    response.headers["Cache-Control"] = IMAGE_CACHE_CONTROL
+    return response
+
+# -----------------------------
+# Wardrobe namespaces (per-user wardrobes)
+# -----------------------------
+# X-Wardrobe-Namespace 헤더로 요청마다 옷장을 고른다. 없으면 기본 네임스페이스:
+# 지금까지와 같은 extracted_attributes/ 평면 디렉터리와 전역 wardrobe_store / 캐시.
+# 그 외에는 extracted_attributes/ns/<h[0:2]>/<h[2:4]>/<h>/ (h = sha256(이름) 앞 16자리) 에 저장되어
+# 한 디렉터리의 항목 수는 사용자 수가 아니라 옷장 하나의 크기로 제한된다.
+# 네임스페이스는 인증이 아니다: 사용자 확인은 앞단(게이트웨이)이 하고, 클라이언트가 보낸 헤더를 지우고 직접 채워야 한다.
+# ?namespace= 는 누구나 URL에 붙일 수 있으므로 NAMESPACE_QUERY_PARAM=true 일 때만 받는다 (게이트웨이 없는 로컬 개발용).
+NAMESPACE_HEADER = "X-Wardrobe-Namespace"
+NAMESPACE_PARAM = "namespace"
+NAMESPACE_QUERY_PARAM = os.getenv("NAMESPACE_QUERY_PARAM", "false").lower() == "true"
+NAMESPACE_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.@-]{0,127}")
+NAMESPACE_CACHE_SIZE = max(1, int(os.getenv("NAMESPACE_CACHE_SIZE", "256")))  # namespaces kept open per process
+
+def namespace_of(req) -> str:
+    """Namespace a request is scoped to ("" = default); ValueError for a malformed name, or for
+    ?namespace= while NAMESPACE_QUERY_PARAM is off (rather than silently using the default wardrobe)"""
+    name = req.headers.get(NAMESPACE_HEADER)
+    if not name and NAMESPACE_PARAM in req.args:
+        if not NAMESPACE_QUERY_PARAM:
+            raise ValueError(f"The ?{NAMESPACE_PARAM}= parameter is disabled; "
+                             f"the namespace comes from the {NAMESPACE_HEADER} header")
+        name = req.args.get(NAMESPACE_PARAM)
+    name = (name or "").strip()
+    if name and not NAMESPACE_PATTERN.fullmatch(name):
+        raise ValueError(f"Invalid namespace (1-128 characters of A-Z a-z 0-9 _ . @ -, "
+                         f"starting with a letter or digit): {name[:64]!r}")
+    return name
+
+def namespace_path(name: str) -> str:
+    """Directory of a namespace relative to OUTPUT_DIR ("" for the default namespace)"""
+    if not name:
+        return ""
+    digest = hashlib.sha256(name.encode("utf-8")).hexdigest()[:16]
+    return os.path.join("ns", digest[:2], digest[2:4], digest)
+
+class WardrobeNamespace:
+    """One wardrobe: its store, near-duplicate index and recommendation cache"""
+
+    def __init__(self, name: str, store: WardrobeStore, phash: PhashIndex,
+                 recommendations: "RecommendationCache"):
+        self.name = name
+        self.path = namespace_path(name)
+        self.store = store
+        self.phash = phash
+        self.recommendations = recommendations
+
+    def image_file(self, filename: str) -> str:
+        """Path of one of this wardrobe's images relative to OUTPUT_DIR (as image_variants expects)"""
+        return os.path.join(self.path, filename) if self.path else filename
+
+class WardrobeNamespaces:
+    """
+    Namespaces opened by this process, at most max_open (LRU). Each gets its own store over its
+    shard directory (or SQLite file with WARDROBE_BACKEND=sqlite), phash index and recommendation
+    cache, so a request only ever scans, hashes and caches one person's closet. Opening is
+    cheap (nothing is read until first use); an evicted namespace is simply reloaded from disk.
+    The default namespace always resolves to the module-level wardrobe_store / phash_index /
+    recommendation_cache, looked up at call time.
+    """
+
+    def __init__(self, max_open: int = NAMESPACE_CACHE_SIZE):
+        self.max_open = max_open
+        self._open: "OrderedDict[str, WardrobeNamespace]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.evictions = 0
+        # Recommendation lookups of evicted namespaces, so the exported counters never go down
+        self._retired_hits = 0
+        self._retired_misses = 0
+
+    def _create(self, name: str) -> WardrobeNamespace:
+        directory = os.path.join(OUTPUT_DIR, namespace_path(name))
+        if WARDROBE_BACKEND == "sqlite":
+            store = SqliteWardrobeStore(directory, namespace=name)
+        else:
+            store = WardrobeStore(directory, namespace=name)
+        return WardrobeNamespace(name, store, PhashIndex(store), RecommendationCache(namespace=name))
+
+    def get(self, name: str) -> WardrobeNamespace:
+        if not name:
+            return WardrobeNamespace("", wardrobe_store, phash_index, recommendation_cache)
+        with self._lock:
+            namespace = self._open.get(name)
+            if namespace is not None:
+                self._open.move_to_end(name)
+                return namespace
+            namespace = self._open[name] = self._create(name)
+            self.opened += 1
+            while len(self._open) > self.max_open:
+                _, evicted = self._open.popitem(last=False)
+                self.evictions += 1
+                retired = evicted.recommendations.stats()
+                self._retired_hits += retired["hits"]
+                self._retired_misses += retired["misses"]
+            return namespace
+
+    def recommendation_counts(self) -> Tuple[int, int]:
+        """(hits, misses) of every non-default namespace's recommendation cache, evicted ones included"""
+        with self._lock:
+            hits, misses = self._retired_hits, self._retired_misses
+            caches = [namespace.recommendations for namespace in self._open.values()]
+        for cache in caches:
+            cache_stats = cache.stats()
+            hits += cache_stats["hits"]
+            misses += cache_stats["misses"]
+        return hits, misses
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "open": len(self._open),
+                "max_open": self.max_open,
+                "opened": self.opened,
+                "evictions": self.evictions
+            }
+
+wardrobe_namespaces = WardrobeNamespaces()
+
+# -----------------------------
+# Color Harmony Functions
+# -----------------------------
+COLOR_WHEEL = {
+    "black": 0, "white": 0, "gray": 0,
+    "red": 0, "orange": 30, "yellow": 60,
+    "green": 120, "skyblue": 180, "blue": 210,
+    "navy": 240, "purple": 270, "pink": 300,
+    "beige": 45, "brown": 25, "khaki": 90,
+    "cream": 50, "other": None, "unknown": None
+}
+
+def get_color_hue(color: str) -> Optional[float]:
+    """Get hue value for a color (0-360 degrees)"""
+    return COLOR_WHEEL.get(color.lower(), None)
+
+def calculate_color_harmony(color1: str, color2: str) -> float:
+    """
+    Calculate color harmony score between two colors (0.0-1.0)
+    Returns higher scores for complementary, analogous, or monochromatic combinations
+    """
+    hue1 = get_color_hue(color1)
+    hue2 = get_color_hue(color2)
+    
+    # Neutral colors (black, white, gray) go with everything
+    if color1.lower() in ["black", "white", "gray"] or color2.lower() in ["black", "white", "gray"]:
+        return 0.8
+    
+    # Unknown or other colors
+    if hue1 is None or hue2 is None:
+        return 0.5
+    
     # Same color (monochromatic)
     if color1.lower() == color2.lower():
         return 0.9
@@ -703,156 +3488,1568 @@ def calculate_outfit_score(top: Dict[str, Any], bottom: Dict[str, Any]) -> Tuple
     
     return total_score, reasons
 
+# -----------------------------
+# Vectorized Outfit Scoring
+# -----------------------------
+COLOR_INDEX = {c: i for i, c in enumerate(ENUMS["color"])}
+
+# Pairwise calculate_color_harmony over ENUMS["color"] (18x18).
+# Colors outside the enum behave exactly like "other" (hue None, not neutral).
+COLOR_HARMONY_TABLE = np.array(
+    [[calculate_color_harmony(c1, c2) for c2 in ENUMS["color"]] for c1 in ENUMS["color"]],
+    dtype=np.float64,
+)
+
+_POPCOUNT8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def _popcount64(x: np.ndarray) -> np.ndarray:
+    """Number of set bits for each element of a uint64 array"""
+    x = np.ascontiguousarray(x, dtype=np.uint64)
+    return _POPCOUNT8[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1, dtype=np.int64)
+
+def _color_index(color: Any) -> int:
+    if not isinstance(color, str):
+        return COLOR_INDEX["other"]
+    return COLOR_INDEX.get(color.lower(), COLOR_INDEX["other"])
+
+class VocabularyFullError(ValueError):
+    """A bitmask vocabulary has no free bit for a new token"""
+
+class OutfitFeatureVocab:
+    """
+    Token -> bit assignments for style tag / season bitmasks.
+    Starts from ENUMS and grows for unexpected tokens (up to 64 per mask).
+    """
+
+    MAX_BITS = 64
+
+    def __init__(self, style_tokens: Optional[List[str]] = None, season_tokens: Optional[List[str]] = None):
+        self.style_bits: Dict[str, int] = {t: i for i, t in enumerate(style_tokens or ENUMS["style_tags"])}
+        self.season_bits: Dict[str, int] = {s: i for i, s in enumerate(season_tokens or ENUMS["season"])}
+
+    @staticmethod
+    def tokens(bits: Dict[str, int]) -> List[str]:
+        """Tokens ordered by bit position (round-trips through the constructor)"""
+        return sorted(bits, key=bits.get)
+
+    def _mask(self, values: Any, bits: Dict[str, int]) -> int:
+        if not values:
+            return 0
+        mask = 0
+        for v in set(values):
+            bit = bits.get(v)
+            if bit is None:
+                if len(bits) >= self.MAX_BITS:
+                    raise VocabularyFullError("Too many distinct tokens for a 64-bit mask")
+                bit = bits[v] = len(bits)
+            mask |= 1 << bit
+        return mask
+
+    def style_mask(self, tags: Any) -> int:
+        return self._mask(tags, self.style_bits)
+
+    def season_mask(self, seasons: Any) -> int:
+        return self._mask(seasons, self.season_bits)
+
+def encode_outfit_features(items: List[Dict[str, Any]], vocab: OutfitFeatureVocab) -> Dict[str, np.ndarray]:
+    """
+    Encode items once into columnar arrays used by score_outfit_matrix:
+    color index, style-tag bitmask, formality, season bitmask
+    """
+    n = len(items)
+    color = np.empty(n, dtype=np.intp)
+    style = np.empty(n, dtype=np.uint64)
+    formality = np.empty(n, dtype=np.float64)
+    season = np.empty(n, dtype=np.uint64)
+
+    for i, item in enumerate(items):
+        attrs = item.get("attributes", {})
+        scores = attrs.get("scores", {})
+        color[i] = _color_index(attrs.get("color", {}).get("primary", "unknown"))
+        style[i] = vocab.style_mask(attrs.get("style_tags", []))
+        formality[i] = scores.get("formality", 0.5)
+        season[i] = vocab.season_mask(scores.get("season", []))
+
+    return {"color": color, "style": style, "formality": formality, "season": season}
+
+def score_outfit_matrix(top_features: Dict[str, np.ndarray], bottom_features: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Full tops x bottoms score matrix.
+    Mirrors calculate_outfit_score operation by operation so results are bit-identical.
+    """
+    # Color harmony (40% weight)
+    color_score = COLOR_HARMONY_TABLE[top_features["color"][:, None], bottom_features["color"][None, :]]
+
+    # Style match (30% weight)
+    ts = top_features["style"][:, None]
+    bs = bottom_features["style"][None, :]
+    common = _popcount64(ts & bs)
+    total = _popcount64(ts | bs)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        jaccard = np.minimum(1.0, 0.3 + (common / total) * 0.7)
+    style_score = np.where((ts == 0) | (bs == 0), 0.3, jaccard)
+
+    # Formality match (20% weight) - fmax matches max(0.0, nan) == 0.0
+    diff = np.abs(top_features["formality"][:, None] - bottom_features["formality"][None, :])
+    formality_score = np.fmax(0.0, 1.0 - diff * 2)
+
+    # Season match (10% weight)
+    tse = top_features["season"][:, None]
+    bse = bottom_features["season"][None, :]
+    season_score = np.where((tse == 0) | (bse == 0), 0.5, np.where((tse & bse) != 0, 1.0, 0.3))
+
+    return (
+        color_score * 0.4 +
+        style_score * 0.3 +
+        formality_score * 0.2 +
+        season_score * 0.1
+    )
+
+def score_outfit_pairs(tops: List[Dict[str, Any]], bottoms: List[Dict[str, Any]]) -> np.ndarray:
+    """Score every top x bottom pair at once; returns a (len(tops), len(bottoms)) matrix"""
+    vocab = OutfitFeatureVocab()
+    try:
+        return score_outfit_matrix(encode_outfit_features(tops, vocab), encode_outfit_features(bottoms, vocab))
+    except ValueError:
+        # Too many distinct tokens for a bitmask - fall back to the scalar scorer
+        scores = np.empty((len(tops), len(bottoms)), dtype=np.float64)
+        for i, top in enumerate(tops):
+            for j, bottom in enumerate(bottoms):
+                scores[i, j] = calculate_outfit_score(top, bottom)[0]
+        return scores
+
+# Rows of the score matrix computed at once by top_outfit_pairs (bounds peak memory)
+OUTFIT_SCORE_BLOCK_ROWS = 256
+
+def _top_k_flat(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k best entries of a 1-D array, ordered by (score desc, index asc)"""
+    if k < scores.size:
+        kth = -np.partition(-scores, k - 1)[k - 1]
+        above = np.flatnonzero(scores > kth)
+        ties = np.flatnonzero(scores == kth)[:k - above.size]
+        idx = np.concatenate([above, ties])
+    else:
+        idx = np.arange(scores.size)
+    return idx[np.lexsort((idx, -scores[idx]))]
+
+def top_outfit_pairs_scalar(tops: List[Dict[str, Any]], bottoms: List[Dict[str, Any]], k: int) -> List[Tuple[float, int, int]]:
+    """
+    Best k (score, top_index, bottom_index) using calculate_outfit_score and heapq.
+    Ties are broken by lower top index, then lower bottom index.
+    """
+    if k <= 0:
+        return []
+    scored = (
+        (calculate_outfit_score(top, bottom)[0], -i, -j)
+        for i, top in enumerate(tops)
+        for j, bottom in enumerate(bottoms)
+    )
+    return [(score, -ni, -nj) for score, ni, nj in heapq.nlargest(k, scored)]
+
+def top_outfit_pairs(tops: List[Dict[str, Any]], bottoms: List[Dict[str, Any]], k: int,
+                     block_rows: int = OUTFIT_SCORE_BLOCK_ROWS,
+                     features: Optional[Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]] = None) -> List[Tuple[float, int, int]]:
+    """
+    Best k (score, top_index, bottom_index), highest score first.
+    Scores blocks of tops with score_outfit_matrix and keeps only a running top-k
+    (argpartition), so no per-pair candidate list is ever materialized.
+    Ties are broken by lower top index, then lower bottom index (same as a stable sort).
+    `features` may carry already-encoded (top, bottom) arrays, e.g. from WardrobeStore.select.
+    """
+    if k <= 0 or not tops or not bottoms:
+        return []
+
+    if features is not None:
+        top_features, bottom_features = features
+    else:
+        vocab = OutfitFeatureVocab()
+        try:
+            top_features = encode_outfit_features(tops, vocab)
+            bottom_features = encode_outfit_features(bottoms, vocab)
+        except ValueError:
+            return top_outfit_pairs_scalar(tops, bottoms, k)
+
+    n_bottoms = len(bottoms)
+    best_scores = np.empty(0, dtype=np.float64)
+    best_idx = np.empty(0, dtype=np.int64)
+    for start in range(0, len(tops), block_rows):
+        block = {key: arr[start:start + block_rows] for key, arr in top_features.items()}
+        scores = score_outfit_matrix(block, bottom_features).ravel()
+        local = _top_k_flat(scores, k)
+
+        cand_scores = np.concatenate([best_scores, scores[local]])
+        cand_idx = np.concatenate([best_idx, local.astype(np.int64) + start * n_bottoms])
+        keep = np.lexsort((cand_idx, -cand_scores))[:k]
+        best_scores, best_idx = cand_scores[keep], cand_idx[keep]
+
+    return [(float(score), int(idx) // n_bottoms, int(idx) % n_bottoms)
+            for score, idx in zip(best_scores, best_idx)]
+
+# -----------------------------
+# Wardrobe Snapshot (columnar, mmap)
+# -----------------------------
+def _category_index(attrs: Dict[str, Any]) -> int:
+    main = attrs.get("category", {}).get("main")
+    return ENUMS["category_main"].index(main) if main in ENUMS["category_main"] else -1
+
+class WardrobeSnapshot:
+    """
+    Compact columnar snapshot of the wardrobe: enum indices, bitmasks, float scores,
+    an id table and compact attribute JSON. Opened with mmap so worker processes share
+    pages and start without parsing every pretty-printed JSON file.
+
+    Layout: MAGIC | uint64 header length | JSON header | 8-byte aligned columns
+    """
+
+    MAGIC = b"WSNAP001"
+    FEATURE_COLUMNS = ("color", "style", "formality", "season")
+
+    def __init__(self, buffer: Any, header: Dict[str, Any], data_offset: int):
+        self.header = header
+        self.count: int = header["count"]
+        self.dir_mtime: int = header["dir_mtime_ns"]
+        self.vocab = OutfitFeatureVocab(header["style_tokens"], header["season_tokens"])
+        self.columns: Dict[str, np.ndarray] = {}
+        for name, (dtype, offset, length) in header["columns"].items():
+            if length:
+                self.columns[name] = np.frombuffer(buffer, dtype=dtype, count=length, offset=data_offset + offset)
+            else:
+                self.columns[name] = np.empty(0, dtype=dtype)
+
+    @classmethod
+    def from_bytes(cls, data: Any) -> "WardrobeSnapshot":
+        if data[:8] != cls.MAGIC:
+            raise ValueError("Not a wardrobe snapshot")
+        header_len = int.from_bytes(data[8:16], "little")
+        header = json.loads(bytes(data[16:16 + header_len]))
+        data_offset = 16 + header_len + (-(16 + header_len)) % 8
+        return cls(data, header, data_offset)
+
+    @classmethod
+    def open(cls, path: str) -> Optional["WardrobeSnapshot"]:
+        """mmap an existing snapshot file; None if missing or unreadable"""
+        try:
+            with open(path, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return cls.from_bytes(buffer)
+        except (OSError, ValueError, KeyError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"Error opening wardrobe snapshot: {e}")
+            return None
+
+    @classmethod
+    def save(cls, data: bytes, path: str) -> "WardrobeSnapshot":
+        """Atomically replace the snapshot file, falling back to an in-memory snapshot"""
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Error writing wardrobe snapshot: {e}")
+            return cls.from_bytes(data)
+        return cls.open(path) or cls.from_bytes(data)
+
+    @classmethod
+    def build(cls, rows: List[Tuple[str, Any, int, Optional[str]]], dir_mtime: int,
+              base: Optional["WardrobeSnapshot"] = None) -> bytes:
+        """
+        Serialize rows of (item_id, source, json_mtime, image_ext). `source` is either a row
+        index in `base` (columns and JSON bytes copied as-is) or an attributes dict (encoded).
+        Rows whose attributes cannot be encoded are dropped from the snapshot.
+        Raises ValueError if the vocabulary overflows (over 64 distinct style tags).
+        """
+        if base is not None:
+            vocab = OutfitFeatureVocab(OutfitFeatureVocab.tokens(base.vocab.style_bits),
+                                       OutfitFeatureVocab.tokens(base.vocab.season_bits))
+        else:
+            vocab = OutfitFeatureVocab()
+
+        fresh = [(i, source) for i, (_, source, _, _) in enumerate(rows) if isinstance(source, dict)]
+        try:
+            encoded = cls._encode(fresh, vocab)
+        except VocabularyFullError:
+            raise
+        except (TypeError, AttributeError, ValueError):
+            # Find the offending items one by one and leave them out
+            bad = set()
+            for i, attrs in fresh:
+                try:
+                    cls._encode([(i, attrs)], vocab)
+                except VocabularyFullError:
+                    raise
+                except (TypeError, AttributeError, ValueError) as e:
+                    print(f"Leaving {rows[i][0]} out of the wardrobe snapshot: {e}")
+                    bad.add(i)
+            rows = [row for i, row in enumerate(rows) if i not in bad]
+            fresh = [(i, source) for i, (_, source, _, _) in enumerate(rows) if isinstance(source, dict)]
+            encoded = cls._encode(fresh, vocab)
+
+        n = len(rows)
+        columns: Dict[str, np.ndarray] = {
+            "category": np.empty(n, dtype=np.int8),
+            "color": np.empty(n, dtype=np.int16),
+            "style": np.empty(n, dtype=np.uint64),
+            "season": np.empty(n, dtype=np.uint64),
+            "formality": np.empty(n, dtype=np.float64),
+        }
+
+        copied = [(i, source) for i, (_, source, _, _) in enumerate(rows) if not isinstance(source, dict)]
+        if copied:
+            pos = np.array([i for i, _ in copied], dtype=np.intp)
+            src = np.array([source for _, source in copied], dtype=np.intp)
+            for name in columns:
+                columns[name][pos] = base.columns[name][src]
+
+        if fresh:
+            pos = np.array([i for i, _ in fresh], dtype=np.intp)
+            for name in columns:
+                columns[name][pos] = encoded[name]
+
+        columns["image_ext"] = np.array(
+            [IMAGE_EXTENSIONS.index(ext) if ext else -1 for _, _, _, ext in rows], dtype=np.int8)
+        columns["json_mtime"] = np.array([mtime for _, _, mtime, _ in rows], dtype=np.int64)
+
+        pieces = []
+        for _, source, _, _ in rows:
+            if isinstance(source, dict):
+                pieces.append(json.dumps(source, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+            else:
+                pieces.append(base.attribute_bytes(source))
+        columns["attr_ends"] = np.cumsum([len(p) for p in pieces], dtype=np.int64)
+        columns["attr_blob"] = np.frombuffer(b"".join(pieces), dtype=np.uint8)
+        columns["id_blob"] = np.frombuffer("\x00".join(row[0] for row in rows).encode("utf-8"), dtype=np.uint8)
+
+        layout = {}
+        chunks = []
+        offset = 0
+        for name, arr in columns.items():
+            pad = (-offset) % 8
+            chunks.append(b"\0" * pad)
+            offset += pad
+            layout[name] = [arr.dtype.str, offset, int(arr.size)]
+            chunks.append(arr.tobytes())
+            offset += arr.nbytes
+
+        header = json.dumps({
+            "version": 1,
+            "count": n,
+            "dir_mtime_ns": dir_mtime,
+            "style_tokens": OutfitFeatureVocab.tokens(vocab.style_bits),
+            "season_tokens": OutfitFeatureVocab.tokens(vocab.season_bits),
+            "columns": layout,
+        }).encode("utf-8")
+        prefix = cls.MAGIC + len(header).to_bytes(8, "little") + header
+        prefix += b"\0" * ((-len(prefix)) % 8)
+        return prefix + b"".join(chunks)
+
+    @staticmethod
+    def _encode(fresh: List[Tuple[int, Dict[str, Any]]], vocab: OutfitFeatureVocab) -> Dict[str, np.ndarray]:
+        """Feature and category columns of the attributes dicts in `fresh`"""
+        encoded = encode_outfit_features([{"attributes": attrs} for _, attrs in fresh], vocab)
+        encoded["category"] = np.array([_category_index(attrs) for _, attrs in fresh], dtype=np.int8)
+        return encoded
+
+    def ids(self) -> List[str]:
+        if not self.count:
+            return []
+        return self.columns["id_blob"].tobytes().decode("utf-8").split("\x00")
+
+    def attribute_bytes(self, row: int) -> bytes:
+        ends = self.columns["attr_ends"]
+        start = int(ends[row - 1]) if row else 0
+        return self.columns["attr_blob"][start:int(ends[row])].tobytes()
+
+    def attributes(self, row: int) -> Dict[str, Any]:
+        return json.loads(self.attribute_bytes(row))
+
+# -----------------------------
+# Extraction jobs (async mode)
+# -----------------------------
+JOB_DIR = os.getenv("JOB_DIR", "extraction_jobs")
+JOB_WORKERS = max(1, int(os.getenv("JOB_WORKERS", "2")))
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETENTION_SECONDS = float(os.getenv("JOB_RETENTION_HOURS", "168")) * 3600
+JOB_TERMINAL_STATES = ("succeeded", "failed")
+
+class JobQueue:
+    """
+    SQLite-backed queue for asynchronous /api/extract requests.
+
+    The upload is spooled to <job_dir>/uploads/ and the job row is committed before the
+    client gets 202, so queued work survives a restart. Workers claim a job by taking a
+    lease; a job whose lease expired (its process died mid-extraction) is picked up again,
+    up to max_attempts. A job turned away by the Gemini circuit breaker or rate limit goes
+    back to the queue until available_at without using up an attempt. Claiming is a single
+    UPDATE, so several server processes can share one database.
+    """
+
+    def __init__(self, job_dir: str = JOB_DIR, workers: int = JOB_WORKERS,
+                 lease_seconds: float = JOB_LEASE_SECONDS, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.job_dir = job_dir
+        self.upload_dir = os.path.join(job_dir, "uploads")
+        self.db_path = os.path.join(job_dir, "jobs.db")
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._threads: List[threading.Thread] = []
+        self._initialized = False
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    def _init_db(self) -> None:
+        if self._initialized:
+            return
+        os.makedirs(self.upload_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    stage TEXT,
+                    filename TEXT,
+                    upload_path TEXT NOT NULL,
+                    dedupe INTEGER NOT NULL DEFAULT 1,
+                    namespace TEXT NOT NULL DEFAULT '',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    lease_until REAL,
+                    available_at REAL,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )""")
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "namespace" not in columns:
+                # Databases created before wardrobe namespaces: their jobs belong to the default one
+                with contextlib.suppress(sqlite3.OperationalError):  # another process added it first
+                    conn.execute("ALTER TABLE jobs ADD COLUMN namespace TEXT NOT NULL DEFAULT ''")
+            if "available_at" not in columns:
+                with contextlib.suppress(sqlite3.OperationalError):
+                    conn.execute("ALTER TABLE jobs ADD COLUMN available_at REAL")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at)")
+            conn.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                         (*JOB_TERMINAL_STATES, time.time() - JOB_RETENTION_SECONDS))
+        self._initialized = True
+
+    def start(self) -> None:
+        """Start the worker threads once per process (also resumes jobs left by a previous run)"""
+        if self._threads:
+            return
+        with self._lock:
+            if self._threads:
+                return
+            self._init_db()
+            for n in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"extract-job-{n}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, upload: "UploadedImage", filename: str, dedupe: bool = True, namespace: str = "") -> str:
+        self.start()
+        job_id = uuid.uuid4().hex
+        _, ext = os.path.splitext(filename or "")
+        upload_path = os.path.join(self.upload_dir, f"{job_id}{ext.lower() or '.jpg'}")
+        upload.copy_to(upload_path)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, stage, filename, upload_path, dedupe, namespace, created_at, updated_at) "
+                "VALUES (?, 'queued', 'queued', ?, ?, ?, ?, ?, ?)",
+                (job_id, filename, upload_path, int(dedupe), namespace, now, now))
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id: str, namespace: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Job status; with namespace, None unless the job was submitted to that wardrobe namespace"""
+        self._init_db()
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None or (namespace is not None and row["namespace"] != namespace):
+            return None
+        job = {
+            "job_id": row["id"],
+            "status": row["status"],
+            "stage": row["stage"],
+            "filename": row["filename"],
+            "attempts": row["attempts"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"]
+        }
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["error"] is not None:
+            job["error"] = row["error"]
+        return job
+
+    def _claim(self) -> Optional[sqlite3.Row]:
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE (status = 'queued' AND (available_at IS NULL OR available_at <= ?)) "
+                "OR (status = 'running' AND lease_until < ?) ORDER BY created_at LIMIT 1", (now, now)).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', stage = 'starting', attempts = attempts + 1, "
+                "lease_until = ?, updated_at = ? WHERE id = ?",
+                (now + self.lease_seconds, now, row["id"]))
+            conn.execute("COMMIT")
+        return row
+
+    def _update(self, job_id: str, **fields: Any) -> None:
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _execute(self, row: sqlite3.Row) -> None:
+        job_id = row["id"]
+        if row["attempts"] >= self.max_attempts:
+            self._update(job_id, status="failed", stage="failed", lease_until=None, attempts=row["attempts"],
+                         error=f"Gave up after {row['attempts']} interrupted attempts")
+            with contextlib.suppress(OSError):
+                os.remove(row["upload_path"])
+            return
+        try:
+            with open(row["upload_path"], "rb") as f:
+                result = process_upload(UploadedImage(f), row["filename"], bool(row["dedupe"]),
+                                        on_stage=lambda stage: self._update(job_id, stage=stage),
+                                        namespace=row["namespace"])
+        except GeminiUnavailableError as e:
+            # Gemini was never called: requeue for when it is expected back, without spending an attempt
+            self._update(job_id, status="queued", stage="waiting_for_gemini", lease_until=None,
+                         attempts=row["attempts"], available_at=time.time() + max(e.retry_after, 1.0))
+            return
+        except Exception as e:
+            print(f"Extraction job {job_id} failed: {e}")
+            self._update(job_id, status="failed", stage="failed", lease_until=None, error=str(e))
+        else:
+            self._update(job_id, status="succeeded", stage="done", lease_until=None,
+                         result=json.dumps(result, ensure_ascii=False))
+        with contextlib.suppress(OSError):
+            os.remove(row["upload_path"])
+
+    def _run(self) -> None:
+        while True:
+            try:
+                row = self._claim()
+            except sqlite3.Error as e:
+                print(f"Job queue error: {e}")
+                row = None
+            if row is None:
+                # Also polls so jobs enqueued by other processes (or with expired leases) get picked up
+                with self._wakeup:
+                    self._wakeup.wait(timeout=1.0)
+                continue
+            self._execute(row)
+
+    def events(self, job_id: str, poll_interval: float = 0.25, heartbeat: float = 15.0):
+        """Server-Sent Events: one 'status' event per state/stage change, ending at a terminal state"""
+        last = None
+        last_sent = time.time()
+        while True:
+            job = self.get(job_id)
+            if job is None:
+                yield f"event: error\ndata: {json.dumps({'error': 'Job not found'})}\n\n"
+                return
+            state = (job["status"], job["stage"])
+            if state != last:
+                last = state
+                last_sent = time.time()
+                yield f"event: status\ndata: {json.dumps(job, ensure_ascii=False)}\n\n"
+                if job["status"] in JOB_TERMINAL_STATES:
+                    return
+            elif time.time() - last_sent >= heartbeat:
+                last_sent = time.time()
+                yield ": keep-alive\n\n"
+            time.sleep(poll_interval)
+
+job_queue = JobQueue()
+
 # -----------------------------
 # API Routes
 # -----------------------------
+@app.before_request
+def start_background_workers():
+    # Resume jobs queued before a restart as soon as this process serves its first request
+    job_queue.start()
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.spans = begin_trace()
+    g.profiler = StackSampler(threading.get_ident()).start() if should_profile(request.headers) else None
+
+def finish_request_trace(method: str, route: str, path: str, status: int, total_ms: float,
+                         spans: List[Tuple[str, float, float]], profile_path: Optional[str] = None) -> str:
+    """Request latency metric and structured log line (Flask hook and asgi.py); returns the Server-Timing value"""
+    http_request_duration.observe(total_ms / 1000, route=route, method=method, status=status)
+    spans = list(spans)
+    if REQUEST_LOG_ENABLED:
+        print(json.dumps({
+            "event": "request",
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            "method": method,
+            "route": route,
+            "path": path,
+            "status": status,
+            "duration_ms": round(total_ms, 2),
+            "spans": [{"name": n, "start_ms": round(st, 2), "duration_ms": round(d, 2)} for n, st, d in spans],
+            "profile": profile_path,
+        }, ensure_ascii=False))
+    return server_timing_header(spans, total_ms)
+
+@app.after_request
+def record_request_latency(response):
+    # Labelled by URL rule (not path) to keep cardinality bounded; SSE responses are timed to the first byte
+    started = g.get("request_started")
+    if started is None:
+        return response
+    total_ms = (time.perf_counter() - started) * 1000
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+    profile_path = None
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.stop()
+        profile_path = write_profile(profiler, route)
+        response.headers["X-Profile-File"] = os.path.basename(profile_path)
+    response.headers["Server-Timing"] = finish_request_trace(
+        request.method, route, request.path, response.status_code, total_ms, g.get("spans") or [], profile_path)
+    return response
+
+@app.after_request
+def vary_on_namespace(response):
+    # Same URL, different wardrobe: shared caches must key on the namespace header too
+    response.vary.add(NAMESPACE_HEADER)
+    return response
+
+@app.teardown_request
+def stop_request_profiler(exc):
+    # after_request is skipped when the view raised; never leave a sampler thread running
+    profiler = g.pop("profiler", None)
+    if profiler is not None:
+        profiler.stop()
+
+def _cache_counts() -> Dict[Tuple[Any, ...], float]:
+    extraction, recommendation = extraction_cache.stats(), recommendation_cache.stats()
+    namespace_hits, namespace_misses = wardrobe_namespaces.recommendation_counts()
+    return {
+        ("extraction", "hit"): extraction["hits"], ("extraction", "miss"): extraction["misses"],
+        ("recommendation", "hit"): recommendation["hits"] + namespace_hits,
+        ("recommendation", "miss"): recommendation["misses"] + namespace_misses,
+    }
+
+metrics.register(GaugeCallback("cache_requests_total", "Cache lookups by cache and result",
+                               ("cache", "result"), _cache_counts, kind="counter"))
+metrics.register(GaugeCallback("wardrobe_items", "Wardrobe items by category.main (default namespace)", ("category",),
+                               lambda: {(c,): wardrobe_store.count(c) for c in ENUMS["category_main"]}))
+metrics.register(GaugeCallback("wardrobe_namespaces_open", "Wardrobe namespaces currently open in this process", (),
+                               lambda: {(): wardrobe_namespaces.stats()["open"]}))
+metrics.register(GaugeCallback("gemini_circuit_open", "1 while the Gemini circuit breaker rejects calls", (),
+                               lambda: {(): 1 if gemini_client.breaker.state == "open" else 0}))
+metrics.register(GaugeCallback("schema_repair_retries_avoided_total",
+                               "Schema-invalid extractions fixed locally instead of a second Gemini call", (),
+                               lambda: {(): schema_repair_stats.stats()["retries_avoided"]}, kind="counter"))
+
 @app.route('/api/health', methods=['GET'])
 def health():
     return jsonify({"status": "ok"})
 
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    """Cache and preprocessing counters for monitoring"""
+    return jsonify({
+        "extraction_cache": extraction_cache.stats(),
+        "image_preprocess": image_preprocess_stats.stats(),
+        "image_variants": image_variants.stats(),
+        "gemini": gemini_client.stats(),
+        "schema_repair": schema_repair_stats.stats(),
+        "recommendation_cache": recommendation_cache.stats(),
+        "namespaces": wardrobe_namespaces.stats()
+    })
+
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text exposition of request, Gemini, extraction, recommendation and cache metrics"""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
 @app.route('/api/images/<filename>', methods=['GET'])
 def serve_image(filename):
-    """Serve images from extracted_attributes/ folder"""
+    """Serve images from the request's wardrobe namespace folder, optionally as a thumbnail variant"""
     try:
-        output_dir = "extracted_attributes"
-        return send_from_directory(output_dir, filename)
+        try:
+            image_file = wardrobe_namespaces.get(namespace_of(request)).image_file(filename)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        path = safe_join(OUTPUT_DIR, image_file)
+        if path is None or os.path.splitext(filename)[1].lower() not in IMAGE_EXTENSIONS or not os.path.isfile(path):
+            return jsonify({"error": "Image not found"}), 404
+
+        try:
+            max_side = resolve_image_variant(request.args.get('size'), request.args.get('w', type=int))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if max_side is not None:
+            variant = image_variants.get(image_file, max_side)
+            if variant is not None:
+                path = variant
+        return send_immutable_file(path)
     except Exception as e:
         return jsonify({"error": str(e)}), 404
 
+MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
+MAX_UPLOAD_REQUEST_SIZE = MAX_UPLOAD_SIZE + 64 * 1024  # /api/extract: one image plus multipart framing
+ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+EXTRACT_BATCH_MAX_FILES = int(os.getenv("EXTRACT_BATCH_MAX_FILES", "20"))
+EXTRACT_MAX_IN_FLIGHT = max(1, int(os.getenv("EXTRACT_MAX_IN_FLIGHT", "4")))
+
+# Shared by every batch request, so the number of concurrent Gemini calls stays bounded server-wide
+extract_executor = ThreadPoolExecutor(max_workers=EXTRACT_MAX_IN_FLIGHT, thread_name_prefix="extract")
+
+# -----------------------------
+# Upload intake (spooling, type sniffing, shared decode)
+# -----------------------------
+# 업로드 파트는 메모리에 UPLOAD_SPOOL_MEMORY_KB까지, 그 이상은 UPLOAD_SPOOL_DIR의 임시 파일로.
+# 스풀 디렉터리는 OUTPUT_DIR과 같은 파일시스템이어야 저장 시 복사 없이 rename으로 옮겨진다.
+UPLOAD_SPOOL_MEMORY = int(os.getenv("UPLOAD_SPOOL_MEMORY_KB", "512")) * 1024
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", os.path.join(OUTPUT_DIR, ".uploads"))
+UPLOAD_SPOOL_MAX_AGE = 3600  # seconds; leftovers of killed workers are removed by create_app()
+# Long side of the single decode shared by Gemini preprocessing and the thumbnail variants
+UPLOAD_DECODE_MAX_SIDE = max(GEMINI_IMAGE_MAX_SIDE, *IMAGE_VARIANT_SIZES.values())
+
+# Leading bytes of each accepted format -> extension the image is saved with
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", ".png"),
+    (b"GIF87a", ".gif"),
+    (b"GIF89a", ".gif"),
+)
+
+def sniff_image_type(head: bytes) -> Optional[str]:
+    """Extension of the image format identified by its first 12+ bytes, None if not an accepted image"""
+    for signature, ext in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return ext
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    return None
+
+class UploadSpool:
+    """
+    Stream for one multipart file part. Kept in memory up to memory_limit bytes, then written to
+    a named temp file in spool_dir that save_upload() can rename into the wardrobe.
+    Bytes past max_size are counted but dropped (with whatever was buffered), so an oversized
+    part costs neither memory nor disk while the rest of the body is parsed.
+    """
+
+    def __init__(self, memory_limit: int = UPLOAD_SPOOL_MEMORY, max_size: int = MAX_UPLOAD_SIZE,
+                 spool_dir: str = UPLOAD_SPOOL_DIR):
+        self.memory_limit = memory_limit
+        self.max_size = max_size
+        self.spool_dir = spool_dir
+        self.size = 0
+        self.path: Optional[str] = None
+        self._file: Any = io.BytesIO()
+
+    @property
+    def too_large(self) -> bool:
+        return self.size > self.max_size
+
+    def write(self, data: bytes) -> int:
+        self.size += len(data)
+        if self.too_large:
+            if self._file.tell():
+                self._file.seek(0)
+                self._file.truncate()
+            return len(data)
+        if self.path is None and self._file.tell() + len(data) > self.memory_limit:
+            os.makedirs(self.spool_dir, exist_ok=True)
+            fd, self.path = tempfile.mkstemp(prefix="upload-", suffix=".part", dir=self.spool_dir)
+            spooled = open(fd, "w+b")
+            spooled.write(self._file.getvalue())
+            self._file = spooled
+        return self._file.write(data)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._file.read(size)
+
+    def readline(self, size: int = -1) -> bytes:
+        return self._file.readline(size)
+
+    def seek(self, offset: int, whence: int = os.SEEK_SET) -> int:
+        return self._file.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def release(self) -> Optional[str]:
+        """Hand over the temp file (None while the part is in memory); the caller moves or removes it"""
+        path, self.path = self.path, None
+        if path is not None:
+            self._file.close()
+            os.chmod(path, 0o644)  # mkstemp creates 0600; match files written with open()
+        return path
+
+    def close(self) -> None:
+        self._file.close()
+        if self.path is not None:
+            with contextlib.suppress(OSError):
+                os.remove(self.path)
+            self.path = None
+
+def upload_spool(file) -> Optional[UploadSpool]:
+    """The UploadSpool behind a FileStorage, if it was parsed by UploadRequest"""
+    return file.stream if isinstance(file.stream, UploadSpool) else None
+
+class UploadedImage:
+    """
+    One upload read through its stream (an UploadSpool, or a queued job's file) instead of as
+    one bytes object: the type is sniffed from the first bytes, the sha256 is computed in chunks
+    on first use, and the shared decode reads the stream directly. read() loads the whole
+    image only for consumers that need the bytes (decode failed, preprocessing disabled, or
+    an in-memory spool being saved).
+    """
+
+    CHUNK_SIZE = 256 * 1024
+
+    def __init__(self, stream: Any, size: Optional[int] = None):
+        self.stream = stream
+        if size is None:
+            size = stream.seek(0, os.SEEK_END)
+        self.size = size
+        self.ext = sniff_image_type(self.head(16))
+        self._digest: Optional[str] = None
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "UploadedImage":
+        return cls(io.BytesIO(data), len(data))
+
+    def open(self) -> Any:
+        """The stream, rewound"""
+        self.stream.seek(0)
+        return self.stream
+
+    def head(self, n: int) -> bytes:
+        return self.open().read(n)
+
+    def read(self) -> bytes:
+        return self.open().read()
+
+    @property
+    def digest(self) -> str:
+        """sha256 hex digest of the content (the extraction cache key)"""
+        if self._digest is None:
+            sha = hashlib.sha256()
+            stream = self.open()
+            for chunk in iter(lambda: stream.read(self.CHUNK_SIZE), b""):
+                sha.update(chunk)
+            self._digest = sha.hexdigest()
+        return self._digest
+
+    def bytes_for(self, decoded: Optional[DecodedImage]) -> Optional[bytes]:
+        """Bytes for extract_attributes: None when it works from the shared decode alone"""
+        if GEMINI_IMAGE_PREPROCESS and decoded is not None and decoded.image is not None:
+            return None
+        return self.read()
+
+    def copy_to(self, path: str) -> None:
+        with open(path, "wb") as f:
+            shutil.copyfileobj(self.open(), f, self.CHUNK_SIZE)
+
+def sweep_upload_spool(max_age: float = UPLOAD_SPOOL_MAX_AGE) -> int:
+    """Remove spool files left behind by killed workers; returns how many were removed"""
+    removed = 0
+    cutoff = time.time() - max_age
+    with contextlib.suppress(FileNotFoundError):
+        for entry in os.scandir(UPLOAD_SPOOL_DIR):
+            if entry.name.startswith("upload-") and entry.stat().st_mtime < cutoff:
+                with contextlib.suppress(OSError):
+                    os.remove(entry.path)
+                    removed += 1
+    return removed
+
+class UploadRequest(Request):
+    """Flask request whose multipart file parts are streamed into UploadSpools"""
+
+    def _get_file_stream(self, total_content_length: Optional[int], content_type: Optional[str],
+                         filename: Optional[str] = None, content_length: Optional[int] = None) -> Any:
+        return UploadSpool()
+
+app.request_class = UploadRequest
+# Whole-request cap (a full batch); /api/extract checks Content-Length against MAX_UPLOAD_REQUEST_SIZE
+app.config["MAX_CONTENT_LENGTH"] = MAX_UPLOAD_SIZE * EXTRACT_BATCH_MAX_FILES + 1024 * 1024
+
+def upload_too_large_message() -> str:
+    return f"File size exceeds maximum allowed size ({MAX_UPLOAD_SIZE // (1024 * 1024)}MB)"
+
+# Oversized uploads get 400 like every other rejected upload (clients match on it)
+@app.errorhandler(RequestEntityTooLarge)
+def request_entity_too_large(e):
+    return jsonify({"error": upload_too_large_message()}), 400
+
+def read_upload(file) -> UploadedImage:
+    """Validate an uploaded file (size, format sniffed from its content) without reading it into memory;
+    raises ValueError. The client's filename and Content-Type are not trusted."""
+    if file.filename == '':
+        raise ValueError("No file selected")
+
+    # File size validation (max 10MB): counted while the part was spooled
+    spool = upload_spool(file)
+    if spool is not None:
+        file_size = spool.size
+    else:
+        file.seek(0, os.SEEK_END)
+        file_size = file.tell()
+        file.seek(0)
+
+    if file_size > MAX_UPLOAD_SIZE:
+        raise ValueError(f"{upload_too_large_message()}. Your file is {file_size / (1024*1024):.1f}MB")
+
+    # File type validation by magic bytes
+    upload = UploadedImage(file.stream, file_size)
+    if upload.ext is None:
+        raise ValueError(f"Invalid file type. Allowed: {', '.join(sorted(ALLOWED_EXTENSIONS))}")
+    return upload
+
+def decode_upload(upload: UploadedImage) -> Optional[DecodedImage]:
+    """The shared decode of an upload, read from its stream; None if Pillow cannot read it
+    (consumers then decode themselves)"""
+    try:
+        with span("decode"):
+            return decode_image(upload.open(), UPLOAD_DECODE_MAX_SIDE)
+    except Exception as e:
+        print(f"Image decode error: {e}")
+        return None
+
+def prerender_variants(decoded: Optional[DecodedImage]) -> Optional[Future]:
+    """Thumbnail variants encoded from the shared decode, overlapping the Gemini call"""
+    if decoded is None or not IMAGE_VARIANT_PREGENERATE:
+        return None
+    return image_variants.prerender(decoded)
+
+def find_near_duplicate(upload: UploadedImage, decoded: Optional[DecodedImage] = None, namespace: str = ""
+                        ) -> Tuple[Optional[int], Optional[Tuple[int, Dict[str, Any]]]]:
+    """Near-duplicate lookup (re-photographed / recompressed uploads) within one wardrobe namespace:
+    (image dHash, (distance, item) or None)"""
+    try:
+        with span("dedupe"):
+            if decoded is not None and decoded.image is not None:
+                image_hash = dhash(decoded.image)
+            else:
+                image_hash = image_dhash(upload.read())
+            return image_hash, wardrobe_namespaces.get(namespace).phash.nearest(image_hash)
+    except Exception as e:
+        print(f"Perceptual hash error: {e}")
+        return None, None
+
+def reusable_duplicate(upload: UploadedImage, decoded: Optional[DecodedImage],
+                       near_duplicate: Tuple[int, Dict[str, Any]], namespace: str = "") -> bool:
+    """Whether a near-duplicate's attributes may be copied: same outline (dHash) is not enough,
+    its stored image must also have the upload's colors"""
+    try:
+        with span("dedupe_color"):
+            if decoded is not None and decoded.image is not None:
+                upload_colors = color_grid(decoded.image)
+            else:
+                upload_colors = image_color_grid(upload.read())
+            with open(wardrobe_namespaces.get(namespace).phash.image_path(near_duplicate[1]), "rb") as f:
+                return colors_match(upload_colors, image_color_grid(f.read()))
+    except Exception as e:
+        print(f"Near-duplicate color check error: {e}")
+        return False
+
+def dedupe_upload(upload: UploadedImage, decoded: Optional[DecodedImage], dedupe: bool, namespace: str = ""
+                  ) -> Tuple[Optional[int], Optional[Tuple[int, Dict[str, Any]]], bool]:
+    """find_near_duplicate plus whether the match's attributes are reused instead of calling Gemini
+    (PHASH_MODE=reuse, dedupe requested and the colors match)"""
+    image_hash, near_duplicate = find_near_duplicate(upload, decoded, namespace)
+    reuse = (near_duplicate is not None and PHASH_MODE == "reuse" and dedupe
+             and reusable_duplicate(upload, decoded, near_duplicate, namespace))
+    return image_hash, near_duplicate, reuse
+
+def save_upload(upload: UploadedImage, original_filename: str, attributes: Dict[str, Any], cache_hit: bool,
+                image_hash: Optional[int], near_duplicate: Optional[Tuple[int, Dict[str, Any]]],
+                reused: bool, variants: Optional[Future] = None,
+                spool: Optional[UploadSpool] = None, namespace: str = "") -> Dict[str, Any]:
+    """Save an extracted upload to a namespace's wardrobe and build the /api/extract response
+    (variants: an image_variants.prerender() future; spool: the upload's UploadSpool, whose temp
+    file is renamed into place instead of writing a copy)"""
+    wardrobe = wardrobe_namespaces.get(namespace)
+    # Use milliseconds and random suffix to prevent collisions
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    milliseconds = int(time.time() * 1000) % 1000
+    random_suffix = random.randint(1000, 9999)
+    base_id = f"attributes_{timestamp}_{milliseconds:03d}_{random_suffix}"
+
+    # Extension of the sniffed format; the original filename only for content that was not sniffed
+    # (jobs queued before validation by content), else jpg
+    ext = upload.ext
+    if ext is None:
+        _, ext = os.path.splitext(original_filename or "")
+        if ext.lower() not in IMAGE_EXTENSIONS:
+            ext = '.jpg'
+
+    with span("save"):
+        move_from = spool.release() if spool is not None else None
+        image_bytes = upload.read() if move_from is None else None
+        _, saved_to = wardrobe.store.save(base_id, attributes, image_bytes, ext, move_from=move_from)
+    wardrobe.recommendations.invalidate()
+    if image_hash is not None:
+        wardrobe.phash.add(base_id, image_hash)
+    if IMAGE_VARIANT_PREGENERATE:
+        image_variants.pregenerate(wardrobe.image_file(f"{base_id}{ext}"), variants)
+
+    # Add image URL to response
+    image_url = _image_url(base_id, ext, namespace)
+
+    response = {
+        "success": True,
+        "attributes": attributes,
+        "saved_to": saved_to,
+        "image_url": image_url,
+        "item_id": base_id,
+        "cached": cache_hit
+    }
+    if near_duplicate:
+        distance, duplicate_item = near_duplicate
+        response["near_duplicate"] = {
+            "item_id": duplicate_item["id"],
+            "distance": distance,
+            "image_url": duplicate_item.get("image_url"),
+            "attributes": duplicate_item["attributes"],
+            "reused": reused
+        }
+    return response
+
+def process_upload(upload: UploadedImage, original_filename: str, dedupe: bool = True,
+                   on_stage: Optional[Callable[[str], None]] = None,
+                   on_field: Optional[Callable[[str, Any], None]] = None,
+                   spool: Optional[UploadSpool] = None, namespace: str = "") -> Dict[str, Any]:
+    """Extract (or reuse) attributes for one image, save it to a namespace's wardrobe and build the response.
+    The image is decoded once; the thumbnails, dHash and Gemini preprocessing all use that decode.
+    spool: see save_upload (only while the request that owns it is still open)."""
+    on_stage = on_stage or (lambda stage: None)
+    decoded = decode_upload(upload)
+    variants = prerender_variants(decoded)
+
+    # Near-duplicate lookup before calling Gemini
+    image_hash = None
+    near_duplicate = None
+    reused = False
+    if PHASH_MODE in ("reuse", "offer"):
+        on_stage("deduplicating")
+        image_hash, near_duplicate, reused = dedupe_upload(upload, decoded, dedupe, namespace)
+
+    if reused:
+        attributes, cache_hit = json.loads(json.dumps(near_duplicate[1]["attributes"])), False
+    else:
+        on_stage("extracting")
+        attributes, cache_hit = extract_attributes_cached(upload, on_field=on_field, decoded=decoded)
+
+    # Save attributes and image through the storage backend
+    on_stage("saving")
+    return save_upload(upload, original_filename, attributes, cache_hit, image_hash, near_duplicate, reused,
+                       variants, spool, namespace)
+
+async def process_upload_async(upload: UploadedImage, original_filename: str, dedupe: bool = True,
+                               spool: Optional[UploadSpool] = None, namespace: str = "") -> Dict[str, Any]:
+    """process_upload for the async serving path: decoding, hashing and saving in worker threads, Gemini awaited"""
+    decoded = await asyncio.to_thread(decode_upload, upload)
+    variants = prerender_variants(decoded)
+
+    image_hash = None
+    near_duplicate = None
+    reused = False
+    if PHASH_MODE in ("reuse", "offer"):
+        image_hash, near_duplicate, reused = await asyncio.to_thread(dedupe_upload, upload, decoded, dedupe,
+                                                                     namespace)
+
+    if reused:
+        attributes, cache_hit = json.loads(json.dumps(near_duplicate[1]["attributes"])), False
+    else:
+        attributes, cache_hit = await extract_attributes_cached_async(upload, decoded=decoded)
+
+    return await asyncio.to_thread(save_upload, upload, original_filename, attributes, cache_hit,
+                                   image_hash, near_duplicate, reused, variants, spool, namespace)
+
+def extract_event_stream(upload: UploadedImage, filename: str, dedupe: bool, namespace: str = ""):
+    """
+    Server-Sent Events for one extraction: a "field" event per top-level attribute as Gemini
+    streams it (raw, not yet validated), then "result" (same body as /api/extract) or "error"
+    """
+    events: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+
+    def run() -> None:
+        try:
+            result = process_upload(upload, filename, dedupe,
+                                    on_field=lambda key, value: events.put(("field", {"key": key, "value": value})),
+                                    namespace=namespace)
+            events.put(("result", result))
+        except Exception as e:
+            events.put(("error", {"error": str(e)}))
+
+    extract_executor.submit(run)
+    while True:
+        try:
+            event, data = events.get(timeout=15)
+        except queue.Empty:
+            yield ": keep-alive\n\n"
+            continue
+        yield f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        if event != "field":
+            return
+
 @app.route('/api/extract', methods=['POST'])
 def extract():
     """Extract clothing attributes from uploaded image"""
     try:
+        # Reject before the body is read when the client announces more than one image's worth
+        if request.content_length is not None and request.content_length > MAX_UPLOAD_REQUEST_SIZE:
+            return jsonify({"error": upload_too_large_message()}), 400
+        try:
+            namespace = namespace_of(request)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         if 'image' not in request.files:
             return jsonify({"error": "No image file provided"}), 400
-        
+
         file = request.files['image']
-        if file.filename == '':
-            return jsonify({"error": "No file selected"}), 400
+        try:
+            upload = read_upload(file)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        # File size validation (max 10MB)
-        MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        file.seek(0)
-        
-        if file_size > MAX_FILE_SIZE:
-            return jsonify({"error": f"File size exceeds maximum allowed size (10MB). Your file is {file_size / (1024*1024):.1f}MB"}), 400
-        
-        # File type validation
-        ALLOWED_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
-        ALLOWED_MIME_TYPES = {'image/jpeg', 'image/jpg', 'image/png', 'image/gif', 'image/webp'}
-        
-        filename = file.filename.lower()
-        file_ext = os.path.splitext(filename)[1]
-        mime_type = file.content_type
-        
-        if file_ext not in ALLOWED_EXTENSIONS:
-            return jsonify({"error": f"Invalid file type. Allowed: {', '.join(ALLOWED_EXTENSIONS)}"}), 400
-        
-        if mime_type and mime_type not in ALLOWED_MIME_TYPES:
-            return jsonify({"error": f"Invalid MIME type. Allowed: {', '.join(ALLOWED_MIME_TYPES)}"}), 400
+        dedupe = request.form.get('dedupe', 'true').lower() == 'true'
+        run_async = (request.args.get('async') or request.form.get('async', 'false')).lower() == 'true'
+        if run_async:
+            job_id = job_queue.enqueue(upload, file.filename, dedupe, namespace)
+            response = jsonify({
+                "job_id": job_id,
+                "status": "queued",
+                "status_url": f"/api/jobs/{job_id}",
+                "events_url": f"/api/jobs/{job_id}/events"
+            })
+            response.headers["Location"] = f"/api/jobs/{job_id}"
+            return response, 202
+        if request.args.get('stream', 'false').lower() == 'true':
+            return Response(
+                # The worker may outlive the request (client gone) and with it the spool: keep a copy
+                stream_with_context(extract_event_stream(UploadedImage.from_bytes(upload.read()), file.filename,
+                                                         dedupe, namespace)),
+                mimetype="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+        return jsonify(process_upload(upload, file.filename, dedupe, spool=upload_spool(file), namespace=namespace))
 
-        image_bytes = file.read()
-        attributes = extract_attributes(image_bytes)
-        
-        # Save to JSON file and image file
-        output_dir = "extracted_attributes"
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Use milliseconds and random suffix to prevent collisions
-        import time
-        import random
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        milliseconds = int(time.time() * 1000) % 1000
-        random_suffix = random.randint(1000, 9999)
-        base_id = f"attributes_{timestamp}_{milliseconds:03d}_{random_suffix}"
-        
-        # Save JSON
-        json_filename = f"{output_dir}/{base_id}.json"
-        with open(json_filename, 'w', encoding='utf-8') as f:
-            json.dump(attributes, f, ensure_ascii=False, indent=2)
-        
-        # Save image file
-        # Get original file extension or default to jpg
-        original_filename = file.filename
-        if original_filename:
-            _, ext = os.path.splitext(original_filename)
-            if ext.lower() not in ['.jpg', '.jpeg', '.png', '.gif', '.webp']:
-                ext = '.jpg'
-        else:
-            ext = '.jpg'
-        
-        image_filename = f"{output_dir}/{base_id}{ext}"
-        with open(image_filename, 'wb') as f:
-            f.write(image_bytes)
-        
-        # Add image URL to response
-        image_url = f"/api/images/{base_id}{ext}"
-        
+    except GeminiUnavailableError as e:
+        response = jsonify({"error": str(e)})
+        response.headers["Retry-After"] = str(max(1, int(e.retry_after + 0.5)))
+        return response, 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/extract/batch', methods=['POST'])
+def extract_batch():
+    """Extract attributes for many uploaded images concurrently; results keep the input order"""
+    try:
+        try:
+            namespace = namespace_of(request)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        files = request.files.getlist('images') or request.files.getlist('image')
+        if not files:
+            return jsonify({"error": "No image files provided (use the 'images' field)"}), 400
+        if len(files) > EXTRACT_BATCH_MAX_FILES:
+            return jsonify({"error": f"Too many files. Maximum {EXTRACT_BATCH_MAX_FILES} per batch"}), 400
+
+        dedupe = request.form.get('dedupe', 'true').lower() == 'true'
+
+        # Uploads are read on the request thread; only extraction and saving run on the pool
+        results: List[Optional[Dict[str, Any]]] = [None] * len(files)
+        futures = {}
+        for index, file in enumerate(files):
+            try:
+                upload = read_upload(file)
+            except ValueError as e:
+                results[index] = {"success": False, "error": str(e), "status": 400}
+                continue
+            # The request (and its spools) stays open until every future is collected below
+            futures[index] = extract_executor.submit(process_upload, upload, file.filename, dedupe,
+                                                     spool=upload_spool(file), namespace=namespace)
+
+        for index, future in futures.items():
+            try:
+                results[index] = future.result()
+            except GeminiUnavailableError as e:
+                results[index] = {"success": False, "error": str(e), "status": 503}
+            except Exception as e:
+                results[index] = {"success": False, "error": str(e), "status": 500}
+
+        for index, (file, result) in enumerate(zip(files, results)):
+            result["index"] = index
+            result["filename"] = file.filename
+
+        succeeded = sum(1 for result in results if result["success"])
         return jsonify({
-            "success": True,
-            "attributes": attributes,
-            "saved_to": json_filename,
-            "image_url": image_url,
-            "item_id": base_id
+            "success": succeeded > 0,
+            "results": results,
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded
         })
-    
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of an asynchronous extraction job (result included once it succeeded)"""
+    try:
+        try:
+            namespace = namespace_of(request)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        job = job_queue.get(job_id, namespace)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(job)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Server-Sent Events stream of job progress"""
+    try:
+        namespace = namespace_of(request)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if job_queue.get(job_id, namespace) is None:
+        return jsonify({"error": "Job not found"}), 404
+    return Response(
+        stream_with_context(job_queue.events(job_id)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+WARDROBE_PAGE_DEFAULT = 50
+WARDROBE_PAGE_MAX = 500
+ITEM_FIELDS = ("id", "filename", "image_url", "attributes")
+
+def encode_cursor(item_id: str) -> str:
+    return base64.urlsafe_b64encode(item_id.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        return base64.b64decode(cursor + "=" * (-len(cursor) % 4), altchars=b"-_", validate=True).decode("utf-8")
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """fields=id,image_url,category -> item keys and/or top-level attribute keys (None = everything)"""
+    if not fields:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in ITEM_FIELDS and name not in REQUIRED_TOP_KEYS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Allowed: {', '.join(ITEM_FIELDS + tuple(sorted(REQUIRED_TOP_KEYS)))}")
+    return names
+
+def project_item(item: Dict[str, Any], fields: Optional[List[str]]) -> Dict[str, Any]:
+    """Keep only the requested fields; attribute keys stay nested under "attributes" """
+    if fields is None:
+        return item
+    out: Dict[str, Any] = {}
+    for name in fields:
+        if name in ITEM_FIELDS:
+            out[name] = item.get(name)
+        else:
+            out.setdefault("attributes", {})[name] = item.get("attributes", {}).get(name)
+    if "attributes" in fields:
+        out["attributes"] = item.get("attributes")
+    return out
+
 @app.route('/api/wardrobe/items', methods=['GET'])
 def get_wardrobe_items():
-    """Get all wardrobe items from extracted_attributes/ folder"""
+    """
+    Wardrobe items in id order. Optional filters: category, color (comma-separated), season,
+    formality_min / formality_max, style. Pagination: limit + cursor (next_cursor in the response);
+    without either, every match is returned. fields= projects each item. Unchanged wardrobe +
+    same query -> 304 via ETag / If-None-Match. Scoped to the request's wardrobe namespace.
+    """
     try:
+        try:
+            namespace = namespace_of(request)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        store = wardrobe_namespaces.get(namespace).store
+
+        # The representation depends only on the namespace, its wardrobe version and the query,
+        # so the ETag can be checked before any item is loaded
+        query_string = "&".join(f"{key}={value}" for key, value in sorted(request.args.items(multi=True)))
+        etag = hashlib.sha256(f"{namespace}\0{store.version()}?{query_string}".encode("utf-8")).hexdigest()[:32]
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
+
         category = request.args.get('category', None)  # Optional filter
+        colors = [c.strip().lower() for c in request.args.get('color', '').split(',') if c.strip()] or None
+        try:
+            fields = parse_fields(request.args.get('fields'))
+            formality_min = request.args.get('formality_min', type=float)
+            formality_max = request.args.get('formality_max', type=float)
+            cursor = request.args.get('cursor')
+            after = decode_cursor(cursor) if cursor else None
+            limit = request.args.get('limit', type=int)
+            if limit is None and cursor:
+                limit = WARDROBE_PAGE_DEFAULT
+            if limit is not None and not 1 <= limit <= WARDROBE_PAGE_MAX:
+                raise ValueError(f"limit must be between 1 and {WARDROBE_PAGE_MAX}")
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        items, total, last_id = store.query(
+            category=category.lower() if category else None,
+            colors=colors,
+            season=request.args.get('season'),
+            formality_min=formality_min,
+            formality_max=formality_max,
+            style=request.args.get('style'),
+            after=after,
+            limit=limit,
+            with_attributes=fields is None or any(name not in ("id", "filename", "image_url") for name in fields)
+        )
         
-        items = load_wardrobe_items()
-        
-        # Filter by category if provided
-        if category:
-            filtered = []
-            for item in items:
-                item_category = item.get("attributes", {}).get("category", {}).get("main", "")
-                if item_category == category.lower():
-                    filtered.append(item)
-            items = filtered
-        
-        return jsonify({
+        response = jsonify({
             "success": True,
-            "items": items,
-            "count": len(items)
+            "items": [project_item(item, fields) for item in items],
+            "count": len(items),
+            "total": total,
+            "next_cursor": encode_cursor(last_id) if last_id else None
         })
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 # Cache for Gemini recommendations (in-memory, simple cache)
-_gemini_cache = {}
-_cache_max_size = 100
+RECOMMEND_CACHE_SIZE = int(os.getenv("RECOMMEND_CACHE_SIZE", "256"))
+RECOMMEND_CACHE_TTL = float(os.getenv("RECOMMEND_CACHE_TTL", "3600"))
+RECOMMEND_CACHE_DB = os.getenv("RECOMMEND_CACHE_DB", "")  # e.g. extraction_cache/recommend.db; empty = memory only
+
+class RecommendationCache:
+    """
+    Gemini outfit picks keyed by a digest of exactly what the prompt is built from.
+
+    Memory tier: LRU with per-entry TTL. Optional SQLite tier (db_path) shared by every
+    worker process and surviving restarts; memory misses fall through to it and hits are
+    promoted. Keys are content-addressed, so a stale hit for a changed wardrobe is impossible
+    even across processes; invalidate() additionally drops everything when items are added.
+    One cache per wardrobe namespace: SQLite rows are keyed "<namespace>/<digest>" (bare digest
+    for the default namespace), so invalidating one wardrobe leaves the others' entries alone.
+    """
+
+    def __init__(self, max_entries: int = RECOMMEND_CACHE_SIZE, ttl: float = RECOMMEND_CACHE_TTL,
+                 db_path: str = RECOMMEND_CACHE_DB, namespace: str = ""):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.namespace = namespace
+        self._entries: "OrderedDict[str, Tuple[float, List[Dict[str, Any]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_ready = False
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(candidates: List[Dict[str, Any]], count: int) -> str:
+        """Stable digest of the candidate pairs (ids + attributes), request count and model"""
+        h = hashlib.sha256(f"{GEMINI_MODEL_NAME}\0{count}".encode("utf-8"))
+        seen = set()
+        for candidate in candidates:
+            h.update(f"\0{candidate['top'].get('id')}:{candidate['bottom'].get('id')}".encode("utf-8"))
+            for item in (candidate["top"], candidate["bottom"]):
+                if item.get("id") not in seen:
+                    seen.add(item.get("id"))
+                    h.update(json.dumps(item.get("attributes", {}), sort_keys=True, ensure_ascii=False).encode("utf-8"))
+        return h.hexdigest()
+
+    @contextlib.contextmanager
+    def _connect(self):
+        if not self._db_ready:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=5, isolation_level=None)
+        try:
+            if not self._db_ready:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("CREATE TABLE IF NOT EXISTS recommendations (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)")
+                self._db_ready = True
+            yield conn
+        finally:
+            conn.close()
+
+    def _db_key(self, key: str) -> str:
+        return f"{self.namespace}/{key}" if self.namespace else key
+
+    def _remember(self, key: str, expires_at: float, value: List[Dict[str, Any]]) -> None:
+        # caller holds self._lock
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    row = conn.execute("SELECT value, expires_at FROM recommendations WHERE key = ? AND expires_at > ?",
+                                       (self._db_key(key), now)).fetchone()
+            except sqlite3.Error as e:
+                print(f"Recommendation cache read error: {e}")
+                row = None
+            if row is not None:
+                value = json.loads(row[0])
+                with self._lock:
+                    self._remember(key, row[1], value)
+                    self.hits += 1
+                    self.db_hits += 1
+                return value
 
-def _get_cache_key(tops: List[Dict[str, Any]], bottoms: List[Dict[str, Any]], count: int) -> str:
-    """Generate cache key from tops and bottoms IDs"""
-    top_ids = sorted([t.get("id") for t in tops])
-    bottom_ids = sorted([b.get("id") for b in bottoms])
-    return f"{hash(tuple(top_ids))}_{hash(tuple(bottom_ids))}_{count}"
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, value: List[Dict[str, Any]]) -> None:
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, value)
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    conn.execute("INSERT OR REPLACE INTO recommendations (key, value, expires_at) VALUES (?, ?, ?)",
+                                 (self._db_key(key), json.dumps(value, ensure_ascii=False), expires_at))
+                    conn.execute("DELETE FROM recommendations WHERE expires_at <= ?", (time.time(),))
+            except sqlite3.Error as e:
+                print(f"Recommendation cache write error: {e}")
+
+    def invalidate(self) -> None:
+        """Drop every entry of this namespace (memory and SQLite tier), e.g. after a wardrobe item was added"""
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+        if self.db_path:
+            try:
+                with self._connect() as conn:
+                    if self.namespace:
+                        # "<namespace>/" prefix as a key range ("0" sorts right after "/")
+                        conn.execute("DELETE FROM recommendations WHERE key >= ? AND key < ?",
+                                     (f"{self.namespace}/", f"{self.namespace}0"))
+                    else:
+                        conn.execute("DELETE FROM recommendations WHERE instr(key, '/') = 0")
+            except sqlite3.Error as e:
+                print(f"Recommendation cache invalidate error: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "size": len(self._entries),
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "shared": bool(self.db_path)
+            }
 
-def recommend_outfit_with_gemini(tops: List[Dict[str, Any]], bottoms: List[Dict[str, Any]], count: int = 1, top_candidates: int = 5) -> List[Dict[str, Any]]:
+recommendation_cache = RecommendationCache()
+
+RECOMMEND_LATENCY_BUDGET_MS = int(os.getenv("RECOMMEND_LATENCY_BUDGET_MS", "5000"))
+RECOMMEND_LATENCY_BUDGET_MAX_MS = int(os.getenv("RECOMMEND_LATENCY_BUDGET_MAX_MS", "30000"))
+GEMINI_REQUEST_TIMEOUT = float(os.getenv("GEMINI_REQUEST_TIMEOUT", "60"))
+
+# Gemini recommendations run here so the request thread can give up at its deadline while the
+# call finishes in the background and fills recommendation_cache for the next request
+recommend_executor = ThreadPoolExecutor(max_workers=int(os.getenv("RECOMMEND_GEMINI_WORKERS", "4")),
+                                        thread_name_prefix="recommend-gemini")
+# Calls submitted (running + queued) at most; beyond that requests skip Gemini ("saturated")
+# instead of piling up work that would only start after their deadline
+RECOMMEND_GEMINI_MAX_PENDING = max(1, int(os.getenv("RECOMMEND_GEMINI_MAX_PENDING", "16")))
+recommend_pending = threading.BoundedSemaphore(RECOMMEND_GEMINI_MAX_PENDING)
+
+def recommendation_steps(tops: List[Dict[str, Any]], bottoms: List[Dict[str, Any]], count: int = 1, top_candidates: int = 5,
+                         features: Optional[Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]] = None,
+                         cache: Optional[RecommendationCache] = None):
     """
     Use Gemini to recommend outfit combinations with optimization:
     1. Pre-filter with rule-based scoring (fast)
     2. Send only top candidates to Gemini (reduces prompt size)
     3. Use caching for repeated requests
+    Written without I/O: yields the prompt, receives the response text (or has the call's
+    exception thrown in) and returns the recommendations; see run_gemini_steps(_async).
+    cache: the wardrobe namespace's RecommendationCache (default: recommendation_cache).
     """
+    if cache is None:
+        cache = recommendation_cache
     try:
-        # Check cache first
-        cache_key = _get_cache_key(tops, bottoms, count)
-        if cache_key in _gemini_cache:
-            cached_result = _gemini_cache[cache_key]
+        # Step 1: Pre-filter with rule-based scoring (vectorized top-k, no full candidate list)
+        with span("prefilter"):
+            top_candidates_list = [{
+                "top": tops[i],
+                "bottom": bottoms[j],
+                "score": score
+            } for score, i, j in top_outfit_pairs(tops, bottoms, top_candidates, features=features)]
+        
+        if not top_candidates_list:
+            return []
+        
+        # Check cache: the key covers exactly the candidates the prompt is built from
+        with span("cache"):
+            cache_key = RecommendationCache.key(top_candidates_list, count)
+            cached_result = cache.get(cache_key)
+        if cached_result:
+            candidate_items = {}
+            for candidate in top_candidates_list:
+                candidate_items[candidate["top"].get("id")] = candidate["top"]
+                candidate_items[candidate["bottom"].get("id")] = candidate["bottom"]
             # Return cached items with full data
             result = []
             for cached in cached_result:
-                top_item = next((t for t in tops if t.get("id") == cached["top_id"]), None)
-                bottom_item = next((b for b in bottoms if b.get("id") == cached["bottom_id"]), None)
+                top_item = candidate_items.get(cached["top_id"])
+                bottom_item = candidate_items.get(cached["bottom_id"])
                 if top_item and bottom_item:
                     result.append({
                         "top": top_item,
@@ -865,25 +5062,8 @@ def recommend_outfit_with_gemini(tops: List[Dict[str, Any]], bottoms: List[Dict[
             if result:
                 return result[:count]
         
-        # Step 1: Pre-filter with rule-based scoring (fast)
-        candidates = []
-        for top in tops:
-            for bottom in bottoms:
-                score, _ = calculate_outfit_score(top, bottom)
-                candidates.append({
-                    "top": top,
-                    "bottom": bottom,
-                    "score": score
-                })
-        
-        # Sort and take top candidates
-        candidates.sort(key=lambda x: x["score"], reverse=True)
-        top_candidates_list = candidates[:min(top_candidates, len(candidates))]
-        
-        if not top_candidates_list:
-            return []
-        
         # Step 2: Prepare only top candidates for Gemini (reduces prompt size significantly)
+        prompt_started = time.perf_counter()
         tops_summary = []
         bottoms_summary = []
         candidate_tops = {}
@@ -936,20 +5116,14 @@ Return JSON array with {count} object(s):
 
 JSON only, no markdown."""
 
-        # Step 4: Call Gemini with timeout
-        import signal
-        
+        record_span("prompt", prompt_started)
+
+        # Step 4: Call Gemini (done by the driver; the reply or its exception comes back here)
         try:
-            response = model.generate_content(
-                prompt,
-                generation_config={
-                    "temperature": 0.7,
-                    "max_output_tokens": 500,  # Limit response size
-                }
-            )
-            response_text = response.text.strip()
+            response_text = (yield prompt).strip()
         except Exception as e:
             print(f"Gemini API error: {e}")
+            recommend_fallbacks.inc(reason="gemini_error")
             # Fallback to rule-based
             return [{
                 "top": c["top"],
@@ -961,8 +5135,10 @@ JSON only, no markdown."""
             } for c in top_candidates_list[:count]]
         
         # Step 5: Parse response
-        parsed, repaired = parse_json_from_text(response_text)
+        with span("parse"):
+            parsed, repaired = parse_json_from_text(response_text)
         if parsed is None:
+            recommend_fallbacks.inc(reason="parse_failed")
             # Fallback to rule-based
             return [{
                 "top": c["top"],
@@ -977,6 +5153,7 @@ JSON only, no markdown."""
         if isinstance(parsed, dict):
             parsed = [parsed]
         elif not isinstance(parsed, list):
+            recommend_fallbacks.inc(reason="invalid_response")
             # Fallback if parsed is neither dict nor list
             return [{
                 "top": c["top"],
@@ -1014,9 +5191,9 @@ JSON only, no markdown."""
                     "style_description": rec.get("style_description", "")
                 })
         
-        # Cache the result (with size limit)
-        if cache_data and len(_gemini_cache) < _cache_max_size:
-            _gemini_cache[cache_key] = cache_data
+        # Cache the result (LRU + TTL)
+        if cache_data:
+            cache.put(cache_key, cache_data)
         
         return result[:count]
     
@@ -1024,19 +5201,64 @@ JSON only, no markdown."""
         print(f"Gemini recommendation error: {e}")
         # Fallback to rule-based
         candidates = []
-        for top in tops[:10]:  # Limit for fallback
-            for bottom in bottoms[:10]:
-                score, reasons = calculate_outfit_score(top, bottom)
-                candidates.append({
-                    "top": top,
-                    "bottom": bottom,
-                    "score": score,
-                    "reasoning": ", ".join(reasons),
-                    "style_description": f"{top.get('attributes', {}).get('category', {}).get('sub', 'Top')} & {bottom.get('attributes', {}).get('category', {}).get('sub', 'Bottom')}",
-                    "reasons": reasons
-                })
-        candidates.sort(key=lambda x: x["score"], reverse=True)
-        return candidates[:count]
+        for score, i, j in top_outfit_pairs_scalar(tops[:10], bottoms[:10], count):  # Limit for fallback
+            top, bottom = tops[i], bottoms[j]
+            _, reasons = calculate_outfit_score(top, bottom)
+            candidates.append({
+                "top": top,
+                "bottom": bottom,
+                "score": score,
+                "reasoning": ", ".join(reasons),
+                "style_description": f"{top.get('attributes', {}).get('category', {}).get('sub', 'Top')} & {bottom.get('attributes', {}).get('category', {}).get('sub', 'Bottom')}",
+                "reasons": reasons
+            })
+        return candidates
+
+RECOMMEND_GENERATION_CONFIG = {
+    "temperature": 0.7,
+    "max_output_tokens": 500,  # Limit response size
+}
+
+def recommend_outfit_with_gemini(tops: List[Dict[str, Any]], bottoms: List[Dict[str, Any]], count: int = 1, top_candidates: int = 5,
+                                 features: Optional[Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]] = None,
+                                 cache: Optional[RecommendationCache] = None) -> List[Dict[str, Any]]:
+    """recommendation_steps with a blocking Gemini call (hard transport timeout; the caller's
+    latency budget is enforced by the route)"""
+    def call(prompt: str) -> str:
+        return gemini_client.generate_content(prompt, purpose="recommend", generation_config=RECOMMEND_GENERATION_CONFIG,
+                                              request_options={"timeout": GEMINI_REQUEST_TIMEOUT}).text
+    return run_gemini_steps(recommendation_steps(tops, bottoms, count, top_candidates, features, cache), call)
+
+async def recommend_outfit_with_gemini_async(tops: List[Dict[str, Any]], bottoms: List[Dict[str, Any]], count: int = 1,
+                                             top_candidates: int = 5,
+                                             features: Optional[Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]] = None,
+                                             cache: Optional[RecommendationCache] = None) -> List[Dict[str, Any]]:
+    """recommendation_steps awaiting generate_content_async (no thread held while Gemini runs)"""
+    async def call(prompt: str) -> str:
+        response = await gemini_client.generate_content_async(
+            prompt, purpose="recommend", generation_config=RECOMMEND_GENERATION_CONFIG,
+            request_options={"timeout": GEMINI_REQUEST_TIMEOUT})
+        return response.text
+    return await run_gemini_steps_async(recommendation_steps(tops, bottoms, count, top_candidates, features, cache),
+                                        call)
+
+def rule_based_combinations(tops: List[Dict[str, Any]], bottoms: List[Dict[str, Any]], count: int,
+                            features: Optional[Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]] = None) -> List[Dict[str, Any]]:
+    """Best `count` top + bottom pairs by rule-based score, in the /api/recommend/outfit response shape"""
+    top_combinations = []
+    with span("score"):
+        for score, i, j in top_outfit_pairs(tops, bottoms, count, features=features):
+            top, bottom = tops[i], bottoms[j]
+            _, reasons = calculate_outfit_score(top, bottom)
+            top_combinations.append({
+                "top": top,
+                "bottom": bottom,
+                "score": round(score, 3),
+                "reasons": reasons,
+                "reasoning": ", ".join(reasons),
+                "style_description": f"{top.get('attributes', {}).get('category', {}).get('sub', 'Top')} & {bottom.get('attributes', {}).get('category', {}).get('sub', 'Bottom')}"
+            })
+    return top_combinations
 
 @app.route('/api/outfit/score', methods=['GET'])
 def get_outfit_score():
@@ -1047,13 +5269,14 @@ def get_outfit_score():
         
         if not top_id or not bottom_id:
             return jsonify({"error": "top_id and bottom_id are required"}), 400
-        
-        # Load all items
-        all_items = load_wardrobe_items()
+        try:
+            store = wardrobe_namespaces.get(namespace_of(request)).store
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
         # Find the items
-        top_item = next((item for item in all_items if item.get("id") == top_id), None)
-        bottom_item = next((item for item in all_items if item.get("id") == bottom_id), None)
+        top_item = store.get(top_id)
+        bottom_item = store.get(bottom_id)
         
         if not top_item or not bottom_item:
             return jsonify({"error": "Items not found"}), 404
@@ -1075,41 +5298,32 @@ def get_outfit_score():
 @app.route('/api/recommend/outfit', methods=['GET'])
 def recommend_outfit():
     """Recommend outfit combinations (top + bottom) using Gemini"""
+    started = time.perf_counter()
     try:
         count = int(request.args.get('count', 1))
         season = request.args.get('season', None)
         formality = request.args.get('formality', None)
         use_gemini = request.args.get('use_gemini', 'true').lower() == 'true'
+        try:
+            wardrobe = wardrobe_namespaces.get(namespace_of(request))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
-        # Load all items
-        all_items = load_wardrobe_items()
-        
-        # Filter by category
-        tops = [item for item in all_items 
-                if item.get("attributes", {}).get("category", {}).get("main") == "top"]
-        bottoms = [item for item in all_items 
-                   if item.get("attributes", {}).get("category", {}).get("main") == "bottom"]
-        
-        if not tops or not bottoms:
+        with span("wardrobe"):
+            has_items = wardrobe.store.count("top") and wardrobe.store.count("bottom")
+        if not has_items:
             return jsonify({
                 "success": True,
                 "outfits": [],
                 "message": "Not enough items in wardrobe (need at least one top and one bottom)"
             })
         
-        # Apply optional filters
-        if season:
-            tops = [t for t in tops 
-                   if season.lower() in t.get("attributes", {}).get("scores", {}).get("season", [])]
-            bottoms = [b for b in bottoms 
-                       if season.lower() in b.get("attributes", {}).get("scores", {}).get("season", [])]
-        
-        if formality:
-            target_formality = float(formality)
-            tops = [t for t in tops 
-                   if abs(t.get("attributes", {}).get("scores", {}).get("formality", 0.5) - target_formality) <= 0.3]
-            bottoms = [b for b in bottoms 
-                       if abs(b.get("attributes", {}).get("scores", {}).get("formality", 0.5) - target_formality) <= 0.3]
+        # Filter by category and optional season / formality (runs on snapshot columns when available)
+        target_formality = float(formality) if formality else None
+        with span("select"):
+            tops, top_features = wardrobe.store.select("top", season, target_formality)
+            bottoms, bottom_features = wardrobe.store.select("bottom", season, target_formality)
+        features = (top_features, bottom_features) if top_features is not None and bottom_features is not None else None
         
         if not tops or not bottoms:
             return jsonify({
@@ -1118,45 +5332,86 @@ def recommend_outfit():
                 "message": "No items match the filters"
             })
         
-        # Use Gemini for recommendation (with optimization)
-        if use_gemini:
-            # Pre-filter to reduce Gemini workload
+        # Start Gemini first (skipped while the circuit breaker is open) and compute the
+        # rule-based answer while it runs; Gemini only wins if it finishes within the budget
+        budget_ms = max(0, min(request.args.get('budget_ms', RECOMMEND_LATENCY_BUDGET_MS, type=int),
+                               RECOMMEND_LATENCY_BUDGET_MAX_MS))
+        gemini_future = None
+        if use_gemini and not gemini_client.available():
+            recommend_fallbacks.inc(reason="breaker_open")
+        elif use_gemini and not recommend_pending.acquire(blocking=False):
+            recommend_fallbacks.inc(reason="saturated")
+        elif use_gemini:
             # Only send top 5 candidates to Gemini for faster response
-            recommendations = recommend_outfit_with_gemini(tops, bottoms, count, top_candidates=5)
-            if recommendations:
-                return jsonify({
-                    "success": True,
-                    "outfits": recommendations,
-                    "count": len(recommendations),
-                    "method": "gemini-optimized"
-                })
+            # copy_context: spans recorded in the worker land in this request's Server-Timing
+            gemini_future = recommend_executor.submit(
+                contextvars.copy_context().run,
+                recommend_outfit_with_gemini, tops, bottoms, count, top_candidates=5, features=features,
+                cache=wardrobe.recommendations)
+            gemini_future.add_done_callback(lambda _: recommend_pending.release())
         
-        # Fallback to rule-based if Gemini fails or disabled
-        combinations = []
-        for top in tops:
-            for bottom in bottoms:
-                score, reasons = calculate_outfit_score(top, bottom)
-                combinations.append({
-                    "top": top,
-                    "bottom": bottom,
-                    "score": round(score, 3),
-                    "reasons": reasons,
-                    "reasoning": ", ".join(reasons),
-                    "style_description": f"{top.get('attributes', {}).get('category', {}).get('sub', 'Top')} & {bottom.get('attributes', {}).get('category', {}).get('sub', 'Bottom')}"
-                })
+        top_combinations = rule_based_combinations(tops, bottoms, count, features)
         
-        combinations.sort(key=lambda x: x["score"], reverse=True)
-        top_combinations = combinations[:count]
+        method = "rule-based"
+        if gemini_future is not None:
+            remaining = budget_ms / 1000 - (time.perf_counter() - started)
+            try:
+                with span("gemini_wait"):
+                    recommendations = gemini_future.result(timeout=max(0.0, remaining))
+            except FutureTimeoutError:
+                # A call that already started keeps running and caches its answer for the next
+                # request; one still queued is dropped so it does not spend quota for nobody
+                gemini_future.cancel()
+                method = "rule-based-deadline"
+                recommend_fallbacks.inc(reason="deadline")
+            except Exception as e:
+                print(f"Gemini recommendation error: {e}")
+                recommend_fallbacks.inc(reason="gemini_error")
+            else:
+                if recommendations:
+                    recommend_methods.inc(method="gemini-optimized")
+                    return jsonify({
+                        "success": True,
+                        "outfits": recommendations,
+                        "count": len(recommendations),
+                        "method": "gemini-optimized"
+                    })
         
+        recommend_methods.inc(method=method)
         return jsonify({
             "success": True,
             "outfits": top_combinations,
             "count": len(top_combinations),
-            "method": "rule-based"
+            "method": method
         })
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# -----------------------------
+# App factory
+# -----------------------------
+APP_PRELOAD = os.getenv("APP_PRELOAD", "false").lower() == "true"
+
+def create_app(preload: Optional[bool] = None) -> Flask:
+    """
+    Entry point for servers that import the app once and fork workers
+    (gunicorn --preload "api_server:create_app(preload=True)"). preload (default APP_PRELOAD)
+    imports the Gemini SDK and loads the wardrobe in the parent so workers share those pages.
+    Nothing fork-unsafe happens here: no threads, no SQLite connection, no gRPC channel; the
+    model client is still created per worker on first use. Upload spool files left by killed
+    workers are removed.
+    """
+    if preload is None:
+        preload = APP_PRELOAD
+    sweep_upload_spool()
+    if preload:
+        if GEMINI_BACKEND != "fake":
+            import google.generativeai  # noqa: F401
+        retryable_gemini_errors()
+        if isinstance(wardrobe_store, WardrobeStore):
+            wardrobe_store.refresh()
+    return app
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5000, host='0.0.0.0')
+    create_app().run(debug=True, port=5000, host='0.0.0.0')
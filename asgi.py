@@ -0,0 +1,372 @@
+"""
+ASGI entry point for AI Stylist Agent.
+
+POST /api/extract and GET /api/recommend/outfit are served natively on the event loop and await
+the Gemini client (generate_content_async), so a request waiting on Gemini holds no thread.
+Every other route (and /api/extract?async=true / ?stream=true) runs the Flask app through a small
+WSGI bridge on a bounded thread pool; response bodies and status codes are identical either way.
+
+Usage:
+    pip install uvicorn
+    uvicorn asgi:app --host 0.0.0.0 --port 5000
+"""
+
+import asyncio
+import io
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from werkzeug.wrappers import Request
+
+import api_server
+
+# Concurrent native extractions (upload bytes held in memory) and in-flight Gemini recommendation
+# calls; excess requests wait on the semaphore instead of piling onto Gemini
+ASGI_EXTRACT_MAX_IN_FLIGHT = max(1, int(os.getenv("ASGI_EXTRACT_MAX_IN_FLIGHT", "64")))
+ASGI_RECOMMEND_MAX_IN_FLIGHT = max(1, int(os.getenv("ASGI_RECOMMEND_MAX_IN_FLIGHT", "64")))
+# Gemini recommendation tasks (in flight + waiting for a slot); beyond that requests skip Gemini
+ASGI_RECOMMEND_MAX_PENDING = max(ASGI_RECOMMEND_MAX_IN_FLIGHT, int(os.getenv("ASGI_RECOMMEND_MAX_PENDING", "128")))
+ASGI_WSGI_THREADS = max(1, int(os.getenv("ASGI_WSGI_THREADS", "32")))  # Flask routes served concurrently
+
+Message = Dict[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+Reply = Tuple[int, Dict[str, Any], Dict[str, str]]  # (status, JSON body, extra headers)
+
+flask_app = api_server.create_app()
+wsgi_executor = ThreadPoolExecutor(max_workers=ASGI_WSGI_THREADS, thread_name_prefix="asgi-wsgi")
+extract_slots = asyncio.Semaphore(ASGI_EXTRACT_MAX_IN_FLIGHT)
+recommend_slots = asyncio.Semaphore(ASGI_RECOMMEND_MAX_IN_FLIGHT)
+
+# Gemini recommendations that outlived their request keep running (and fill recommendation_cache);
+# the event loop only holds weak references to tasks, so they are kept here until done
+_background_tasks: "set[asyncio.Task]" = set()
+
+# -----------------------------
+# ASGI <-> WSGI plumbing
+# -----------------------------
+async def read_body(receive: Receive, limit: Optional[int] = None) -> Optional[bytes]:
+    """Whole request body, or None as soon as it exceeds limit bytes"""
+    chunks: List[bytes] = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if limit is not None and size > limit:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+def build_environ(scope: Dict[str, Any], body: bytes) -> Dict[str, Any]:
+    """PEP 3333 environ for an ASGI HTTP scope with an already received body"""
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    client = scope.get("client")
+    if client:
+        environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = client[0], str(client[1])
+    for raw_name, raw_value in scope.get("headers", []):
+        name, value = raw_name.decode("latin-1").lower(), raw_value.decode("latin-1")
+        if name == "content-length":
+            continue
+        key = "CONTENT_TYPE" if name == "content-type" else "HTTP_" + name.upper().replace("-", "_")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+async def call_wsgi(scope: Dict[str, Any], receive: Receive, send: Send, body: bytes) -> None:
+    """
+    Run the Flask app for one request on wsgi_executor. The response iterable is consumed on that
+    same thread (stream_with_context needs it) and chunks are forwarded as they come, so SSE works.
+    """
+    loop = asyncio.get_running_loop()
+    environ = build_environ(scope, body)
+    messages: "asyncio.Queue[Tuple[str, Any]]" = asyncio.Queue()
+    disconnected = threading.Event()
+
+    def put(kind: str, value: Any = None) -> None:
+        loop.call_soon_threadsafe(messages.put_nowait, (kind, value))
+
+    def start_response(status: str, headers: List[Tuple[str, str]], exc_info: Any = None):
+        put("start", (int(status.split(" ", 1)[0]),
+                      [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]))
+        return lambda data: put("body", data)
+
+    def run() -> None:
+        try:
+            result = flask_app(environ, start_response)
+            try:
+                for chunk in result:
+                    if disconnected.is_set():
+                        break
+                    if chunk:
+                        put("body", chunk)
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+        except BaseException as e:
+            put("error", e)
+        else:
+            put("end")
+
+    async def watch_disconnect() -> None:
+        # The body is already read, so the next message is the client going away
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        disconnected.set()
+
+    loop.run_in_executor(wsgi_executor, run)
+    watcher = asyncio.create_task(watch_disconnect())
+    started = False
+    try:
+        while True:
+            kind, value = await messages.get()
+            if kind == "start":
+                status, headers = value
+                await send({"type": "http.response.start", "status": status, "headers": headers})
+                started = True
+            elif kind == "body":
+                await send({"type": "http.response.body", "body": bytes(value), "more_body": True})
+            elif kind == "error":
+                print(f"WSGI bridge error: {value}")
+                if not started:
+                    await send_json(send, 500, {"error": str(value)})
+                else:
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+            else:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+                return
+    finally:
+        disconnected.set()
+        watcher.cancel()
+
+async def send_json(send: Send, status: int, payload: Dict[str, Any],
+                    headers: Optional[Dict[str, str]] = None) -> None:
+    """JSON response with exactly the bytes flask.jsonify would produce"""
+    body = flask_app.json.response(payload).get_data()
+    raw_headers = [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                   (b"access-control-allow-origin", b"*")]  # CORS(app) allows every origin
+    raw_headers += [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in (headers or {}).items()]
+    await send({"type": "http.response.start", "status": status, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": body, "more_body": False})
+
+async def respond(scope: Dict[str, Any], send: Send, route: str, handler: Callable[..., Awaitable[Reply]],
+                  *args: Any) -> None:
+    """Run a native handler inside a traced request: same metric, log line and Server-Timing as Flask"""
+    started = time.perf_counter()
+    spans = api_server.begin_trace()
+    try:
+        status, payload, headers = await handler(*args)
+    except Exception as e:
+        status, payload, headers = 500, {"error": str(e)}, {}
+    total_ms = (time.perf_counter() - started) * 1000
+    headers = dict(headers)
+    headers["Vary"] = api_server.NAMESPACE_HEADER  # as the Flask after_request hook adds
+    headers["Server-Timing"] = api_server.finish_request_trace(
+        scope["method"], route, scope["path"], status, total_ms, spans)
+    await send_json(send, status, payload, headers)
+
+# -----------------------------
+# Native routes
+# -----------------------------
+def _parse_form(request: Request) -> Request:
+    request.files  # multipart parsing is CPU work; done here, off the event loop
+    return request
+
+async def too_large() -> Reply:
+    return 400, {"error": api_server.upload_too_large_message()}, {}
+
+async def extract(request: Request) -> Reply:
+    """POST /api/extract without ?async / ?stream: same validation, errors and body as the Flask view"""
+    try:
+        namespace = api_server.namespace_of(request)
+    except ValueError as e:
+        return 400, {"error": str(e)}, {}
+    if 'image' not in request.files:
+        return 400, {"error": "No image file provided"}, {}
+
+    file = request.files['image']
+    try:
+        upload = api_server.read_upload(file)
+    except ValueError as e:
+        return 400, {"error": str(e)}, {}
+
+    dedupe = request.form.get('dedupe', 'true').lower() == 'true'
+    try:
+        async with extract_slots:
+            return 200, await api_server.process_upload_async(upload, file.filename, dedupe,
+                                                              spool=api_server.upload_spool(file),
+                                                              namespace=namespace), {}
+    except api_server.GeminiUnavailableError as e:
+        return 503, {"error": str(e)}, {"Retry-After": str(max(1, int(e.retry_after + 0.5)))}
+    except Exception as e:
+        return 500, {"error": str(e)}, {}
+
+def wants_flask_extract(request: Request) -> bool:
+    """Job submission and SSE streaming stay on the Flask view"""
+    run_async = (request.args.get('async') or request.form.get('async', 'false')).lower() == 'true'
+    return run_async or request.args.get('stream', 'false').lower() == 'true'
+
+def select_candidates(store: Any, season: Optional[str], target_formality: Optional[float]) -> Optional[Tuple[Any, ...]]:
+    """(tops, bottoms, features) for a recommendation, or None when the wardrobe lacks a top or a bottom"""
+    with api_server.span("wardrobe"):
+        has_items = store.count("top") and store.count("bottom")
+    if not has_items:
+        return None
+    with api_server.span("select"):
+        tops, top_features = store.select("top", season, target_formality)
+        bottoms, bottom_features = store.select("bottom", season, target_formality)
+    features = (top_features, bottom_features) if top_features is not None and bottom_features is not None else None
+    return tops, bottoms, features
+
+async def gemini_recommendations(tops: List[Dict[str, Any]], bottoms: List[Dict[str, Any]], count: int,
+                                 features: Any, cache: Any, started: asyncio.Event) -> List[Dict[str, Any]]:
+    async with recommend_slots:
+        started.set()
+        return await api_server.recommend_outfit_with_gemini_async(tops, bottoms, count, top_candidates=5,
+                                                                   features=features, cache=cache)
+
+def _forget_task(task: "asyncio.Task") -> None:
+    _background_tasks.discard(task)
+    if not task.cancelled():
+        task.exception()  # retrieved, so an abandoned failure is not reported as "never retrieved"
+
+async def recommend_outfit(request: Request) -> Reply:
+    """GET /api/recommend/outfit: rule-based scoring in a worker thread while Gemini is awaited"""
+    started = time.perf_counter()
+    count = int(request.args.get('count', 1))
+    season = request.args.get('season', None)
+    formality = request.args.get('formality', None)
+    use_gemini = request.args.get('use_gemini', 'true').lower() == 'true'
+    try:
+        wardrobe = api_server.wardrobe_namespaces.get(api_server.namespace_of(request))
+    except ValueError as e:
+        return 400, {"error": str(e)}, {}
+
+    target_formality = float(formality) if formality else None
+    selected = await asyncio.to_thread(select_candidates, wardrobe.store, season, target_formality)
+    if selected is None:
+        return 200, {
+            "success": True,
+            "outfits": [],
+            "message": "Not enough items in wardrobe (need at least one top and one bottom)"
+        }, {}
+    tops, bottoms, features = selected
+    if not tops or not bottoms:
+        return 200, {"success": True, "outfits": [], "message": "No items match the filters"}, {}
+
+    budget_ms = max(0, min(request.args.get('budget_ms', api_server.RECOMMEND_LATENCY_BUDGET_MS, type=int),
+                           api_server.RECOMMEND_LATENCY_BUDGET_MAX_MS))
+    gemini_task = None
+    gemini_started = asyncio.Event()
+    if use_gemini and not api_server.gemini_client.available():
+        api_server.recommend_fallbacks.inc(reason="breaker_open")
+    elif use_gemini and len(_background_tasks) >= ASGI_RECOMMEND_MAX_PENDING:
+        api_server.recommend_fallbacks.inc(reason="saturated")
+    elif use_gemini:
+        gemini_task = asyncio.create_task(gemini_recommendations(tops, bottoms, count, features,
+                                                                 wardrobe.recommendations, gemini_started))
+        _background_tasks.add(gemini_task)
+        gemini_task.add_done_callback(_forget_task)
+
+    top_combinations = await asyncio.to_thread(api_server.rule_based_combinations, tops, bottoms, count, features)
+
+    method = "rule-based"
+    if gemini_task is not None:
+        remaining = budget_ms / 1000 - (time.perf_counter() - started)
+        wait_started = time.perf_counter()
+        try:
+            # shield: the deadline abandons the wait, not the call
+            recommendations = await asyncio.wait_for(asyncio.shield(gemini_task), timeout=max(0.0, remaining))
+        except asyncio.TimeoutError:
+            if not gemini_started.is_set():
+                gemini_task.cancel()  # still waiting for a slot: drop it rather than spend quota late
+            method = "rule-based-deadline"
+            api_server.recommend_fallbacks.inc(reason="deadline")
+        except Exception as e:
+            print(f"Gemini recommendation error: {e}")
+            api_server.recommend_fallbacks.inc(reason="gemini_error")
+        else:
+            if recommendations:
+                api_server.recommend_methods.inc(method="gemini-optimized")
+                return 200, {
+                    "success": True,
+                    "outfits": recommendations,
+                    "count": len(recommendations),
+                    "method": "gemini-optimized"
+                }, {}
+        finally:
+            api_server.record_span("gemini_wait", wait_started)
+
+    api_server.recommend_methods.inc(method=method)
+    return 200, {
+        "success": True,
+        "outfits": top_combinations,
+        "count": len(top_combinations),
+        "method": method
+    }, {}
+
+# -----------------------------
+# Application
+# -----------------------------
+async def lifespan(receive: Receive, send: Send) -> None:
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            api_server.job_queue.start()  # Flask starts it on the first request it sees
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            wsgi_executor.shutdown(wait=False, cancel_futures=True)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def app(scope: Dict[str, Any], receive: Receive, send: Send) -> None:
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    method, path = scope["method"], scope["path"]
+    if method == "POST" and path == "/api/extract":
+        body = await read_body(receive, api_server.MAX_UPLOAD_REQUEST_SIZE)
+        if body is None:
+            await respond(scope, send, path, too_large)
+            return
+        request = await asyncio.to_thread(_parse_form, api_server.UploadRequest(build_environ(scope, body)))
+        try:
+            if not wants_flask_extract(request):
+                await respond(scope, send, path, extract, request)
+                return
+        finally:
+            request.close()  # removes upload spool files that were not moved into the wardrobe
+    elif method == "GET" and path == "/api/recommend/outfit":
+        await respond(scope, send, path, recommend_outfit, Request(build_environ(scope, b"")))
+        return
+    else:
+        body = await read_body(receive) or b""
+    await call_wsgi(scope, receive, send, body)
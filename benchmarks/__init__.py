@@ -0,0 +1 @@
+"""Performance benchmarks (run the bench_*.py scripts directly, see README)."""
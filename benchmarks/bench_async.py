@@ -0,0 +1,226 @@
+"""
+Concurrency benchmark: the native async routes of asgi.py vs the Flask (WSGI) views on a
+thread pool, with the fake Gemini backend holding every call for --latency seconds.
+
+For each route (extract, recommend) and mode:
+  - asgi: --concurrency client tasks call asgi.app in-process on one event loop
+  - wsgi: the same clients, each request handed to a --threads worker pool running the Flask app
+          (what a threaded WSGI server does); requests queue when all workers wait on Gemini
+Every client sends requests back to back until --requests are done. Reported per run:
+throughput, p50/p99 latency, peak thread count and tracemalloc peak (Python allocations).
+
+Rate limits are off and the recommendation cache is disabled, so every request reaches the
+fake model; extract uploads are unique noise images (no extraction cache / dedupe hits).
+
+Usage:
+    python benchmarks/bench_async.py [--requests 400] [--concurrency 100] [--threads 16] [--latency 0.5]
+    python benchmarks/bench_async.py --routes recommend --latency lognormal:0.8,0.4 --output async.json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+ROUTES = ("extract", "recommend")
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))] if sorted_values else None
+
+
+def random_jpeg(rng):
+    pixels = np.random.default_rng(rng.getrandbits(32)).integers(0, 256, (128, 128, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, "JPEG", quality=80)
+    return buf.getvalue()
+
+
+def multipart(data):
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"image\"; filename=\"bench.jpg\"\r\n"
+            f"Content-Type: image/jpeg\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def build_requests(route, n, rng, budget_ms):
+    """(method, path, query string, body, content type) per request"""
+    if route == "extract":
+        return [("POST", "/api/extract", "", *multipart(random_jpeg(rng))) for _ in range(n)]
+    query = f"count=3&budget_ms={budget_ms}"
+    return [("GET", "/api/recommend/outfit", query, b"", None) for _ in range(n)]
+
+
+async def call_asgi(app, method, path, query, body, content_type):
+    headers = [(b"host", b"bench")]
+    if content_type:
+        headers.append((b"content-type", content_type.encode()))
+    scope = {"type": "http", "method": method, "path": path, "query_string": query.encode(), "headers": headers,
+             "http_version": "1.1", "scheme": "http", "server": ("bench", 80), "client": ("127.0.0.1", 0)}
+    received = False
+
+    async def receive():
+        nonlocal received
+        if not received:
+            received = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await asyncio.Event().wait()  # no disconnect during the benchmark
+
+    status = None
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+def call_wsgi(app, method, path, query, body, content_type):
+    from werkzeug.test import EnvironBuilder
+
+    environ = EnvironBuilder(path=path, method=method, query_string=query, data=body,
+                             content_type=content_type).get_environ()
+    status = []
+    result = app(environ, lambda s, h, exc_info=None: status.append(int(s.split(" ", 1)[0])))
+    try:
+        for _ in result:
+            pass
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+    return status[0]
+
+
+async def run_clients(requests, concurrency, handle):
+    """Closed loop: `concurrency` clients take the next request as soon as their previous one returns"""
+    pending = list(reversed(requests))
+    latencies, statuses = [], {}
+
+    async def client():
+        while pending:
+            request = pending.pop()
+            t0 = time.perf_counter()
+            try:
+                status = await handle(request)
+            except Exception:
+                status = "exception"
+            latencies.append((time.perf_counter() - t0) * 1000)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, statuses, time.perf_counter() - started
+
+
+def measure(mode, route, requests, args, asgi_app, flask_app):
+    peak_threads = threading.active_count()
+    done = threading.Event()
+
+    def watch_threads():
+        nonlocal peak_threads
+        while not done.wait(0.01):
+            peak_threads = max(peak_threads, threading.active_count())
+
+    watcher = threading.Thread(target=watch_threads, daemon=True)
+    watcher.start()
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    if mode == "asgi":
+        handle = lambda request: call_asgi(asgi_app, *request)
+        latencies, statuses, elapsed = asyncio.run(run_clients(requests, args.concurrency, handle))
+    else:
+        pool = ThreadPoolExecutor(max_workers=args.threads, thread_name_prefix="wsgi-worker")
+
+        async def handle(request):
+            return await asyncio.get_running_loop().run_in_executor(pool, call_wsgi, flask_app, *request)
+
+        latencies, statuses, elapsed = asyncio.run(run_clients(requests, args.concurrency, handle))
+        pool.shutdown()
+
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    if args.tracemalloc:
+        tracemalloc.stop()
+    done.set()
+    watcher.join()
+
+    latencies.sort()
+    errors = sum(v for k, v in statuses.items() if k != "200")
+    return {
+        "route": route, "mode": mode, "requests": len(latencies), "errors": errors, "status": statuses,
+        "elapsed_s": round(elapsed, 2), "throughput_rps": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 0.50), 1), "p99_ms": round(percentile(latencies, 0.99), 1),
+        "peak_threads": peak_threads,
+        "tracemalloc_peak_mb": round(traced_peak / 2**20, 1) if traced_peak is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--routes", nargs="+", default=list(ROUTES), choices=ROUTES)
+    parser.add_argument("--modes", nargs="+", default=["asgi", "wsgi"], choices=["asgi", "wsgi"])
+    parser.add_argument("--requests", type=int, default=400, help="requests per route and mode")
+    parser.add_argument("--concurrency", type=int, default=100, help="concurrent clients")
+    parser.add_argument("--threads", type=int, default=16, help="worker threads of the WSGI mode")
+    parser.add_argument("--latency", default="0.5", help="fake Gemini latency spec (see parse_latency_spec)")
+    parser.add_argument("--wardrobe", type=int, default=200, help="synthetic items for recommend")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-tracemalloc", dest="tracemalloc", action="store_false",
+                        help="skip allocation tracking (it slows CPU-bound stages)")
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    os.environ.update({"GEMINI_BACKEND": "fake", "GEMINI_FAKE_LATENCY": args.latency, "GEMINI_RPM": "0",
+                       "GEMINI_TPM": "0", "REQUEST_LOG": "false", "RECOMMEND_CACHE_SIZE": "0",
+                       "ASGI_EXTRACT_MAX_IN_FLIGHT": str(args.concurrency),
+                       "ASGI_RECOMMEND_MAX_IN_FLIGHT": str(args.concurrency)})
+    os.chdir(tempfile.mkdtemp(prefix="bench_async_"))  # wardrobe, caches and job files land here
+    import api_server
+    import asgi
+    from benchmarks.synthetic import write_wardrobe
+
+    write_wardrobe(api_server.OUTPUT_DIR, args.wardrobe, args.seed)
+    api_server.recommendation_cache = api_server.RecommendationCache(max_entries=0, db_path="")
+    # recommend: a budget above the model latency, so both modes wait for Gemini instead of falling back
+    budget_ms = api_server.RECOMMEND_LATENCY_BUDGET_MAX_MS
+    rng = random.Random(args.seed)
+
+    # The Flask recommend view also hands Gemini to recommend_executor (RECOMMEND_GEMINI_WORKERS)
+    print(f"fake Gemini latency {args.latency}s | {args.requests} requests x {args.concurrency} clients | "
+          f"wsgi threads {args.threads}, recommend_executor workers {api_server.recommend_executor._max_workers}")
+    results = []
+    for route in args.routes:
+        for mode in args.modes:
+            requests = build_requests(route, args.requests, rng, budget_ms)
+            r = measure(mode, route, requests, args, asgi.app, api_server.app)
+            results.append(r)
+            traced = f"{r['tracemalloc_peak_mb']}MB" if args.tracemalloc else "-"
+            print(f"[{route:9}|{mode}] {r['throughput_rps']:7.2f} rps | p50 {r['p50_ms']}ms p99 {r['p99_ms']}ms "
+                  f"| threads {r['peak_threads']} | traced peak {traced} "
+                  f"| errors {r['errors']} {r['status']}")
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Worker cold-start benchmark: JSON directory scan vs mmap wardrobe snapshot.
+
+For each size a synthetic extracted_attributes/ directory is generated (pretty-printed
+JSON like /api/extract writes), then a fresh WardrobeStore is timed:
+  - scan:     no snapshot, every JSON file parsed (what load_wardrobe_items() costs cold)
+  - build:    first scan that also writes the snapshot
+  - snapshot: a new worker opening the existing snapshot
+plus the first recommendation-style lookup (select tops/bottoms for a season) for each mode,
+and the per-write cost once the snapshot exists:
+  - save:       WardrobeStore.save (files + in-memory index + delta log entry)
+  - catch-up:   another worker picking that save up from the delta log
+  - compaction: the background rebuild that folds the log into the snapshot (O(n), off the
+                request path, once per WARDROBE_DELTA_COMPACT_KB of log)
+
+Usage:
+    python benchmarks/bench_cold_start.py [--sizes 10000 100000] [--seed 0]
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_server
+from benchmarks.synthetic import random_attributes, write_wardrobe
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - t0) * 1000
+
+
+def first_select(store):
+    tops, _ = store.select("top", season="winter", formality=0.8)
+    bottoms, _ = store.select("bottom", season="winter", formality=0.8)
+    return len(tops), len(bottoms)
+
+
+def per_write(output_dir, writes, seed):
+    """(save ms, other worker's catch-up ms, compaction ms), averaged over `writes` saves"""
+    writer = api_server.WardrobeStore(output_dir, refresh_interval=0)
+    reader = api_server.WardrobeStore(output_dir, refresh_interval=0)
+    writer.refresh()
+    reader.refresh()
+    rng = random.Random(seed)
+    save_ms = catch_up_ms = 0.0
+    for i in range(writes):
+        attributes = random_attributes(rng)
+        _, ms = timed(lambda: writer.save(f"bench_{i:05d}", attributes, b"png", ".png"))
+        save_ms += ms
+        _, ms = timed(reader.refresh)
+        catch_up_ms += ms
+    _, compact_ms = timed(writer._compact)
+    return save_ms / writes, catch_up_ms / writes, compact_ms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--writes", type=int, default=50)
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        workdir = tempfile.mkdtemp(prefix="wardrobe_bench_")
+        output_dir = os.path.join(workdir, "extracted_attributes")
+        try:
+            write_wardrobe(output_dir, n, args.seed, images=False)
+
+            scan_store = api_server.WardrobeStore(output_dir, use_snapshot=False)
+            _, scan_ms = timed(scan_store.refresh)
+            _, scan_sel_ms = timed(lambda: first_select(scan_store))
+
+            _, build_ms = timed(api_server.WardrobeStore(output_dir).refresh)
+
+            snap_store = api_server.WardrobeStore(output_dir)
+            _, snap_ms = timed(snap_store.refresh)
+            _, snap_sel_ms = timed(lambda: first_select(snap_store))
+
+            size_kb = os.path.getsize(snap_store.snapshot_path) / 1024
+            print(f"[{n} items] scan {scan_ms:.0f}ms (+{scan_sel_ms:.0f}ms first select) | "
+                  f"snapshot build {build_ms:.0f}ms ({size_kb:.0f}KiB) | "
+                  f"snapshot open {snap_ms:.1f}ms (+{snap_sel_ms:.0f}ms first select)")
+
+            save_ms, catch_up_ms, compact_ms = per_write(output_dir, args.writes, args.seed)
+            print(f"[{n} items] per write: save {save_ms:.2f}ms, other worker catch-up {catch_up_ms:.2f}ms | "
+                  f"background compaction {compact_ms:.0f}ms")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
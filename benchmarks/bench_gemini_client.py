@@ -0,0 +1,89 @@
+"""
+GeminiClient behaviour against FakeGeminiModel (no network, no API key needed).
+
+Scenarios, each with a fresh client:
+- rate:    concurrent callers against a requests/minute limit (achieved rate must stay under it)
+- flaky:   a fraction of calls fail with 503; retries with jittered backoff should hide most of them
+- outage:  every call fails; the circuit breaker should trip and reject the rest immediately
+
+Refund and breaker-state correctness is covered by tests/test_gemini_client.py.
+
+Usage:
+    python benchmarks/bench_gemini_client.py [--rpm 600] [--calls 40] [--threads 8] [--error-rate 0.3]
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_server
+
+
+def run(client, calls, threads):
+    outcomes = {"ok": 0, "error": 0, "rejected": 0}
+    latencies = []
+
+    def one(_):
+        t0 = time.perf_counter()
+        try:
+            client.generate_content("ping")
+            outcome = "ok"
+        except api_server.GeminiUnavailableError:
+            outcome = "rejected"
+        except Exception:
+            outcome = "error"
+        return outcome, time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        for outcome, latency in pool.map(one, range(calls)):
+            outcomes[outcome] += 1
+            latencies.append(latency)
+    return outcomes, time.perf_counter() - t0, sorted(latencies)
+
+
+def report(name, client, outcomes, elapsed, latencies):
+    p50 = latencies[len(latencies) // 2] * 1000
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+    print(f"[{name}] {outcomes} in {elapsed:.2f}s | p50 {p50:.0f}ms p95 {p95:.0f}ms | {client.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rpm", type=float, default=600)
+    parser.add_argument("--calls", type=int, default=40)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # The bucket starts full (one minute of budget), so drain it first to measure the steady-state rate
+    client = api_server.GeminiClient(api_server.FakeGeminiModel(latency=args.latency), rpm=args.rpm, tpm=0)
+    client.requests.tokens = 0
+    outcomes, elapsed, latencies = run(client, args.calls, args.threads)
+    report("rate", client, outcomes, elapsed, latencies)
+    achieved = outcomes["ok"] / elapsed * 60
+    if achieved > args.rpm * 1.1:
+        raise SystemExit(f"rate limiter let through {achieved:.0f} rpm (limit {args.rpm:.0f})")
+
+    fake = api_server.FakeGeminiModel(latency=args.latency, error_rate=args.error_rate, seed=args.seed)
+    client = api_server.GeminiClient(fake, rpm=0, tpm=0, backoff_base=0.01, backoff_max=0.1,
+                                     breaker=api_server.CircuitBreaker(threshold=1000))
+    outcomes, elapsed, latencies = run(client, args.calls, args.threads)
+    report("flaky", client, outcomes, elapsed, latencies)
+
+    fake = api_server.FakeGeminiModel(latency=args.latency, error_rate=1.0)
+    client = api_server.GeminiClient(fake, rpm=0, tpm=0, max_retries=1, backoff_base=0.01, backoff_max=0.05,
+                                     breaker=api_server.CircuitBreaker(threshold=3, reset_timeout=60))
+    outcomes, elapsed, latencies = run(client, args.calls, 1)
+    report("outage", client, outcomes, elapsed, latencies)
+    print(f"[outage] model called {fake.calls} times for {args.calls} requests")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Startup budget: `python -X importtime -c "import api_server"` in fresh interpreters.
+
+Reports the median cumulative import time of api_server, its heaviest direct imports, peak RSS
+after the import, and whether modules that must stay lazy (the Gemini SDK, gRPC) were loaded.
+Exits 1 when the median exceeds --budget-ms or a --forbid module was imported, so it can run as
+a CI check. The budget is machine dependent; the forbidden-module check is not.
+
+Usage:
+    python benchmarks/bench_import.py [--runs 5] [--budget-ms 500] [--top 10]
+    python benchmarks/bench_import.py --forbid google.generativeai grpc google.api_core.exceptions
+"""
+
+import argparse
+import json
+import os
+import py_compile
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = """
+import json, resource, sys
+import api_server
+print(json.dumps({"maxrss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  "modules": sorted(sys.modules)}))
+"""
+
+
+def parse_importtime(stderr):
+    """[(self_us, cumulative_us, depth, module)] from -X importtime output"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append((int(self_us), int(cumulative_us), depth, name.strip()))
+    return rows
+
+
+def run_once():
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", CHILD], cwd=ROOT,
+                            capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise SystemExit(f"import failed:\n{result.stderr[-2000:]}")
+    rows = parse_importtime(result.stderr)
+    total = next(cumulative for _, cumulative, depth, name in rows if name == "api_server" and depth == 0)
+    # Rows are printed children first: api_server's direct imports are the depth-1 rows after the
+    # previous top-level import (site/.pth imports at startup are not counted)
+    direct, pending = [], []
+    for _, cumulative, depth, name in rows:
+        if depth == 1:
+            pending.append((name, cumulative))
+        elif depth == 0:
+            direct, pending = (pending if name == "api_server" else direct), []
+    info = json.loads(result.stdout.strip().splitlines()[-1])
+    return total, direct, info
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=500, help="max median import time of api_server")
+    parser.add_argument("--top", type=int, default=10, help="heaviest direct imports to list")
+    parser.add_argument("--forbid", nargs="*", default=["google.generativeai", "grpc"],
+                        help="modules that must not be loaded by the import")
+    args = parser.parse_args()
+
+    # A stale .pyc would add a full compile of the 4k-line module to the first run
+    py_compile.compile(os.path.join(ROOT, "api_server.py"), doraise=True)
+
+    totals, rss, direct_runs, loaded = [], [], [], set()
+    for _ in range(args.runs):
+        total, direct, info = run_once()
+        totals.append(total / 1000)
+        rss.append(info["maxrss_kb"] / 1024)
+        direct_runs.append(dict(direct))
+        loaded.update(info["modules"])
+
+    median_ms = statistics.median(totals)
+    print(f"import api_server: median {median_ms:.0f}ms (min {min(totals):.0f}, max {max(totals):.0f}, "
+          f"{args.runs} runs) | peak RSS {statistics.median(rss):.0f}MB")
+    heaviest = sorted(direct_runs[0], key=lambda name: -statistics.median(run.get(name, 0) for run in direct_runs))
+    for name in heaviest[:args.top]:
+        print(f"  {statistics.median(run.get(name, 0) for run in direct_runs) / 1000:8.1f}ms  {name}")
+
+    failed = False
+    forbidden = [m for m in args.forbid if m in loaded]
+    if forbidden:
+        print(f"FAIL: imported at startup: {', '.join(forbidden)}")
+        failed = True
+    if median_ms > args.budget_ms:
+        print(f"FAIL: median {median_ms:.0f}ms exceeds the {args.budget_ms:.0f}ms budget")
+        failed = True
+    if not failed:
+        print(f"OK: within {args.budget_ms:.0f}ms, none of {args.forbid} imported")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Per-request cost vs. total user base: one flat wardrobe vs. per-user namespaces.
+
+For each --users level, the same users x --items synthetic items are laid out two ways:
+  - flat:       every item in one extracted_attributes/ directory (default namespace), which is
+                what a deployment without namespaces has to serve every user from
+  - namespaced: each user's items in their own shard directory (namespace_path), requests
+                carry X-Wardrobe-Namespace
+and one user's requests are timed through the Flask test client:
+  - recommend:  GET /api/recommend/outfit?use_gemini=false
+  - items:      GET /api/wardrobe/items?limit=50
+cold = first request after the store was opened (directory scan / snapshot build),
+warm = median of --repeat requests. Flat cost grows with the user base; namespaced cost
+should stay flat because a request only touches one closet. Flat recommendations score every
+top x bottom pair of the whole user base, so levels above --flat-max-items run namespaced only.
+
+Usage:
+    python benchmarks/bench_namespaces.py [--users 10 100 1000] [--items 40] [--repeat 50] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_server
+from benchmarks.synthetic import write_wardrobe
+
+ROUTES = {
+    "recommend": "/api/recommend/outfit?use_gemini=false&count=3",
+    "items": "/api/wardrobe/items?limit=50",
+}
+
+
+def request_ms(client, path, headers):
+    t0 = time.perf_counter()
+    response = client.get(path, headers=headers)
+    elapsed = (time.perf_counter() - t0) * 1000
+    assert response.status_code == 200, response.get_data(as_text=True)[:200]
+    return elapsed
+
+
+def measure(client, headers, repeat):
+    result = {}
+    for name, path in ROUTES.items():
+        cold = request_ms(client, path, headers)
+        warm = statistics.median(request_ms(client, path, headers) for _ in range(repeat))
+        result[name] = {"cold_ms": round(cold, 2), "warm_ms": round(warm, 3)}
+    return result
+
+
+def run_level(users, items, repeat, seed, flat_max_items):
+    root = tempfile.mkdtemp(prefix="bench_ns_")
+    try:
+        client = api_server.app.test_client()
+        flat = None
+        if users * items <= flat_max_items:
+            flat_dir = os.path.join(root, "flat")
+            write_wardrobe(flat_dir, users * items, seed=seed, images=False)
+            api_server.OUTPUT_DIR = flat_dir
+            api_server.wardrobe_store = api_server.WardrobeStore(flat_dir)
+            flat = measure(client, {}, repeat)
+
+        ns_dir = os.path.join(root, "namespaced")
+        for user in range(users):
+            write_wardrobe(os.path.join(ns_dir, api_server.namespace_path(f"user{user}")), items,
+                           seed=seed + user, images=False)
+        api_server.OUTPUT_DIR = ns_dir
+        api_server.wardrobe_namespaces = api_server.WardrobeNamespaces()
+        namespaced = measure(client, {api_server.NAMESPACE_HEADER: f"user{users // 2}"}, repeat)
+        return {"users": users, "items_per_user": items, "flat": flat, "namespaced": namespaced}
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", nargs="+", type=int, default=[10, 100, 1000])
+    parser.add_argument("--items", type=int, default=40, help="wardrobe items per user")
+    parser.add_argument("--repeat", type=int, default=50, help="warm requests per route")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--flat-max-items", type=int, default=10000,
+                        help="largest total item count measured with the flat layout")
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+
+    # Rule-based path only; keep the recommendation cache and request log out of the timings
+    api_server.REQUEST_LOG_ENABLED = False
+    api_server.recommendation_cache = api_server.RecommendationCache(max_entries=0, db_path="")
+
+    results = []
+    for users in args.users:
+        r = run_level(users, args.items, args.repeat, args.seed, args.flat_max_items)
+        results.append(r)
+        for layout in ("flat", "namespaced"):
+            if r[layout] is None:
+                print(f"[users={users:5}|{layout:10}] skipped ({users * args.items} items > --flat-max-items)")
+                continue
+            print(f"[users={users:5}|{layout:10}] " + " | ".join(
+                f"{name} cold {r[layout][name]['cold_ms']:8.2f}ms warm {r[layout][name]['warm_ms']:7.3f}ms"
+                for name in ROUTES))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+        print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
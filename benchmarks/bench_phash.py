@@ -0,0 +1,67 @@
+"""
+Near-duplicate lookup benchmark: MultiIndexHash.search over N 64-bit dHashes
+(checked against a brute-force scan).
+
+Half of the indexed hashes are random, half are small perturbations of a set of
+"garments" (like repeated photos of the same item), which is closer to a real wardrobe.
+
+Usage:
+    python benchmarks/bench_phash.py [--sizes 10000 100000] [--distance 4] [--queries 2000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_server
+
+
+def flip_bits(rng, value, count):
+    for bit in rng.sample(range(64), count):
+        value ^= 1 << bit
+    return value
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--distance", type=int, default=api_server.PHASH_MAX_DISTANCE)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for n in args.sizes:
+        rng = random.Random(args.seed)
+        bases = [rng.getrandbits(64) for _ in range(max(1, n // 10))]
+        hashes = [rng.getrandbits(64) for _ in range(n // 2)]
+        hashes += [flip_bits(rng, rng.choice(bases), rng.randint(0, 6)) for _ in range(n - n // 2)]
+
+        index = api_server.MultiIndexHash(args.distance)
+        t0 = time.perf_counter()
+        for i, value in enumerate(hashes):
+            index.add(value, str(i))
+        build_ms = (time.perf_counter() - t0) * 1000
+
+        queries = [flip_bits(rng, rng.choice(hashes), rng.randint(0, 3)) for _ in range(args.queries // 2)]
+        queries += [rng.getrandbits(64) for _ in range(args.queries - len(queries))]
+
+        t0 = time.perf_counter()
+        results = [index.search(q) for q in queries]
+        per_query_us = (time.perf_counter() - t0) / len(queries) * 1e6
+        found = sum(1 for r in results if r)
+
+        for q, r in zip(queries[:50], results):
+            expected = sorted(((v ^ q).bit_count(), str(i)) for i, v in enumerate(hashes) if (v ^ q).bit_count() <= args.distance)
+            if r != expected:
+                raise SystemExit(f"[{n} hashes] search result differs from brute force")
+
+        print(f"[{n} hashes] build {build_ms:.0f}ms | search(d<={args.distance}) {per_query_us:.0f}us/query "
+              f"| {found}/{len(queries)} queries matched")
+
+
+if __name__ == "__main__":
+    main()
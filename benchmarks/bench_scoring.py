@@ -0,0 +1,76 @@
+"""
+Pairwise outfit scoring benchmark: scalar calculate_outfit_score loop vs score_outfit_pairs.
+Also checks that both paths produce bit-identical scores, and that top_outfit_pairs
+returns the same top-k as a full stable sort.
+
+Usage:
+    python benchmarks/bench_scoring.py [--sizes 100 500] [--seed 0]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import api_server
+from benchmarks.synthetic import make_items
+
+
+def scalar_matrix(tops, bottoms):
+    scores = np.empty((len(tops), len(bottoms)), dtype=np.float64)
+    for i, top in enumerate(tops):
+        for j, bottom in enumerate(bottoms):
+            scores[i, j] = api_server.calculate_outfit_score(top, bottom)[0]
+    return scores
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 500])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    for n in args.sizes:
+        tops = make_items(n, "top", rng)
+        bottoms = make_items(n, "bottom", rng)
+
+        t0 = time.perf_counter()
+        expected = scalar_matrix(tops, bottoms)
+        scalar_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        actual = api_server.score_outfit_pairs(tops, bottoms)
+        vector_s = time.perf_counter() - t0
+
+        if not np.array_equal(expected, actual):
+            mismatches = int(np.count_nonzero(expected != actual))
+            raise SystemExit(f"[{n}x{n}] parity check failed: {mismatches} scores differ")
+
+        print(f"[{n}x{n}] scalar {scalar_s * 1000:.1f}ms | vectorized {vector_s * 1000:.1f}ms "
+              f"| x{scalar_s / max(vector_s, 1e-9):.0f} | parity ok")
+
+        order = np.argsort(-actual, axis=None, kind="stable")[:args.k]
+        expected_top = [(float(actual.ravel()[x]), int(x) // n, int(x) % n) for x in order]
+
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        top = api_server.top_outfit_pairs(tops, bottoms, args.k)
+        topk_s = time.perf_counter() - t0
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        if top != expected_top:
+            raise SystemExit(f"[{n}x{n}] top-{args.k} differs from full sort")
+        print(f"[{n}x{n}] top-{args.k} {topk_s * 1000:.1f}ms | peak {peak / 1024:.0f}KiB | order ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Streaming extraction against a fake chunked Gemini stream (no network, no API key needed).
+
+1. IncrementalJsonObjectScanner must return exactly what _first_balanced_json_object returns,
+   however the text is split into chunks, and report every top-level field of the object.
+2. extract_attributes(stream=True) vs the buffered call on a response that keeps generating
+   commentary after the JSON object: time to first field, time to result, chunks read.
+
+Usage:
+    python benchmarks/bench_streaming.py [--cases 2000] [--trailing 4000] [--chunk-size 32] [--chunk-ms 5]
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_server
+from PIL import Image
+
+PIECES = ['{', '}', '[', ']', '"', '\\"', '\\\\', ',', ':', ' ', 'a', '1', '"{"', '"}"', '"a,b"', '\n', '```json\n']
+
+
+def random_text(rng):
+    if rng.random() < 0.5:
+        obj = json.loads(json.dumps(api_server.DEFAULT_OBJ))
+        obj["meta"]["notes"] = rng.choice(['has "quotes" and {braces}', "a, b: [c]", "back\\slash", None])
+        body = json.dumps(obj, indent=rng.choice([None, 2]))
+        return rng.choice(["", "Here you go:\n```json\n", "noise } ] "]) + body + rng.choice(["", "\n```", " trailing {x}"])
+    return "".join(rng.choice(PIECES) for _ in range(rng.randint(0, 60)))
+
+
+def check_scanner(cases, seed):
+    rng = random.Random(seed)
+    for _ in range(cases):
+        text = random_text(rng)
+        fields = []
+        scanner = api_server.IncrementalJsonObjectScanner(lambda key, value: fields.append((key, value)))
+        pos = 0
+        while pos < len(text) and scanner.result is None:
+            step = rng.randint(1, 12)
+            scanner.feed(text[pos:pos + step])
+            pos += step
+        expected = api_server._first_balanced_json_object(text)
+        if scanner.result != expected:
+            raise SystemExit(f"scanner mismatch for {text!r}: {scanner.result!r} != {expected!r}")
+        if expected is not None:
+            try:
+                parsed = json.loads(expected)
+            except ValueError:
+                continue
+            if dict(fields) != parsed:
+                raise SystemExit(f"fields mismatch for {expected!r}: {fields!r}")
+    print(f"[scanner] {cases} random texts/chunkings match _first_balanced_json_object")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cases", type=int, default=2000)
+    parser.add_argument("--trailing", type=int, default=4000, help="characters generated after the JSON object")
+    parser.add_argument("--chunk-size", type=int, default=32)
+    parser.add_argument("--chunk-ms", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    check_scanner(args.cases, args.seed)
+
+    obj = json.loads(json.dumps(api_server.DEFAULT_OBJ))
+    obj["category"].update({"main": "top", "sub": "shirt", "confidence": 0.9})
+    text = json.dumps(obj, indent=2) + "\n\nNotes: " + "x" * args.trailing
+    fake = api_server.FakeGeminiModel(text=text, chunk_size=args.chunk_size, chunk_latency=args.chunk_ms / 1000)
+    api_server.gemini_client = api_server.GeminiClient(fake, rpm=0, tpm=0)
+    buf = io.BytesIO()
+    Image.new("RGB", (64, 64), "white").save(buf, "JPEG")
+    image_bytes = buf.getvalue()
+
+    for stream in (False, True):
+        fake.chunks_served = 0
+        first_field = []
+        t0 = time.perf_counter()
+        if stream:
+            attrs = api_server.extract_attributes(
+                image_bytes, stream=True,
+                on_field=lambda key, value: first_field or first_field.append(time.perf_counter() - t0))
+        else:
+            # Buffered: the whole stream has to be generated before parsing can start
+            t_text = "".join(chunk.text for chunk in fake.generate_content([], stream=True))
+            attrs = api_server.normalize(api_server.parse_json_from_text(t_text)[0])
+        elapsed = (time.perf_counter() - t0) * 1000
+        if attrs["category"]["sub"] != "shirt":
+            raise SystemExit(f"unexpected extraction result: {attrs['category']}")
+        first = f"{first_field[0] * 1000:.0f}ms" if first_field else "-"
+        print(f"[{'stream' if stream else 'buffered'}] result {elapsed:.0f}ms | first field {first} "
+              f"| chunks read {fake.chunks_served}")
+
+
+if __name__ == "__main__":
+    main()
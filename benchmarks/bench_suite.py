@@ -0,0 +1,227 @@
+"""
+Micro-benchmark suite on a seeded synthetic wardrobe; results are saved as JSON so runs can be compared.
+
+For each wardrobe size (items written like /api/extract does, JSON + image):
+  - load_wardrobe_items:  cold (fresh store, directory scan) and warm call
+  - outfit_score_pairs:   calculate_outfit_score over every top x bottom pair (capped at --max-pairs,
+                          the cap is recorded) and top_outfit_pairs over the full wardrobe
+  - recommend_rule_based: GET /api/recommend/outfit?use_gemini=false through the Flask test client
+Once, on a corpus of messy model outputs (see synthetic.messy_outputs):
+  - parse_json_from_text: time per response and parse rate per defect kind
+  - validate_normalize:   validate_schema + repair_schema + normalize per parsed response
+
+100000 items is not in the default sizes (a few minutes per run); pass it explicitly.
+
+Usage:
+    python benchmarks/bench_suite.py [--sizes 100 1000 10000 100000] [--seed 0] [--output results.json]
+    python benchmarks/bench_suite.py --sizes 1000 --compare benchmarks/results/<previous>.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_server
+from benchmarks.synthetic import SIZES, messy_outputs, write_wardrobe
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - t0) * 1000
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def bench_load(output_dir):
+    store = api_server.WardrobeStore(output_dir, use_snapshot=False)
+    api_server.wardrobe_store = store
+    items, cold_ms = timed(api_server.load_wardrobe_items)
+    _, warm_ms = timed(api_server.load_wardrobe_items)
+    return {"items": len(items), "cold_ms": round(cold_ms, 2), "warm_ms": round(warm_ms, 3)}, items
+
+
+def bench_pairs(items, max_pairs, k=5):
+    tops = [it for it in items if it["attributes"]["category"]["main"] == "top"]
+    bottoms = [it for it in items if it["attributes"]["category"]["main"] == "bottom"]
+    total_pairs = len(tops) * len(bottoms)
+
+    # Scalar loop over all pairs, or over the first rows of tops when that exceeds max_pairs
+    rows = len(tops) if total_pairs <= max_pairs else max(1, max_pairs // max(1, len(bottoms)))
+    scored = 0
+    t0 = time.perf_counter()
+    for top in tops[:rows]:
+        for bottom in bottoms:
+            api_server.calculate_outfit_score(top, bottom)
+            scored += 1
+    scalar_ms = (time.perf_counter() - t0) * 1000
+
+    _, topk_ms = timed(lambda: api_server.top_outfit_pairs(tops, bottoms, k))
+    return {
+        "tops": len(tops), "bottoms": len(bottoms), "pairs": total_pairs,
+        "scalar_pairs": scored, "scalar_ms": round(scalar_ms, 2),
+        "scalar_pairs_per_s": round(scored / (scalar_ms / 1000)) if scalar_ms else None,
+        "top_k_ms": round(topk_ms, 2),
+    }
+
+
+def bench_recommend(output_dir, requests_count, time_limit, count=3):
+    # Default production store (snapshot columns feed the vectorized scorer); built before timing
+    api_server.wardrobe_store = api_server.WardrobeStore(output_dir)
+    api_server.wardrobe_store.refresh()
+    client = api_server.app.test_client()
+    latencies = []
+    status = {}
+    started = time.perf_counter()
+    for _ in range(requests_count):
+        if len(latencies) >= 3 and time.perf_counter() - started > time_limit:
+            break
+        t0 = time.perf_counter()
+        response = client.get(f"/api/recommend/outfit?use_gemini=false&count={count}")
+        latencies.append((time.perf_counter() - t0) * 1000)
+        status[response.status_code] = status.get(response.status_code, 0) + 1
+    latencies.sort()
+    return {"requests": len(latencies), "status": {str(k): v for k, v in status.items()},
+            "p50_ms": round(percentile(latencies, 0.50), 2), "p95_ms": round(percentile(latencies, 0.95), 2)}
+
+
+def bench_parse(corpus):
+    per_kind = {}
+    parsed = []
+    t0 = time.perf_counter()
+    for kind, text in corpus:
+        obj, _ = api_server.parse_json_from_text(text)
+        stats = per_kind.setdefault(kind, {"count": 0, "parsed": 0})
+        stats["count"] += 1
+        if isinstance(obj, dict):
+            stats["parsed"] += 1
+            parsed.append(obj)
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+    return {"responses": len(corpus), "total_ms": round(elapsed_ms, 2),
+            "us_per_response": round(elapsed_ms * 1000 / len(corpus), 2), "kinds": per_kind}, parsed
+
+
+def bench_validate(parsed):
+    valid = repaired = 0
+    t0 = time.perf_counter()
+    for obj in parsed:
+        ok, _ = api_server.validate_schema(obj)
+        if not ok:
+            obj, applied = api_server.repair_schema(obj)
+            ok = bool(applied) and api_server.validate_schema(obj)[0]
+            repaired += ok
+        else:
+            valid += 1
+        api_server.normalize(obj)
+    elapsed_ms = (time.perf_counter() - t0) * 1000
+    return {"objects": len(parsed), "valid": valid, "repaired": repaired, "total_ms": round(elapsed_ms, 2),
+            "us_per_object": round(elapsed_ms * 1000 / max(1, len(parsed)), 2)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(RESULTS_DIR), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def compare(results, baseline_path):
+    """Print time ratios (current / baseline) for every *_ms metric present in both runs"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["name"], r.get("size")): r for r in json.load(f)["results"]}
+    for r in results:
+        base = baseline.get((r["name"], r.get("size")))
+        if base is None:
+            continue
+        ratios = [f"{key} x{r[key] / base[key]:.2f}" for key in r
+                  if key.endswith("_ms") and isinstance(base.get(key), (int, float)) and base[key] > 0]
+        label = f"{r['name']}[{r['size']}]" if r.get("size") else r["name"]
+        print(f"[compare] {label}: {', '.join(ratios) or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES[:3]), help=f"wardrobe sizes (available presets: {list(SIZES)})")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus", type=int, default=4000, help="messy model outputs to parse")
+    parser.add_argument("--max-pairs", type=int, default=250000, help="cap for the scalar all-pairs loop")
+    parser.add_argument("--requests", type=int, default=20, help="rule-based recommend requests per size")
+    parser.add_argument("--time-limit", type=float, default=30.0,
+                        help="stop issuing recommend requests after this many seconds (at least 3 are made)")
+    parser.add_argument("--no-images", action="store_true", help="write attribute JSON only")
+    parser.add_argument("--output", help="result file (default: benchmarks/results/bench_<timestamp>.json)")
+    parser.add_argument("--compare", help="previous result file to compare against")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_suite_")
+    cwd = os.getcwd()
+    os.chdir(workdir)  # job queue / caches touched by the app write here, not into the repo
+    results = []
+    try:
+        corpus = messy_outputs(args.corpus, args.seed)
+        parse_result, parsed = bench_parse(corpus)
+        results.append({"name": "parse_json_from_text", **parse_result})
+        print(f"[parse] {parse_result['us_per_response']}us/response | "
+              + ", ".join(f"{k} {v['parsed']}/{v['count']}" for k, v in parse_result["kinds"].items()))
+
+        validate_result = bench_validate(parsed)
+        results.append({"name": "validate_normalize", **validate_result})
+        print(f"[validate+normalize] {validate_result['us_per_object']}us/object | "
+              f"valid {validate_result['valid']} repaired {validate_result['repaired']} of {validate_result['objects']}")
+
+        for n in args.sizes:
+            output_dir = os.path.join(workdir, f"wardrobe_{n}")
+            _, write_ms = timed(lambda: write_wardrobe(output_dir, n, args.seed, images=not args.no_images))
+
+            load_result, items = bench_load(output_dir)
+            results.append({"name": "load_wardrobe_items", "size": n, **load_result})
+            pairs_result = bench_pairs(items, args.max_pairs)
+            results.append({"name": "outfit_score_pairs", "size": n, **pairs_result})
+            recommend_result = bench_recommend(output_dir, args.requests, args.time_limit)
+            results.append({"name": "recommend_rule_based", "size": n, **recommend_result})
+
+            print(f"[{n} items] generated {write_ms:.0f}ms | load cold {load_result['cold_ms']:.0f}ms "
+                  f"warm {load_result['warm_ms']:.2f}ms | scalar {pairs_result['scalar_pairs_per_s']} pairs/s "
+                  f"({pairs_result['scalar_pairs']}/{pairs_result['pairs']}) | top-k {pairs_result['top_k_ms']:.0f}ms "
+                  f"| recommend p50 {recommend_result['p50_ms']}ms p95 {recommend_result['p95_ms']}ms")
+            shutil.rmtree(output_dir, ignore_errors=True)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"results written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
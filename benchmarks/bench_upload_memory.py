@@ -0,0 +1,167 @@
+"""
+Peak memory of concurrent uploads: POST /api/extract against a real threaded WSGI server.
+
+Each concurrency level runs in a fresh server process (werkzeug, one thread per connection, fake
+Gemini backend). The driver sends --requests large photo-like images with --concurrency
+connections in flight and samples the server's RSS from /proc/<pid>/status every few ms.
+Reported per level: RSS after a small warm-up upload (code paths and lazy imports loaded, no
+large buffers freed into the allocator yet), peak RSS, (peak - baseline) / concurrency as the
+cost of one in-flight upload, and throughput.
+
+Only the HTTP surface is used, so --root can point at another checkout (git worktree) to compare
+before/after. Near-duplicate lookup and the extraction cache are off so every upload is decoded,
+sent to the fake model and saved. Linux only (/proc).
+
+Usage:
+    python benchmarks/bench_upload_memory.py [--concurrency 1 4 16] [--requests 48] [--format jpeg png]
+    git worktree add /tmp/base HEAD~1 && python benchmarks/bench_upload_memory.py --root /tmp/base
+"""
+
+import argparse
+import http.client
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVER = """
+import os, sys
+os.chdir(sys.argv[2])
+sys.path.insert(0, sys.argv[1])
+from werkzeug.serving import make_server
+import api_server
+server = make_server("127.0.0.1", 0, api_server.app, threaded=True)
+print(server.server_port, flush=True)
+server.serve_forever()
+"""
+
+
+def photo(fmt, width, height, seed=0):
+    """Smooth gradients plus sensor-like noise: compresses like a photo, not like flat color"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([x / width * 255, y / height * 255, (x + y) / (width + height) * 255], axis=-1)
+    pixels = np.clip(base + rng.normal(0, 6, base.shape), 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    if fmt == "jpeg":
+        Image.fromarray(pixels).save(buf, "JPEG", quality=92)
+    else:
+        Image.fromarray(pixels).save(buf, "PNG", compress_level=1)
+    return buf.getvalue()
+
+
+def multipart(data, filename):
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"image\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: image/{filename.rsplit('.', 1)[1]}\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def upload(port, body, content_type):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    try:
+        conn.request("POST", "/api/extract", body=body, headers={"Content-Type": content_type})
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def run_level(args, concurrency, body, content_type, warmup):
+    env = dict(os.environ, GEMINI_BACKEND="fake", GEMINI_FAKE_LATENCY=args.latency, GEMINI_RPM="0",
+               GEMINI_TPM="0", PHASH_MODE="off", EXTRACTION_CACHE="false", REQUEST_LOG="false",
+               RECOMMEND_CACHE_SIZE="0")
+    workdir = tempfile.mkdtemp(prefix="bench_upload_")
+    server = subprocess.Popen([sys.executable, "-c", SERVER, args.root, workdir], env=env,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        port = int(server.stdout.readline())
+        assert upload(port, *warmup) == 200, "warm-up upload failed"
+        time.sleep(1.0)  # let the warm-up's thumbnail renders finish
+        baseline = rss_mb(server.pid)
+
+        peak = baseline
+        done = threading.Event()
+
+        def sample():
+            nonlocal peak
+            while not done.wait(0.005):
+                peak = max(peak, rss_mb(server.pid))
+
+        sampler = threading.Thread(target=sample, daemon=True)
+        sampler.start()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            statuses = list(pool.map(lambda _: upload(port, body, content_type), range(args.requests)))
+        elapsed = time.perf_counter() - started
+        time.sleep(0.5)  # background thumbnail renders still count towards the peak
+        done.set()
+        sampler.join()
+    finally:
+        server.kill()
+        server.wait()
+
+    return {
+        "concurrency": concurrency, "requests": len(statuses),
+        "errors": sum(1 for status in statuses if status != 200),
+        "baseline_mb": round(baseline, 1), "peak_mb": round(peak, 1),
+        "per_upload_mb": round((peak - baseline) / concurrency, 1),
+        "throughput_rps": round(len(statuses) / elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", default=ROOT, help="checkout whose api_server is measured")
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=48, help="uploads per concurrency level")
+    parser.add_argument("--format", nargs="+", default=["jpeg", "png"], choices=["jpeg", "png"])
+    parser.add_argument("--size", default="4032x3024", help="image size of the JPEG upload (PNG: half of each side)")
+    parser.add_argument("--latency", default="0.3", help="fake Gemini latency spec")
+    parser.add_argument("--output", help="write results as JSON")
+    args = parser.parse_args()
+    args.root = os.path.abspath(args.root)
+
+    width, height = (int(v) for v in args.size.split("x"))
+    fmt_ext = {"jpeg": "jpg", "png": "png"}
+    results = []
+    for fmt in args.format:
+        data = photo(fmt, width, height) if fmt == "jpeg" else photo(fmt, width // 2, height // 2)
+        body, content_type = multipart(data, f"upload.{fmt_ext[fmt]}")
+        warmup = multipart(photo(fmt, 256, 192, seed=1), f"warmup.{fmt_ext[fmt]}")
+        print(f"{fmt}: {len(data) / 2**20:.1f}MB upload | root {args.root}")
+        for concurrency in args.concurrency:
+            r = run_level(args, concurrency, body, content_type, warmup)
+            r["format"], r["upload_mb"] = fmt, round(len(data) / 2**20, 2)
+            results.append(r)
+            print(f"[{fmt}|c={concurrency:3}] baseline {r['baseline_mb']}MB | peak {r['peak_mb']}MB | "
+                  f"per in-flight upload {r['per_upload_mb']}MB | {r['throughput_rps']} rps | errors {r['errors']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+        print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
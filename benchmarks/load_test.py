@@ -0,0 +1,190 @@
+"""
+End-to-end load test: replays mixed traffic at a target rate and reports throughput and
+p50/p95/p99 per route. No Gemini quota is used when the server runs with GEMINI_BACKEND=fake.
+
+Routes (weights via --mix): extract (POST /api/extract with a fresh random image), list
+(GET /api/wardrobe/items), score (GET /api/outfit/score on random existing pairs), recommend
+(GET /api/recommend/outfit).
+
+Requests are sent open-loop: request i is due at start + i/rps regardless of how earlier ones
+went, and latency is measured from that due time, so a slow server shows up as queueing delay
+instead of a lower request rate (no coordinated omission).
+
+By default the app is started in-process on a random port with GEMINI_BACKEND=fake and a
+synthetic wardrobe in a temporary directory; --url targets an already running server instead.
+
+Usage:
+    python benchmarks/load_test.py [--rps 20] [--duration 30] [--mix extract=1,list=5,score=3,recommend=2]
+    GEMINI_FAKE_LATENCY=lognormal:1.2,0.5 GEMINI_FAKE_ERROR_RATE=0.05 python benchmarks/load_test.py --rps 50
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 --output load.json
+"""
+
+import argparse
+import io
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from PIL import Image
+
+ROUTES = ("extract", "list", "score", "recommend")
+
+
+def parse_mix(spec):
+    weights = {}
+    for part in spec.split(","):
+        route, _, weight = part.partition("=")
+        if route not in ROUTES:
+            raise SystemExit(f"unknown route in --mix: {route} (choose from {ROUTES})")
+        weights[route] = float(weight or 1)
+    return weights
+
+
+def percentile(sorted_values, p):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))] if sorted_values else None
+
+
+def start_local_server(wardrobe_size, seed):
+    """Run api_server in this process (fake Gemini, synthetic wardrobe); returns its base URL"""
+    os.environ.setdefault("GEMINI_BACKEND", "fake")
+    os.chdir(tempfile.mkdtemp(prefix="load_test_"))  # relative data dirs of the app land here
+    import api_server
+    from benchmarks.synthetic import write_wardrobe
+    from werkzeug.serving import make_server
+
+    write_wardrobe(api_server.OUTPUT_DIR, wardrobe_size, seed)
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # no access log line per request
+    server = make_server("127.0.0.1", 0, api_server.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"in-process server on port {server.server_port} (GEMINI_BACKEND={api_server.GEMINI_BACKEND}, "
+          f"{wardrobe_size} items in {os.getcwd()})")
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def http(method, url, body=None, headers=None, timeout=60):
+    req = urllib.request.Request(url, data=body, method=method, headers=headers or {})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def random_jpeg(rng):
+    """Noise image: unique bytes and dHash, so neither the extraction cache nor dedupe short-circuits it"""
+    pixels = np.random.default_rng(rng.getrandbits(32)).integers(0, 256, (128, 128, 3), dtype=np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, "JPEG", quality=80)
+    return buf.getvalue()
+
+
+def multipart(field, filename, data, content_type="image/jpeg"):
+    boundary = uuid.uuid4().hex
+    body = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"{field}\"; filename=\"{filename}\"\r\n"
+            f"Content-Type: {content_type}\r\n\r\n").encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+
+
+def item_ids(base_url, category):
+    status, body = http("GET", f"{base_url}/api/wardrobe/items?category={category}&fields=id&limit=500")
+    if status != 200:
+        raise SystemExit(f"could not list {category} items: HTTP {status}")
+    return [item["id"] for item in json.loads(body)["items"]]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", help="base URL of a running server (default: start one in-process)")
+    parser.add_argument("--rps", type=float, default=20)
+    parser.add_argument("--duration", type=float, default=30, help="seconds of traffic")
+    parser.add_argument("--mix", default="extract=1,list=5,score=3,recommend=2")
+    parser.add_argument("--concurrency", type=int, default=64, help="max requests in flight")
+    parser.add_argument("--wardrobe", type=int, default=500, help="synthetic items for the in-process server")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report as JSON")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    output = os.path.abspath(args.output) if args.output else None  # before the in-process server changes cwd
+    base_url = args.url.rstrip("/") if args.url else start_local_server(args.wardrobe, args.seed)
+    rng = random.Random(args.seed)
+    tops, bottoms = item_ids(base_url, "top"), item_ids(base_url, "bottom")
+
+    def build(route):
+        """(method, url, body, headers) for one request; built on the scheduling thread so rng stays seeded"""
+        if route == "extract":
+            body, headers = multipart("image", "load.jpg", random_jpeg(rng))
+            return "POST", f"{base_url}/api/extract", body, headers
+        if route == "list":
+            return "GET", f"{base_url}/api/wardrobe/items?limit=50&fields=id,category,color,image_url", None, None
+        if route == "score" and tops and bottoms:
+            return "GET", f"{base_url}/api/outfit/score?top_id={rng.choice(tops)}&bottom_id={rng.choice(bottoms)}", None, None
+        return "GET", f"{base_url}/api/recommend/outfit?count=3", None, None
+
+    results = {route: {"latencies": [], "errors": 0, "status": {}} for route in mix}
+    lock = threading.Lock()
+
+    def send(route, request_args, due):
+        try:
+            status, _ = http(*request_args)
+        except Exception:
+            status = "exception"
+        latency = (time.perf_counter() - due) * 1000
+        with lock:
+            r = results[route]
+            r["latencies"].append(latency)
+            r["status"][str(status)] = r["status"].get(str(status), 0) + 1
+            if status == "exception" or not 200 <= status < 300:
+                r["errors"] += 1
+
+    routes, weights = list(mix), list(mix.values())
+    total = int(args.rps * args.duration)
+    print(f"sending {total} requests at {args.rps} rps, mix {mix}")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for i in range(total):
+            due = start + i / args.rps
+            route = rng.choices(routes, weights)[0]
+            request_args = build(route)
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, route, request_args, due)
+    elapsed = time.perf_counter() - start
+
+    report = {"target_rps": args.rps, "duration_s": round(elapsed, 2), "requests": total,
+              "achieved_rps": round(total / elapsed, 2), "routes": {}}
+    for route, r in results.items():
+        latencies = sorted(r["latencies"])
+        report["routes"][route] = {
+            "count": len(latencies), "errors": r["errors"], "status": r["status"],
+            "throughput_rps": round(len(latencies) / elapsed, 2),
+            "p50_ms": round(percentile(latencies, 0.50), 1) if latencies else None,
+            "p95_ms": round(percentile(latencies, 0.95), 1) if latencies else None,
+            "p99_ms": round(percentile(latencies, 0.99), 1) if latencies else None,
+        }
+        s = report["routes"][route]
+        print(f"[{route:9}] {s['count']:5d} req | {s['throughput_rps']:6.2f} rps | errors {s['errors']} "
+              f"| p50 {s['p50_ms']}ms p95 {s['p95_ms']}ms p99 {s['p99_ms']}ms | {s['status']}")
+    print(f"[total    ] {total} requests in {elapsed:.1f}s ({report['achieved_rps']} rps, target {args.rps})")
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"report written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Seeded synthetic data shared by the benchmarks.
+
+- make_items / random_attributes: in-memory wardrobe items (the dicts load_wardrobe_items returns)
+- write_wardrobe: an extracted_attributes/-style directory (pretty-printed JSON + tiny images)
+- messy_outputs: a corpus of model responses with the defects seen in practice
+  (code fences, commentary, Python literals, trailing commas, schema drift, truncation)
+
+Same seed -> same wardrobe and corpus, so runs on different commits are comparable.
+"""
+
+import io
+import json
+import os
+import random
+
+import api_server
+from PIL import Image
+
+SIZES = (100, 1000, 10000, 100000)
+MAINS = ("top", "bottom", "outer", "shoes")
+
+
+def random_attributes(rng, main=None):
+    """Full DEFAULT_OBJ-shaped (normalized) attributes with random enum values"""
+    enums = api_server.ENUMS
+    raw = {
+        "category": {"main": main or rng.choice(MAINS), "sub": rng.choice(enums["category_sub"]), "confidence": rng.random()},
+        "color": {"primary": rng.choice(enums["color"]), "secondary": rng.sample(enums["color"], rng.randint(0, 2)),
+                  "tone": rng.choice(enums["tone"]), "confidence": rng.random()},
+        "pattern": {"type": rng.choice(enums["pattern"]), "confidence": rng.random()},
+        "material": {"guess": rng.choice(enums["material"]), "confidence": rng.random()},
+        "fit": {"type": rng.choice(enums["fit"]), "confidence": rng.random()},
+        "details": {"neckline": rng.choice(enums["neckline"]), "sleeve": rng.choice(enums["sleeve"]),
+                    "length": rng.choice(enums["length"]), "closure": rng.sample(enums["closure"], rng.randint(1, 2)),
+                    "print_or_logo": rng.random() < 0.3},
+        "style_tags": rng.sample(enums["style_tags"], rng.randint(0, 3)),
+        "scores": {"formality": round(rng.random(), 2), "warmth": round(rng.random(), 2),
+                   "season": rng.sample(enums["season"], rng.randint(0, 4)), "versatility": round(rng.random(), 2)},
+        "meta": {"is_layering_piece": rng.random() < 0.2, "notes": None},
+        "confidence": rng.random(),
+    }
+    return api_server.normalize(raw)
+
+
+def make_items(n, main, rng):
+    """n in-memory items of one category, shaped like load_wardrobe_items() entries"""
+    return [{"id": f"{main}_{i}", "attributes": random_attributes(rng, main)} for i in range(n)]
+
+
+def _image_templates():
+    templates = []
+    for color in ("black", "white", "navy", "gray", "beige", "red"):
+        buf = io.BytesIO()
+        Image.new("RGB", (32, 32), color).save(buf, "PNG")
+        templates.append(buf.getvalue())
+    return templates
+
+
+def write_wardrobe(output_dir, n, seed=0, images=True):
+    """Write n items as attributes_<i>.json (+ .png) the way /api/extract saves them; returns output_dir"""
+    rng = random.Random(seed)
+    templates = _image_templates() if images else []
+    os.makedirs(output_dir, exist_ok=True)
+    for i in range(n):
+        item_id = f"attributes_{i:07d}"
+        with open(os.path.join(output_dir, f"{item_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(random_attributes(rng), f, ensure_ascii=False, indent=2)
+        if images:
+            with open(os.path.join(output_dir, f"{item_id}.png"), "wb") as f:
+                f.write(templates[i % len(templates)])
+    return output_dir
+
+
+def _python_literals(text):
+    return text.replace("true", "True").replace("false", "False").replace("null", "None")
+
+
+def _trailing_commas(text):
+    return text.replace("\n  }", ",\n  }").replace("]", ",]", 1)
+
+
+def _schema_drift(obj, rng):
+    obj["details"]["closure"] = obj["details"]["closure"][0]
+    obj["scores"]["season"] = ", ".join(obj["scores"]["season"]) or "winter"
+    obj["category"]["confidence"] = round(obj["category"]["confidence"] * 100)
+    if rng.random() < 0.5:
+        del obj["meta"]
+    obj["explanation"] = "looks like a casual item"
+    return obj
+
+
+# (kind, fn(rng, obj) -> text)
+MESSY_KINDS = [
+    ("clean", lambda rng, obj: json.dumps(obj)),
+    ("pretty", lambda rng, obj: json.dumps(obj, indent=2)),
+    ("fenced", lambda rng, obj: "```json\n" + json.dumps(obj, indent=2) + "\n```"),
+    ("prose", lambda rng, obj: "Here is the analysis:\n" + json.dumps(obj) + "\nLet me know if you need more {details}."),
+    ("python_literals", lambda rng, obj: _python_literals(json.dumps(obj, indent=2))),
+    ("trailing_commas", lambda rng, obj: _trailing_commas(json.dumps(obj, indent=2))),
+    ("schema_drift", lambda rng, obj: json.dumps(_schema_drift(obj, rng))),
+    ("truncated", lambda rng, obj: json.dumps(obj)[:rng.randint(20, 200)]),
+]
+
+
+def messy_outputs(n, seed=0):
+    """n (kind, text) model responses cycling through MESSY_KINDS"""
+    rng = random.Random(seed)
+    corpus = []
+    for i in range(n):
+        kind, render = MESSY_KINDS[i % len(MESSY_KINDS)]
+        corpus.append((kind, render(rng, random_attributes(rng))))
+    return corpus
@@ -0,0 +1,79 @@
+"""Shared fixtures: api_server's state pointed at a throwaway working directory."""
+
+import io
+import os
+import random
+
+import pytest
+from PIL import Image
+
+import api_server
+from benchmarks.synthetic import random_attributes
+
+
+def make_store(backend, output_dir=None, namespace=""):
+    output_dir = output_dir or api_server.OUTPUT_DIR
+    if backend == "sqlite":
+        return api_server.SqliteWardrobeStore(output_dir, namespace=namespace)
+    return api_server.WardrobeStore(output_dir, refresh_interval=0, namespace=namespace)
+
+
+def jpeg_bytes(seed):
+    """A small random JPEG, the same for the same seed"""
+    rng = random.Random(seed)
+    img = Image.new("RGB", (64, 64), tuple(rng.randrange(256) for _ in range(3)))
+    for _ in range(20):
+        x, y = rng.randrange(56), rng.randrange(56)
+        img.paste(tuple(rng.randrange(256) for _ in range(3)), (x, y, x + 8, y + 8))
+    buf = io.BytesIO()
+    img.save(buf, "JPEG")
+    return buf.getvalue()
+
+
+@pytest.fixture
+def backend():
+    """Wardrobe backend of the default store; override with params=["files", "sqlite"] to run both"""
+    return "files"
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch, backend):
+    """Run in tmp_path (api_server's paths are relative to the cwd) with an empty default wardrobe"""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(api_server.OUTPUT_DIR)
+    store = make_store(backend)
+    monkeypatch.setattr(api_server, "WARDROBE_BACKEND", backend)
+    monkeypatch.setattr(api_server, "wardrobe_store", store)
+    monkeypatch.setattr(api_server, "phash_index", api_server.PhashIndex(store))
+    monkeypatch.setattr(api_server, "recommendation_cache", api_server.RecommendationCache(db_path=""))
+    monkeypatch.setattr(api_server, "wardrobe_namespaces", api_server.WardrobeNamespaces())
+    return tmp_path
+
+
+@pytest.fixture
+def client(workdir):
+    return api_server.app.test_client()
+
+
+@pytest.fixture
+def save_items():
+    """save_items(store, n, seed, prefix) -> ids of n random items saved the way /api/extract saves them"""
+    def save(store, n, seed=0, prefix="item"):
+        rng = random.Random(seed)
+        ids = []
+        for i in range(n):
+            item_id = f"{prefix}_{i:04d}"
+            store.save(item_id, random_attributes(rng), b"png", ".png")
+            ids.append(item_id)
+        return ids
+    return save
+
+
+@pytest.fixture
+def model(monkeypatch):
+    """Fake Gemini model behind a client whose breaker opens on the first transient failure"""
+    model = api_server.FakeGeminiModel(text=api_server.FakeGeminiResponder(seed=0))
+    client = api_server.GeminiClient(model=model, rpm=0, tpm=0, max_retries=0, sleep=lambda seconds: None,
+                                     breaker=api_server.CircuitBreaker(threshold=1, reset_timeout=30))
+    monkeypatch.setattr(api_server, "gemini_client", client)
+    return model
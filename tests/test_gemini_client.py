@@ -0,0 +1,190 @@
+"""TokenBucket, CircuitBreaker and GeminiClient rate budget / breaker bookkeeping on an injected clock."""
+
+import pytest
+
+import api_server
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def unavailable():
+    return api_server._fake_service_unavailable()
+
+
+def make_client(clock, model=None, sleeps=None, **kwargs):
+    kwargs.setdefault("rpm", 60)
+    kwargs.setdefault("tpm", 60000)
+    kwargs.setdefault("max_retries", 0)
+    return api_server.GeminiClient(model or api_server.FakeGeminiModel(), clock=clock,
+                                   sleep=(sleeps.append if sleeps is not None else lambda seconds: None), **kwargs)
+
+
+def test_bucket_waits_and_refills(clock):
+    bucket = api_server.TokenBucket(60, clock)  # 1 token/second, 60 capacity
+    assert [bucket.acquire(1, max_wait=10) for _ in range(60)] == [0.0] * 60
+    assert bucket.acquire(1, max_wait=10) == pytest.approx(1.0)
+    assert bucket.acquire(1, max_wait=10) == pytest.approx(2.0)  # queued behind the previous caller
+    clock.now += 5
+    assert bucket.tokens == pytest.approx(-2)  # not refilled until the next call
+    assert bucket.acquire(1, max_wait=10) == 0.0
+    assert bucket.tokens == pytest.approx(2)
+
+
+def test_bucket_caps_at_capacity(clock):
+    bucket = api_server.TokenBucket(60, clock)
+    clock.now += 3600
+    bucket.adjust(1000)
+    assert bucket.tokens == 60
+    assert bucket.acquire(500, max_wait=0) == 0.0  # larger than capacity: charged as a full minute
+    assert bucket.tokens == 0
+
+
+def test_bucket_rejects_long_waits_without_charging(clock):
+    bucket = api_server.TokenBucket(60, clock)
+    bucket.tokens = 0
+    with pytest.raises(api_server.GeminiUnavailableError) as e:
+        bucket.acquire(5, max_wait=4)
+    assert e.value.retry_after == pytest.approx(5)
+    assert bucket.tokens == 0
+
+
+def test_unlimited_bucket(clock):
+    bucket = api_server.TokenBucket(0, clock)
+    assert bucket.acquire(10 ** 9, max_wait=0) == 0.0
+    bucket.adjust(-10 ** 9)
+    assert bucket.acquire(1, max_wait=0) == 0.0
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = api_server.CircuitBreaker(threshold=3, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()  # resets the streak
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert (breaker.state, breaker.trips) == ("open", 1)
+
+    clock.now += 10
+    with pytest.raises(api_server.GeminiUnavailableError) as e:
+        breaker.allow()
+    assert e.value.retry_after == pytest.approx(20)
+
+
+def test_breaker_half_open_probe(clock):
+    breaker = api_server.CircuitBreaker(threshold=1, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    clock.now += 30
+    assert breaker.state == "half_open"
+    breaker.allow()  # the probe
+    with pytest.raises(api_server.GeminiUnavailableError):
+        breaker.allow()  # one probe at a time
+
+    breaker.record_failure()  # failed probe: open again for a full reset_timeout
+    assert (breaker.state, breaker.trips) == ("open", 2)
+    clock.now += 29
+    assert breaker.state == "open"
+    clock.now += 1
+    breaker.allow()
+    breaker.release()  # probe ended for a non-transient reason: still half-open, next probe allowed
+    assert breaker.state == "half_open"
+    breaker.allow()
+    breaker.record_success()
+    assert (breaker.state, breaker.failures) == ("closed", 0)
+
+
+def test_tpm_rejection_refunds_request_token(clock):
+    client = make_client(clock, rate_wait_max=0)
+    client.tokens.tokens = 0
+    for _ in range(5):
+        with pytest.raises(api_server.GeminiUnavailableError):
+            client.generate_content("ping")
+    assert client.requests.tokens == 60
+    assert client.stats()["rejected"] == 5
+    assert client.model.calls == 0
+
+
+def test_failed_attempts_refund_token_budget(clock):
+    model = api_server.FakeGeminiModel(text="ok", errors=[unavailable(), unavailable()])
+    sleeps = []
+    client = make_client(clock, model, sleeps, max_retries=2)
+    estimate = api_server.estimate_gemini_tokens("ping")
+    client.generate_content("ping")
+
+    assert model.calls == 3
+    assert len(sleeps) == 2  # backoff before each retry
+    # Every attempt counts against requests/minute; only the successful one's usage stays on tokens/minute
+    assert client.requests.tokens == 57
+    usage = len("ok") // 4 + 1
+    assert client.tokens.tokens == 60000 - usage
+    assert estimate > usage
+    assert client.stats()["retries"] == 2
+
+
+def test_rate_wait_is_slept(clock):
+    sleeps = []
+    client = make_client(clock, sleeps=sleeps, rpm=60, rate_wait_max=10)
+    client.requests.tokens = 0
+    client.generate_content("ping")
+    assert sleeps == [pytest.approx(1.0)]
+    assert client.stats()["throttled_seconds"] == pytest.approx(1.0)
+
+
+def test_breaker_trips_and_rejects_without_calling_model(clock):
+    model = api_server.FakeGeminiModel(error_rate=1.0)
+    client = make_client(clock, model, breaker=api_server.CircuitBreaker(threshold=2, reset_timeout=30, clock=clock))
+    for _ in range(2):
+        with pytest.raises(Exception, match="fake 503"):
+            client.generate_content("ping")
+    assert client.breaker.state == "open"
+    assert not client.available()
+
+    tokens = (client.requests.tokens, client.tokens.tokens)
+    with pytest.raises(api_server.GeminiUnavailableError):
+        client.generate_content("ping")
+    assert model.calls == 2
+    assert (client.requests.tokens, client.tokens.tokens) == tokens  # nothing reserved for a rejected call
+    assert client.stats()["rejected"] == 1
+
+    # Half-open probe succeeds -> closed
+    model.error_rate = 0
+    clock.now += 30
+    client.generate_content("ping")
+    assert client.stats()["state"] == "closed"
+
+
+def test_non_transient_error_does_not_trip_breaker(clock):
+    model = api_server.FakeGeminiModel(errors=[ValueError("blocked")] * 5)
+    client = make_client(clock, model, max_retries=3,
+                         breaker=api_server.CircuitBreaker(threshold=1, reset_timeout=30, clock=clock))
+    for _ in range(3):
+        with pytest.raises(ValueError):
+            client.generate_content("ping")
+    assert model.calls == 3  # not retried
+    assert client.breaker.state == "closed"
+    assert client.stats()["failures"] == 3
+
+
+def test_probe_ended_by_non_transient_error_allows_next_probe(clock):
+    model = api_server.FakeGeminiModel(errors=[unavailable(), ValueError("blocked")])
+    client = make_client(clock, model, breaker=api_server.CircuitBreaker(threshold=1, reset_timeout=30, clock=clock))
+    with pytest.raises(Exception):
+        client.generate_content("ping")
+    clock.now += 30
+    with pytest.raises(ValueError):
+        client.generate_content("ping")  # the probe
+    assert client.breaker.state == "half_open"
+    client.generate_content("ping")
+    assert client.breaker.state == "closed"
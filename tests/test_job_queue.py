@@ -0,0 +1,182 @@
+"""JobQueue: breaker requeue, lease expiry, attempt limits, namespace scoping and the SSE stream."""
+
+import io
+import json
+import os
+import time
+
+import pytest
+
+import api_server
+from conftest import jpeg_bytes
+
+
+class Clock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def jobs(workdir, model, monkeypatch):
+    # No worker threads: tests claim and execute jobs themselves
+    jobs = api_server.JobQueue(job_dir="jobs", workers=0, lease_seconds=10, max_attempts=2)
+    monkeypatch.setattr(api_server, "job_queue", jobs)
+    return jobs
+
+
+def enqueue(jobs, seed=0, namespace=""):
+    return jobs.enqueue(api_server.UploadedImage.from_bytes(jpeg_bytes(seed)), f"shirt{seed}.jpg", namespace=namespace)
+
+
+def run_next(jobs):
+    row = jobs._claim()
+    assert row is not None
+    jobs._execute(row)
+    return row
+
+
+def uploads(jobs):
+    return os.listdir(jobs.upload_dir)
+
+
+def test_job_succeeds(jobs, model):
+    job_id = enqueue(jobs)
+    assert jobs.get(job_id)["status"] == "queued"
+    run_next(jobs)
+    job = jobs.get(job_id)
+    assert (job["status"], job["stage"], job["attempts"]) == ("succeeded", "done", 1)
+    assert job["result"]["success"] is True
+    assert api_server.wardrobe_store.get(job["result"]["item_id"]) is not None
+    assert model.calls == 1
+    assert uploads(jobs) == []
+
+
+def test_breaker_requeue_does_not_spend_attempts(jobs, model, clock):
+    api_server.gemini_client.breaker.record_failure()  # circuit open for 30s
+    job_id = enqueue(jobs)
+    for _ in range(jobs.max_attempts + 2):
+        run_next(jobs)
+        job = jobs.get(job_id)
+        assert (job["status"], job["stage"], job["attempts"]) == ("queued", "waiting_for_gemini", 0)
+        assert jobs._claim() is None  # not before available_at (when the breaker is due to close)
+        clock.now += api_server.gemini_client.breaker.reset_timeout + 1  # the breaker runs on its own clock
+    assert model.calls == 0
+    assert len(uploads(jobs)) == 1
+
+    api_server.gemini_client.breaker.record_success()
+    run_next(jobs)
+    job = jobs.get(job_id)
+    assert (job["status"], job["attempts"]) == ("succeeded", 1)
+    assert model.calls == 1
+
+
+def test_expired_lease_is_picked_up_again(jobs, clock):
+    job_id = enqueue(jobs)
+    assert jobs._claim() is not None  # this worker "dies" without finishing
+    assert jobs.get(job_id)["status"] == "running"
+    assert jobs._claim() is None  # lease still held
+
+    clock.now += jobs.lease_seconds + 1
+    run_next(jobs)
+    job = jobs.get(job_id)
+    assert (job["status"], job["attempts"]) == ("succeeded", 2)
+
+
+def test_attempt_limit(jobs, clock):
+    job_id = enqueue(jobs)
+    for _ in range(jobs.max_attempts):
+        assert jobs._claim() is not None
+        clock.now += jobs.lease_seconds + 1
+    run_next(jobs)
+    job = jobs.get(job_id)
+    assert (job["status"], job["stage"]) == ("failed", "failed")
+    assert job["attempts"] == jobs.max_attempts
+    assert job["error"] == f"Gave up after {jobs.max_attempts} interrupted attempts"
+    assert uploads(jobs) == []
+    assert jobs._claim() is None
+
+
+def test_extraction_error_fails_job(jobs, model):
+    model.errors = [ValueError("safety block")]
+    job_id = enqueue(jobs)
+    run_next(jobs)
+    job = jobs.get(job_id)
+    assert job["status"] == "failed"
+    assert "safety block" in job["error"]
+    assert api_server.gemini_client.breaker.state == "closed"  # not a transient error
+    assert uploads(jobs) == []
+
+
+def post_async(client, seed, namespace=None):
+    headers = {api_server.NAMESPACE_HEADER: namespace} if namespace else {}
+    response = client.post("/api/extract?async=true", headers=headers,
+                           data={"image": (io.BytesIO(jpeg_bytes(seed)), f"shirt{seed}.jpg")})
+    assert response.status_code == 202
+    return response.get_json()["job_id"]
+
+
+def test_job_endpoints_are_scoped_to_namespace(client, jobs):
+    job_id = post_async(client, 1, namespace="alice")
+    alice = {api_server.NAMESPACE_HEADER: "alice"}
+    for headers in ({}, {api_server.NAMESPACE_HEADER: "bob"}):
+        assert client.get(f"/api/jobs/{job_id}", headers=headers).status_code == 404
+        assert client.get(f"/api/jobs/{job_id}/events", headers=headers).status_code == 404
+    assert client.get(f"/api/jobs/{job_id}", headers=alice).get_json()["status"] == "queued"
+
+    run_next(jobs)
+    assert client.get(f"/api/jobs/{job_id}", headers=alice).get_json()["status"] == "succeeded"
+    assert client.get("/api/wardrobe/items", headers=alice).get_json()["total"] == 1
+    assert client.get("/api/wardrobe/items").get_json()["total"] == 0
+
+
+def parse_events(chunks):
+    events = []
+    for chunk in chunks:
+        if chunk.startswith(":"):
+            events.append(("comment", chunk.strip()))
+            continue
+        lines = dict(line.split(": ", 1) for line in chunk.strip().splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_event_stream(jobs):
+    job_id = enqueue(jobs)
+    stream = jobs.events(job_id, poll_interval=0, heartbeat=3600)
+    first = parse_events([next(stream)])
+    assert first == [("status", jobs.get(job_id))]
+
+    run_next(jobs)
+    rest = parse_events(list(stream))
+    assert [(event, data["status"], data["stage"]) for event, data in rest] == [("status", "succeeded", "done")]
+    assert rest[0][1]["result"]["success"] is True
+
+
+def test_event_stream_heartbeat_and_unknown_job(jobs, clock):
+    job_id = enqueue(jobs)
+    stream = jobs.events(job_id, poll_interval=0, heartbeat=15)
+    next(stream)
+    clock.now += 16
+    assert next(stream) == ": keep-alive\n\n"
+    stream.close()
+
+    assert parse_events(list(jobs.events("nope", poll_interval=0))) == [("error", {"error": "Job not found"})]
+
+
+def test_event_stream_endpoint(client, jobs):
+    job_id = post_async(client, 2)
+    run_next(jobs)
+    response = client.get(f"/api/jobs/{job_id}/events")
+    assert response.mimetype == "text/event-stream"
+    events = parse_events(chunk for chunk in response.get_data(as_text=True).split("\n\n") if chunk)
+    assert [(event, data["status"]) for event, data in events] == [("status", "succeeded")]
@@ -0,0 +1,154 @@
+"""Wardrobe namespaces: header vs ?namespace=, isolation of items, images, jobs and recommendation caches, shard paths."""
+
+import io
+import os
+
+import pytest
+
+import api_server
+from conftest import jpeg_bytes
+
+ALICE = {api_server.NAMESPACE_HEADER: "alice"}
+BOB = {api_server.NAMESPACE_HEADER: "bob"}
+
+
+def upload(client, seed, headers, query=""):
+    response = client.post(f"/api/extract{query}", headers=headers,
+                           data={"image": (io.BytesIO(jpeg_bytes(seed)), f"shirt{seed}.jpg")})
+    assert response.status_code in (200, 202), response.get_json()
+    return response.get_json()
+
+
+def item_ids(client, headers=None, query=None):
+    response = client.get("/api/wardrobe/items", headers=headers or {}, query_string=query or {})
+    assert response.status_code == 200
+    return sorted(item["id"] for item in response.get_json()["items"])
+
+
+@pytest.mark.parametrize("method, url", [
+    ("GET", "/api/wardrobe/items"),
+    ("GET", "/api/images/x.png"),
+    ("GET", "/api/recommend/outfit"),
+    ("GET", "/api/outfit/score?top_id=a&bottom_id=b"),
+    ("GET", "/api/jobs/nope"),
+    ("POST", "/api/extract"),
+])
+def test_query_param_is_rejected_by_default(client, method, url):
+    response = client.open(url + ("&" if "?" in url else "?") + "namespace=alice", method=method)
+    assert response.status_code == 400
+    assert api_server.NAMESPACE_HEADER in response.get_json()["error"]
+
+
+def test_query_param_opt_in(client, save_items, monkeypatch):
+    monkeypatch.setattr(api_server, "NAMESPACE_QUERY_PARAM", True)
+    ids = save_items(api_server.wardrobe_namespaces.get("alice").store, 3)
+    assert item_ids(client, query={"namespace": "alice"}) == ids
+    assert item_ids(client, headers=BOB, query={"namespace": "alice"}) == []  # the header wins
+    assert item_ids(client) == []
+
+    image_url = client.get("/api/wardrobe/items", headers=ALICE).get_json()["items"][0]["image_url"]
+    assert image_url == f"/api/images/{ids[0]}.png?namespace=alice"
+    assert client.get(image_url).status_code == 200
+
+
+def test_image_urls_carry_no_namespace_by_default(client, save_items):
+    item_id = save_items(api_server.wardrobe_namespaces.get("alice").store, 1)[0]
+    item = client.get("/api/wardrobe/items", headers=ALICE).get_json()["items"][0]
+    assert item["image_url"] == f"/api/images/{item_id}.png"
+
+
+@pytest.mark.parametrize("name", ["../etc", "/", "-alice", "al ice", "a" * 129])
+def test_malformed_names_are_400(client, name):
+    response = client.get("/api/wardrobe/items", headers={api_server.NAMESPACE_HEADER: name})
+    assert response.status_code == 400
+
+
+def test_items_are_isolated(client, model):
+    alice = upload(client, 1, ALICE)
+    bob = upload(client, 1, BOB)  # the same photo
+    assert "near_duplicate" not in bob  # alice's wardrobe is not searched
+    assert upload(client, 1, ALICE)["near_duplicate"]["item_id"] == alice["item_id"]
+
+    assert alice["item_id"] in item_ids(client, ALICE)
+    assert item_ids(client, BOB) == [bob["item_id"]]
+    assert item_ids(client) == []
+    assert api_server.NAMESPACE_HEADER in client.get("/api/wardrobe/items", headers=ALICE).vary
+
+    alice_dir = os.path.join(api_server.OUTPUT_DIR, api_server.namespace_path("alice"))
+    assert os.path.dirname(alice["saved_to"]) == alice_dir
+    assert not [name for name in os.listdir(api_server.OUTPUT_DIR) if name.startswith("attributes_")]
+
+
+def test_images_are_isolated(client, save_items):
+    alice = save_items(api_server.wardrobe_namespaces.get("alice").store, 1, prefix="alice")[0]
+    default = save_items(api_server.wardrobe_store, 1, prefix="default")[0]
+    assert client.get(f"/api/images/{alice}.png", headers=ALICE).status_code == 200
+    assert client.get(f"/api/images/{alice}.png", headers=BOB).status_code == 404
+    assert client.get(f"/api/images/{alice}.png").status_code == 404
+    assert client.get(f"/api/images/{default}.png").status_code == 200
+    assert client.get(f"/api/images/{default}.png", headers=ALICE).status_code == 404
+
+
+def test_jobs_are_isolated(client, model, monkeypatch):
+    jobs = api_server.JobQueue(job_dir="jobs", workers=0)
+    monkeypatch.setattr(api_server, "job_queue", jobs)
+    submitted = {name: upload(client, 2, headers, query="?async=true")["job_id"]
+                 for name, headers in (("alice", ALICE), ("bob", BOB))}
+    while (row := jobs._claim()) is not None:
+        jobs._execute(row)
+
+    for name, headers in (("alice", ALICE), ("bob", BOB)):
+        other = "bob" if name == "alice" else "alice"
+        job = client.get(f"/api/jobs/{submitted[name]}", headers=headers).get_json()
+        assert job["status"] == "succeeded"
+        assert item_ids(client, headers) == [job["result"]["item_id"]]
+        assert client.get(f"/api/jobs/{submitted[other]}", headers=headers).status_code == 404
+        assert client.get(f"/api/jobs/{submitted[other]}/events", headers=headers).status_code == 404
+    assert item_ids(client) == []
+
+
+def test_recommendation_caches_are_isolated(client, model, save_items):
+    # Identical items in both wardrobes: the content-addressed cache keys are identical too
+    for name in ("alice", "bob"):
+        save_items(api_server.wardrobe_namespaces.get(name).store, 12, seed=7)
+    url = "/api/recommend/outfit?count=2&budget_ms=30000"
+
+    assert client.get(url, headers=ALICE).get_json()["success"] is True
+    assert model.calls == 1
+    client.get(url, headers=ALICE)
+    assert model.calls == 1
+    client.get(url, headers=BOB)
+    assert model.calls == 2  # not served from alice's cache
+
+    upload(client, 3, BOB)  # invalidates bob's cache only
+    alice = api_server.wardrobe_namespaces.get("alice").recommendations.stats()
+    bob = api_server.wardrobe_namespaces.get("bob").recommendations.stats()
+    assert (alice["hits"], alice["misses"], alice["invalidations"]) == (1, 1, 0)
+    assert (bob["hits"], bob["misses"], bob["invalidations"]) == (0, 1, 1)
+    assert api_server.recommendation_cache.stats()["misses"] == 0
+
+
+def test_evicted_namespace_is_reloaded_from_disk(workdir, save_items, monkeypatch):
+    namespaces = api_server.WardrobeNamespaces(max_open=1)
+    monkeypatch.setattr(api_server, "wardrobe_namespaces", namespaces)
+    ids = save_items(namespaces.get("alice").store, 4)
+    first = namespaces.get("alice")
+    namespaces.get("bob")
+    assert namespaces.stats()["evictions"] == 1
+    reopened = namespaces.get("alice")
+    assert reopened is not first
+    assert sorted(item["id"] for item in reopened.store.items()) == ids
+
+
+@pytest.mark.parametrize("name, path", [
+    ("", ""),
+    ("alice", "ns/2b/d8/2bd806c97f0e00af"),
+    ("Alice", "ns/3b/c5/3bc51062973c458d"),
+    ("user-1234", "ns/c6/1a/c61a1c5012d6c652"),
+])
+def test_shard_paths_are_stable(workdir, name, path):
+    # Changing these moves every existing wardrobe: sha256 of the name, never hash()
+    assert api_server.namespace_path(name) == path.replace("/", os.sep)
+    wardrobe = api_server.wardrobe_namespaces.get(name)
+    assert wardrobe.image_file("x.png") == os.path.join(path.replace("/", os.sep), "x.png")
+    assert os.path.normpath(wardrobe.store.output_dir) == os.path.normpath(os.path.join(api_server.OUTPUT_DIR, path))
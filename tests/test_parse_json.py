@@ -0,0 +1,34 @@
+"""parse_json_from_text: objects with nested arrays stay objects, recommendation arrays stay arrays."""
+
+import json
+
+import pytest
+
+import api_server
+
+ITEM = {"category": {"main": "top"}, "color": {"primary": "navy", "secondary": ["navy", "white"]},
+        "style_tags": ["casual"]}
+PAIRS = [{"top_id": "t1", "bottom_id": "b1", "reason": "navy [classic] + white"}]
+
+
+@pytest.mark.parametrize("text, expected", [
+    # Regression: the first balanced array used to be returned, here ["navy", "white"]
+    (json.dumps(ITEM), ITEM),
+    (json.dumps(ITEM, indent=2), ITEM),
+    ('{"color": {"secondary": []}, "style_tags": ["casual"]}', {"color": {"secondary": []}, "style_tags": ["casual"]}),
+    ("Here is the analysis:\n```json\n" + json.dumps(ITEM) + "\n```", ITEM),
+    ("{'color': {'secondary': ['navy', 'white'], 'tone': 'dark', 'is_dark': True, 'notes': None}}",
+     {"color": {"secondary": ["navy", "white"], "tone": "dark", "is_dark": True, "notes": None}}),
+    # Recommendations are top-level arrays, including of objects
+    (json.dumps(PAIRS), PAIRS),
+    ("```json\n" + json.dumps(PAIRS, indent=2) + "\n```", PAIRS),
+    ('Sure!\n[{"top_id": "t1", "bottom_id": "b1",},]', [{"top_id": "t1", "bottom_id": "b1"}]),
+])
+def test_outermost_value_is_returned(text, expected):
+    obj, _ = api_server.parse_json_from_text(text)
+    assert obj == expected
+
+
+@pytest.mark.parametrize("text", ["", "no json here", '"just a string"', "{not json"])
+def test_unparseable_text(text):
+    assert api_server.parse_json_from_text(text)[0] is None
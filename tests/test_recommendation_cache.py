@@ -0,0 +1,134 @@
+"""RecommendationCache: stable keys, LRU/TTL memory tier, namespaced SQLite tier and counters."""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import api_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CANDIDATES = [
+    {"top": {"id": "t1", "attributes": {"color": {"primary": "navy"}, "style_tags": ["casual", "minimal"]}},
+     "bottom": {"id": "b1", "attributes": {"color": {"primary": "beige"}, "scores": {"formality": 0.4}}}},
+    {"top": {"id": "t1", "attributes": {"color": {"primary": "navy"}, "style_tags": ["casual", "minimal"]}},
+     "bottom": {"id": "b2", "attributes": {"category": {"main": "bottom"}, "color": {"primary": "black"}}}},
+]
+
+PICKS = [{"top_id": "t1", "bottom_id": "b1", "reason": "navy and beige"}]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(time, "time", clock)
+    return clock
+
+
+def test_key_is_stable_across_processes():
+    script = ("import json, sys, api_server; "
+              "print(api_server.RecommendationCache.key(json.loads(sys.stdin.read()), 3))")
+    keys = set()
+    for seed in ("1", "2"):
+        out = subprocess.run([sys.executable, "-c", script], input=json.dumps(CANDIDATES), capture_output=True,
+                             text=True, cwd=ROOT, env=dict(os.environ, PYTHONHASHSEED=seed), check=True)
+        keys.add(out.stdout.strip().splitlines()[-1])
+    assert keys == {api_server.RecommendationCache.key(CANDIDATES, 3)}
+
+
+def test_key_depends_on_content_not_dict_order():
+    key = api_server.RecommendationCache.key(CANDIDATES, 3)
+    reordered = json.loads(json.dumps(CANDIDATES))
+    reordered[0]["top"]["attributes"] = dict(reversed(list(reordered[0]["top"]["attributes"].items())))
+    assert api_server.RecommendationCache.key(reordered, 3) == key
+
+    changed = json.loads(json.dumps(CANDIDATES))
+    changed[1]["bottom"]["attributes"]["color"]["primary"] = "white"
+    assert api_server.RecommendationCache.key(changed, 3) != key
+    assert api_server.RecommendationCache.key(CANDIDATES, 2) != key
+    assert api_server.RecommendationCache.key(CANDIDATES[::-1], 3) != key
+
+
+def test_lru_eviction(clock):
+    cache = api_server.RecommendationCache(max_entries=2, ttl=60, db_path="")
+    cache.put("a", [{"n": 1}])
+    cache.put("b", [{"n": 2}])
+    assert cache.get("a") == [{"n": 1}]  # "a" becomes most recently used
+    cache.put("c", [{"n": 3}])
+    assert cache.get("b") is None
+    assert cache.get("a") == [{"n": 1}]
+    assert cache.get("c") == [{"n": 3}]
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["size"] == 2
+
+
+def test_ttl_expiry(clock, tmp_path):
+    cache = api_server.RecommendationCache(ttl=60, db_path=str(tmp_path / "recommend.db"))
+    cache.put("k", PICKS)
+    clock.now += 59
+    assert cache.get("k") == PICKS
+    clock.now += 2
+    assert cache.get("k") is None
+    # Expired rows are not served by the SQLite tier either
+    assert api_server.RecommendationCache(ttl=60, db_path=cache.db_path).get("k") is None
+
+
+def test_sqlite_tier_is_shared_and_promoted(clock, tmp_path):
+    db_path = str(tmp_path / "recommend.db")
+    api_server.RecommendationCache(db_path=db_path).put("k", PICKS)
+
+    other = api_server.RecommendationCache(db_path=db_path)  # another worker process
+    assert other.get("k") == PICKS
+    assert other.get("k") == PICKS
+    stats = other.stats()
+    assert (stats["hits"], stats["db_hits"], stats["misses"], stats["size"]) == (2, 1, 0, 1)
+    assert stats["shared"] is True
+
+
+def test_invalidate_only_drops_own_namespace(clock, tmp_path):
+    db_path = str(tmp_path / "recommend.db")
+    namespaces = ("", "ali", "alice", "bob")
+    for namespace in namespaces:
+        api_server.RecommendationCache(db_path=db_path, namespace=namespace).put("k", [{"ns": namespace}])
+
+    def cached():
+        # Fresh instances so only the SQLite tier can answer
+        return {ns for ns in namespaces if api_server.RecommendationCache(db_path=db_path, namespace=ns).get("k")}
+
+    api_server.RecommendationCache(db_path=db_path, namespace="ali").invalidate()
+    assert cached() == {"", "alice", "bob"}
+    api_server.RecommendationCache(db_path=db_path, namespace="").invalidate()
+    assert cached() == {"alice", "bob"}
+    assert api_server.RecommendationCache(db_path=db_path, namespace="bob").get("k") == [{"ns": "bob"}]
+
+
+def test_invalidate_clears_memory_tier(clock):
+    cache = api_server.RecommendationCache(db_path="")
+    cache.put("k", PICKS)
+    cache.invalidate()
+    assert cache.get("k") is None
+    assert cache.stats()["invalidations"] == 1
+
+
+def test_counters(clock):
+    cache = api_server.RecommendationCache(db_path="")
+    assert cache.stats()["hit_ratio"] == 0.0
+    cache.get("k")
+    cache.put("k", PICKS)
+    cache.get("k")
+    cache.get("k")
+    cache.get("other")
+    assert cache.stats() == {"hits": 2, "db_hits": 0, "misses": 2, "hit_ratio": 0.5, "size": 1,
+                             "evictions": 0, "invalidations": 0, "shared": False}
@@ -0,0 +1,116 @@
+"""repair_schema: one table row per rule, including what each rule must leave alone."""
+
+import random
+
+import pytest
+
+import api_server
+from benchmarks.synthetic import _schema_drift, random_attributes
+
+
+def valid():
+    obj = random_attributes(random.Random(0), "top")
+    obj["category"]["confidence"] = 0.9
+    obj["scores"].update(formality=0.4, warmth=0.6, versatility=0.7)
+    assert api_server.validate_schema(obj) == (True, [])
+    return obj
+
+
+def at(obj, path):
+    for key in path:
+        obj = obj[key]
+    return obj
+
+
+def put(path, value):
+    def mutate(obj):
+        parent = obj
+        for key in path[:-1]:
+            parent = parent[key]
+        parent[path[-1]] = value
+    return mutate
+
+
+def drop(path):
+    def mutate(obj):
+        parent = obj
+        for key in path[:-1]:
+            parent = parent[key]
+        del parent[path[-1]]
+    return mutate
+
+
+# (id, mutation of a valid object, rules expected to fire, (path, repaired value) or None,
+#  whether the repaired object validates or None to not check)
+CASES = [
+    ("valid_untouched", lambda obj: None, [], None, True),
+
+    # percent_confidence: bare numbers in (1, 100] are rescaled only on *.confidence
+    ("confidence_percent_number", put(("category", "confidence"), 85), ["percent_confidence"], (("category", "confidence"), 0.85), True),
+    ("confidence_100", put(("color", "confidence"), 100), ["percent_confidence"], (("color", "confidence"), 1.0), True),
+    ("top_confidence_percent", put(("confidence",), 70.5), ["percent_confidence"], (("confidence",), 0.705), True),
+    ("confidence_percent_string", put(("fit", "confidence"), "85%"), ["percent_confidence"], (("fit", "confidence"), 0.85), True),
+    ("confidence_number_string", put(("pattern", "confidence"), " 0.7 "), ["percent_confidence"], (("pattern", "confidence"), 0.7), True),
+    ("confidence_over_100", put(("material", "confidence"), 250), [], (("material", "confidence"), 250), False),
+    # (validate_schema takes bools as numbers; the point here is only that repair leaves them alone)
+    ("confidence_bool", put(("category", "confidence"), True), [], (("category", "confidence"), True), None),
+    ("confidence_word", put(("category", "confidence"), "high"), [], (("category", "confidence"), "high"), False),
+    # ec70b2f: a 1-10 formality of 5 must not become 0.05
+    ("formality_number_untouched", put(("scores", "formality"), 5), [], (("scores", "formality"), 5), False),
+    ("warmth_number_untouched", put(("scores", "warmth"), 70), [], (("scores", "warmth"), 70), False),
+    ("versatility_number_untouched", put(("scores", "versatility"), 100), [], (("scores", "versatility"), 100), False),
+    ("formality_percent_string", put(("scores", "formality"), "85%"), ["percent_confidence"], (("scores", "formality"), 0.85), True),
+    ("warmth_number_string", put(("scores", "warmth"), "0.3"), ["percent_confidence"], (("scores", "warmth"), 0.3), True),
+    ("versatility_string_out_of_range", put(("scores", "versatility"), "7"), [], (("scores", "versatility"), "7"), False),
+
+    # string_to_array
+    ("closure_string", put(("details", "closure"), "zipper"), ["string_to_array"], (("details", "closure"), ["zipper"]), True),
+    ("season_comma_string", put(("scores", "season"), "fall, winter"), ["string_to_array"], (("scores", "season"), ["fall", "winter"]), True),
+    ("season_slash_string", put(("scores", "season"), "spring/summer|fall"), ["string_to_array"], (("scores", "season"), ["spring", "summer", "fall"]), True),
+    ("season_empty_string", put(("scores", "season"), " , "), ["string_to_array"], (("scores", "season"), ["unknown"]), True),
+    ("style_tags_string", put(("style_tags",), "casual,street"), ["string_to_array"], (("style_tags",), ["casual", "street"]), True),
+    ("closure_list_untouched", put(("details", "closure"), ["button"]), [], (("details", "closure"), ["button"]), True),
+    ("closure_number_untouched", put(("details", "closure"), 3), [], (("details", "closure"), 3), False),
+
+    # missing_meta
+    ("meta_missing", drop(("meta",)), ["missing_meta"], (("meta",), api_server.DEFAULT_OBJ["meta"]), True),
+    ("meta_not_object", put(("meta",), "n/a"), ["missing_meta"], (("meta",), api_server.DEFAULT_OBJ["meta"]), True),
+    ("meta_partial", drop(("meta", "notes")), ["missing_meta"], (("meta", "notes"), None), True),
+    ("meta_values_kept", put(("meta", "is_layering_piece"), True), [], (("meta", "is_layering_piece"), True), True),
+
+    # extra_top_keys
+    ("extra_top_key", put(("explanation",), "looks casual"), ["extra_top_keys"], None, True),
+    ("extra_nested_key_kept", put(("category", "explanation"), "x"), [], (("category", "explanation"), "x"), True),
+]
+
+
+@pytest.mark.parametrize("mutate, rules, expected, repaired_is_valid",
+                         [case[1:] for case in CASES], ids=[case[0] for case in CASES])
+def test_repair_rule(mutate, rules, expected, repaired_is_valid):
+    obj = valid()
+    mutate(obj)
+    before = repr(obj)
+    repaired, applied = api_server.repair_schema(obj)
+
+    assert applied == rules
+    assert repr(obj) == before  # works on a copy
+    if expected is not None:
+        path, value = expected
+        assert at(repaired, path) == value
+    assert set(repaired) == api_server.REQUIRED_TOP_KEYS
+    if repaired_is_valid is not None:
+        assert api_server.validate_schema(repaired)[0] is repaired_is_valid
+
+
+def test_rules_combine_on_drifted_output():
+    obj = _schema_drift(valid(), random.Random(1))
+    assert not api_server.validate_schema(obj)[0]
+    repaired, applied = api_server.repair_schema(obj)
+    assert set(applied) == {"extra_top_keys", "string_to_array", "percent_confidence"} | (
+        {"missing_meta"} if "meta" not in obj else set())
+    assert api_server.validate_schema(repaired) == (True, [])
+    assert repaired["category"]["confidence"] == 0.9
+
+
+def test_non_object_is_returned_as_is():
+    assert api_server.repair_schema([1, 2]) == ([1, 2], [])
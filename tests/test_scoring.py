@@ -0,0 +1,51 @@
+"""Vectorized outfit scoring must match the scalar calculate_outfit_score reference."""
+
+import random
+
+import numpy as np
+import pytest
+
+import api_server
+from benchmarks.synthetic import make_items
+
+
+def scalar_matrix(tops, bottoms):
+    return np.array([[api_server.calculate_outfit_score(top, bottom)[0] for bottom in bottoms] for top in tops],
+                    dtype=np.float64).reshape(len(tops), len(bottoms))
+
+
+def wardrobe(n_tops, n_bottoms, seed):
+    rng = random.Random(seed)
+    return make_items(n_tops, "top", rng), make_items(n_bottoms, "bottom", rng)
+
+
+@pytest.mark.parametrize("n_tops,n_bottoms,seed", [(1, 1, 0), (7, 13, 1), (60, 60, 2), (120, 35, 3)])
+def test_vectorized_scores_match_scalar(n_tops, n_bottoms, seed):
+    tops, bottoms = wardrobe(n_tops, n_bottoms, seed)
+    np.testing.assert_array_equal(api_server.score_outfit_pairs(tops, bottoms), scalar_matrix(tops, bottoms))
+
+
+def test_sparse_attributes_match_scalar():
+    # Missing sections, unknown colors and unexpected tags take the defaults on both paths
+    tops = [
+        {"id": "t0", "attributes": {}},
+        {"id": "t1", "attributes": {"color": {"primary": "Chartreuse"}, "style_tags": ["gorpcore"]}},
+        {"id": "t2", "attributes": {"scores": {"formality": 0.9, "season": ["winter", "monsoon"]}}},
+    ]
+    bottoms = [
+        {"id": "b0", "attributes": {"color": {"primary": "NAVY"}, "style_tags": ["casual", "gorpcore"]}},
+        {"id": "b1", "attributes": {"scores": {"season": []}}},
+    ]
+    np.testing.assert_array_equal(api_server.score_outfit_pairs(tops, bottoms), scalar_matrix(tops, bottoms))
+
+
+@pytest.mark.parametrize("k", [1, 5, 50])
+@pytest.mark.parametrize("block_rows", [7, api_server.OUTFIT_SCORE_BLOCK_ROWS])
+def test_top_k_order_matches_scalar(k, block_rows):
+    tops, bottoms = wardrobe(80, 45, seed=4)
+    expected = api_server.top_outfit_pairs_scalar(tops, bottoms, k)
+    actual = api_server.top_outfit_pairs(tops, bottoms, k, block_rows=block_rows)
+    assert len(actual) == len(expected) == min(k, len(tops) * len(bottoms))
+    assert [(tops[i]["id"], bottoms[j]["id"]) for _, i, j in actual] == \
+        [(tops[i]["id"], bottoms[j]["id"]) for _, i, j in expected]
+    np.testing.assert_array_equal([s for s, _, _ in actual], [s for s, _, _ in expected])
@@ -0,0 +1,52 @@
+"""IncrementalJsonObjectScanner must return what _first_balanced_json_object returns, however the text is chunked."""
+
+import json
+
+import pytest
+
+import api_server
+
+OBJECT = json.dumps(api_server.DEFAULT_OBJ)
+OBJECT_INDENTED = json.dumps(api_server.DEFAULT_OBJ, indent=2)
+
+CASES = [
+    "",
+    "no json here",
+    "{",
+    "}{",
+    "{}",
+    '{"a": 1}',
+    OBJECT,
+    OBJECT_INDENTED,
+    "Here you go:\n```json\n" + OBJECT_INDENTED + "\n```",
+    "noise } ] " + OBJECT + " trailing {x}",
+    '{"notes": "has \\"quotes\\" and {braces}"}',
+    '{"path": "back\\\\slash", "n": [1, {"x": "}"}]}',
+    '{"a": "unterminated',
+    '{"a": {"b": [1, 2, {"c": "]"}]}, "d": null} {"second": true}',
+    '```json\n{"a": "b,c", "list": ["{", "}"]}\n``` and more',
+]
+
+
+def scan(text, step):
+    fields = []
+    scanner = api_server.IncrementalJsonObjectScanner(lambda key, value: fields.append((key, value)))
+    pos = 0
+    while pos < len(text) and scanner.result is None:
+        scanner.feed(text[pos:pos + step])
+        pos += step
+    return scanner.result, fields
+
+
+@pytest.mark.parametrize("text", CASES)
+@pytest.mark.parametrize("step", [1, 2, 3, 7, 64, 10_000])
+def test_scanner_matches_first_balanced_object(text, step):
+    result, fields = scan(text, step)
+    expected = api_server._first_balanced_json_object(text)
+    assert result == expected
+    if expected is not None:
+        try:
+            parsed = json.loads(expected)
+        except ValueError:
+            return
+        assert dict(fields) == parsed
@@ -0,0 +1,180 @@
+"""The files and sqlite wardrobe backends answer items/count/select/query identically."""
+
+import json
+import os
+import random
+import sqlite3
+
+import pytest
+
+import api_server
+from benchmarks.synthetic import random_attributes, write_wardrobe
+
+SPARSE = {
+    "sparse_empty": {},
+    "sparse_no_scores": {"category": {"main": "top"}, "color": {"primary": "Chartreuse"}, "style_tags": ["gorpcore"]},
+    "sparse_odd_category": {"category": {"main": "cape"}, "scores": {"formality": 1, "season": ["winter"]}},
+}
+
+
+@pytest.fixture(scope="module")
+def wardrobe_dir(tmp_path_factory):
+    output_dir = write_wardrobe(str(tmp_path_factory.mktemp("parity") / "wardrobe"), 300, seed=11)
+    for item_id, attributes in SPARSE.items():
+        with open(os.path.join(output_dir, f"{item_id}.json"), "w", encoding="utf-8") as f:
+            json.dump(attributes, f)
+    with open(os.path.join(output_dir, "broken.json"), "w", encoding="utf-8") as f:
+        f.write("{not json")
+    return output_dir
+
+
+@pytest.fixture(scope="module")
+def stores(wardrobe_dir):
+    return {
+        "snapshot": api_server.WardrobeStore(wardrobe_dir, refresh_interval=0),
+        "files": api_server.WardrobeStore(wardrobe_dir, refresh_interval=0, use_snapshot=False),
+        "sqlite": api_server.SqliteWardrobeStore(wardrobe_dir, db_path=os.path.join(wardrobe_dir, "..", "wardrobe.db")),
+    }
+
+
+def answers(stores, fn):
+    results = {name: fn(store) for name, store in stores.items()}
+    assert results["snapshot"] == results["files"] == results["sqlite"], fn
+    return results["files"]
+
+
+def ids(items):
+    return [item["id"] for item in items]
+
+
+def test_items(stores):
+    items = answers(stores, lambda store: store.items())
+    assert len(items) == 303
+    assert answers(stores, lambda store: store.get("sparse_no_scores")) == {
+        "id": "sparse_no_scores", "filename": "sparse_no_scores.json",
+        "attributes": SPARSE["sparse_no_scores"], "image_url": None}
+    assert answers(stores, lambda store: store.get("missing")) is None
+
+
+@pytest.mark.parametrize("category", api_server.ENUMS["category_main"] + ["cape", "TOP"])
+def test_count(stores, category):
+    answers(stores, lambda store: store.count(category))
+
+
+@pytest.mark.parametrize("category", ["top", "bottom", "shoes", "cape"])
+@pytest.mark.parametrize("season", [None, "winter", "SUMMER", "monsoon"])
+@pytest.mark.parametrize("formality", [None, 0.0, 0.5, 0.8])
+def test_select(stores, category, season, formality):
+    answers(stores, lambda store: ids(store.select(category, season, formality)[0]))
+
+
+QUERIES = [
+    {},
+    {"category": "top"},
+    {"category": "cape"},
+    {"colors": ["navy", "black"]},
+    {"colors": ["chartreuse"]},
+    {"season": "winter"},
+    {"season": "monsoon"},
+    {"style": "casual"},
+    {"style": "gorpcore"},
+    {"formality_min": 0.25, "formality_max": 0.75},
+    {"category": "bottom", "season": "fall", "formality_max": 0.6, "colors": ["gray", "navy", "white", "black"]},
+]
+
+
+@pytest.mark.parametrize("query", QUERIES)
+@pytest.mark.parametrize("with_attributes", [True, False])
+def test_query_pages(stores, query, with_attributes):
+    def pages(store):
+        out, after = [], None
+        while True:
+            items, total, after = store.query(after=after, limit=13, with_attributes=with_attributes, **query)
+            out.append((items, total))
+            if after is None:
+                return out
+    answers(stores, pages)
+    answers(stores, lambda store: store.query(with_attributes=with_attributes, **query))
+
+
+def test_migration_runs_once_and_bumps_version(tmp_path):
+    output_dir = write_wardrobe(str(tmp_path / "wardrobe"), 12, seed=12)
+    store = api_server.SqliteWardrobeStore(output_dir)
+    assert len(store.items()) == 12
+    assert store.version() == "sqlite:1"
+    with sqlite3.connect(store.db_path) as conn:
+        assert conn.execute("SELECT value FROM meta WHERE key = 'migrated_from_json'").fetchone() == ("12",)
+
+    # JSON files written after the import are not picked up again; the database is the source of truth
+    write_wardrobe(str(tmp_path / "wardrobe"), 15, seed=12)
+    reopened = api_server.SqliteWardrobeStore(output_dir)
+    assert len(reopened.items()) == 12
+    assert reopened.version() == "sqlite:1"
+
+    reopened.save("new_item", random_attributes(random.Random(1), "top"), b"png", ".png")
+    assert reopened.version() == store.version() == "sqlite:2"
+
+
+def test_other_process_write_invalidates_decoded_items(tmp_path):
+    output_dir = write_wardrobe(str(tmp_path / "wardrobe"), 3, seed=13)
+    first = api_server.SqliteWardrobeStore(output_dir)
+    second = api_server.SqliteWardrobeStore(output_dir)
+    assert first.get("attributes_0000001") == second.get("attributes_0000001")
+    second.add("attributes_0000001", {"category": {"main": "shoes"}}, ".png")
+    assert first.get("attributes_0000001")["attributes"] == {"category": {"main": "shoes"}}
+    assert first.count("shoes") == second.count("shoes")
+
+
+@pytest.mark.parametrize("backend", ["files", "sqlite"])
+def test_failed_save_leaves_nothing_behind(tmp_path, monkeypatch, backend):
+    output_dir = str(tmp_path / "wardrobe")
+    store = (api_server.SqliteWardrobeStore(output_dir) if backend == "sqlite"
+             else api_server.WardrobeStore(output_dir, refresh_interval=0))
+    store.save("kept", {"category": {"main": "top"}}, b"png", ".png")
+    version = store.version()
+
+    def fail(*args, **kwargs):
+        raise OSError("disk full")
+
+    if backend == "sqlite":
+        monkeypatch.setattr(store, "_write", fail)
+    else:
+        real_write = api_server._atomic_write
+        monkeypatch.setattr(api_server, "_atomic_write",
+                            lambda path, *a, **kw: fail() if path.endswith(".json") else real_write(path, *a, **kw))
+    with pytest.raises(OSError):
+        store.save("lost", {"category": {"main": "top"}}, b"png", ".png")
+    monkeypatch.undo()
+
+    assert store.get("lost") is None
+    assert ids(store.items()) == ["kept"]
+    assert not os.path.exists(os.path.join(output_dir, "lost.json"))
+    if backend == "sqlite":
+        assert not os.path.exists(os.path.join(output_dir, "lost.png"))
+        assert store.version() == version
+    assert not [name for name in os.listdir(output_dir) if name.endswith(".tmp")]
+
+
+@pytest.mark.parametrize("backend", ["files", "sqlite"])
+def test_save_never_exposes_partial_files(tmp_path, monkeypatch, backend):
+    output_dir = str(tmp_path / "wardrobe")
+    store = (api_server.SqliteWardrobeStore(output_dir) if backend == "sqlite"
+             else api_server.WardrobeStore(output_dir, refresh_interval=0))
+    renames = []
+    real_replace = os.replace
+
+    def replace(src, dst):
+        # What is already visible in the wardrobe when each file appears
+        renames.append((os.path.basename(dst), sorted(name for name in os.listdir(output_dir) if name.startswith("item") and not name.endswith(".tmp"))))
+        real_replace(src, dst)
+
+    monkeypatch.setattr(os, "replace", replace)
+    store.save("item", {"category": {"main": "top"}}, b"png-bytes", ".png")
+    monkeypatch.undo()
+
+    renames = [rename for rename in renames if rename[0].startswith("item")]
+    expected = [("item.png", []), ("item.json", ["item.png"])] if backend == "files" else [("item.png", [])]
+    assert renames == expected
+    with open(os.path.join(output_dir, "item.png"), "rb") as f:
+        assert f.read() == b"png-bytes"
+    assert not [name for name in os.listdir(output_dir) if name.endswith(".tmp")]
@@ -0,0 +1,128 @@
+"""GET /api/wardrobe/items: ETag/304, cursor paging, projection, limit bounds and filters."""
+
+import base64
+
+import pytest
+
+import api_server
+from conftest import make_store
+
+URL = "/api/wardrobe/items"
+
+
+@pytest.fixture(params=["files", "sqlite"])
+def backend(request):
+    return request.param
+
+
+@pytest.fixture
+def ids(client, save_items):
+    return save_items(api_server.wardrobe_store, 40, seed=3)
+
+
+def test_unchanged_wardrobe_is_304(client, ids):
+    first = client.get(URL, query_string={"category": "top"})
+    etag = first.headers["ETag"]
+    again = client.get(URL, query_string={"category": "top"}, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["ETag"] == etag
+    # Another query is another representation
+    other = client.get(URL, query_string={"category": "bottom"}, headers={"If-None-Match": etag})
+    assert other.status_code == 200
+
+
+def test_etag_changes_after_add(client, ids, save_items, backend):
+    etag = client.get(URL).headers["ETag"]
+    save_items(api_server.wardrobe_store, 1, seed=4, prefix="new")
+    response = client.get(URL, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert response.get_json()["total"] == 41
+
+    # A save by another worker process (a separate store over the same directory)
+    etag = response.headers["ETag"]
+    save_items(make_store(backend), 1, seed=5, prefix="other")
+    response = client.get(URL, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.get_json()["total"] == 42
+
+
+@pytest.mark.parametrize("query", [{}, {"category": "top"}, {"season": "winter", "formality_min": "0.3"}])
+def test_cursor_paging_returns_every_item_once(client, ids, query):
+    expected = [item["id"] for item in client.get(URL, query_string=query).get_json()["items"]]
+    seen, cursor, pages = [], None, 0
+    while True:
+        params = dict(query, limit=7, fields="id", **({"cursor": cursor} if cursor else {}))
+        body = client.get(URL, query_string=params).get_json()
+        assert body["total"] == len(expected)
+        assert body["count"] == len(body["items"]) <= 7
+        seen += [item["id"] for item in body["items"]]
+        pages += 1
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == expected
+    assert pages == max(1, -(-len(expected) // 7))
+
+
+def test_cursor_without_limit_uses_default_page(client, ids, monkeypatch):
+    monkeypatch.setattr(api_server, "WARDROBE_PAGE_DEFAULT", 15)
+    cursor = base64.urlsafe_b64encode(ids[4].encode()).decode().rstrip("=")
+    body = client.get(URL, query_string={"cursor": cursor}).get_json()
+    assert [item["id"] for item in body["items"]] == ids[5:20]
+    assert body["next_cursor"] is not None
+
+
+@pytest.mark.parametrize("query", [
+    {"cursor": "not base64!"},
+    {"cursor": base64.urlsafe_b64encode(b"\xff\xfe").decode()},
+    {"fields": "id,bogus"},
+    {"limit": "0"},
+    {"limit": "-3"},
+    {"limit": str(api_server.WARDROBE_PAGE_MAX + 1)},
+])
+def test_bad_parameters_are_400(client, ids, query):
+    response = client.get(URL, query_string=query)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_limit_bounds(client, ids):
+    body = client.get(URL, query_string={"limit": 1}).get_json()
+    assert body["count"] == 1 and body["next_cursor"] is not None
+    body = client.get(URL, query_string={"limit": api_server.WARDROBE_PAGE_MAX}).get_json()
+    assert body["count"] == 40 and body["next_cursor"] is None
+
+
+def test_fields_projection(client, ids):
+    body = client.get(URL, query_string={"fields": "id,image_url,category", "limit": 3}).get_json()
+    for item in body["items"]:
+        assert set(item) == {"id", "image_url", "attributes"}
+        assert set(item["attributes"]) == {"category"}
+        assert item["image_url"] == f"/api/images/{item['id']}.png"
+
+
+@pytest.mark.parametrize("query", [
+    {"category": "top"},
+    {"category": "TOP"},
+    {"category": "not-a-category"},
+    {"color": "navy,black"},
+    {"color": "chartreuse"},
+    {"season": "winter"},
+    {"season": "monsoon"},
+    {"style": "casual"},
+    {"formality_min": "0.4", "formality_max": "0.7"},
+    {"category": "top", "season": "summer", "formality_max": "0.5"},
+])
+def test_filters_match_reference(client, ids, query):
+    body = client.get(URL, query_string=query).get_json()
+    colors = [c.strip().lower() for c in query.get("color", "").split(",") if c.strip()] or None
+    expected = [
+        item_id for item_id in ids
+        if api_server._matches_query(
+            api_server.wardrobe_store.get(item_id), query.get("category", "").lower() or None, colors,
+            query.get("season"), float(query["formality_min"]) if "formality_min" in query else None,
+            float(query["formality_max"]) if "formality_max" in query else None, query.get("style"))
+    ]
+    assert [item["id"] for item in body["items"]] == expected
+    assert body["total"] == len(expected)
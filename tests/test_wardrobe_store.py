@@ -0,0 +1,166 @@
+"""WardrobeStore.save must update the in-memory index without rescanning the directory."""
+
+import json
+import os
+import random
+import threading
+
+import pytest
+
+import api_server
+from benchmarks.synthetic import random_attributes, write_wardrobe
+
+
+def listing(store):
+    out = {"ids": [item["id"] for item in store.items()]}
+    for main in ("top", "bottom", "outer", "shoes"):
+        out[f"count_{main}"] = store.count(main)
+        items, features = store.select(main, season="winter")
+        out[f"select_{main}"] = [item["id"] for item in items]
+        if features is not None:
+            out[f"features_{main}"] = {key: value.tolist() for key, value in features.items()}
+    for style in ("casual", "gorpcore"):
+        items, total, _ = store.query(style=style, formality_min=0.2)
+        out[f"query_{style}"] = ([item["id"] for item in items], total)
+    return out
+
+
+@pytest.mark.parametrize("use_snapshot", [True, False])
+def test_save_updates_index_without_rescan(tmp_path, monkeypatch, use_snapshot):
+    output_dir = write_wardrobe(str(tmp_path / "wardrobe"), 40, seed=1, images=False)
+    store = api_server.WardrobeStore(output_dir, refresh_interval=3600, use_snapshot=use_snapshot)
+    store.refresh()
+
+    scans = []
+    scan = api_server.WardrobeStore._scan
+    monkeypatch.setattr(api_server.WardrobeStore, "_scan", lambda self, *a: (scans.append(a), scan(self, *a)))
+
+    rng = random.Random(2)
+    new = {
+        "attributes_0000005": random_attributes(rng, "top"),  # overwrites an existing item
+        "attributes_0000040": random_attributes(rng, "top"),
+        "a_first": random_attributes(rng, "bottom"),
+        "zz_last": dict(random_attributes(rng, "shoes"), style_tags=["gorpcore", "casual"]),
+    }
+    for item_id, attributes in new.items():
+        store.save(item_id, attributes, b"png", ".png")
+    store.refresh_interval = 0  # poll the directory mtime on every call from here on
+    after_save = listing(store)
+    assert scans == []
+    assert store.get("attributes_0000005")["attributes"] == new["attributes_0000005"]
+
+    fresh = api_server.WardrobeStore(output_dir, refresh_interval=0, use_snapshot=use_snapshot)
+    assert after_save == listing(fresh)
+    assert store.version() == fresh.version()
+
+
+def test_other_process_save_is_picked_up_by_poll(tmp_path):
+    output_dir = write_wardrobe(str(tmp_path / "wardrobe"), 10, seed=3, images=False)
+    reader = api_server.WardrobeStore(output_dir, refresh_interval=0)
+    writer = api_server.WardrobeStore(output_dir, refresh_interval=0)
+    assert len(reader.items()) == len(writer.items()) == 10
+
+    writer.save("attributes_0000010", random_attributes(random.Random(4), "top"), b"png", ".png")
+    assert [item["id"] for item in reader.items()][-1] == "attributes_0000010"
+    assert listing(reader) == listing(writer)
+
+
+def test_save_before_first_load(tmp_path):
+    output_dir = write_wardrobe(str(tmp_path / "wardrobe"), 5, seed=5, images=False)
+    store = api_server.WardrobeStore(output_dir, refresh_interval=3600)
+    item, _ = store.save("attributes_0000005", random_attributes(random.Random(6), "top"), b"png", ".png")
+    assert item["image_url"].endswith("attributes_0000005.png")
+    assert len(store.items()) == 6
+
+
+@pytest.fixture
+def count_scans(monkeypatch):
+    scans = []
+    scan = api_server.WardrobeStore._scan
+    monkeypatch.setattr(api_server.WardrobeStore, "_scan", lambda self, *a: (scans.append(a), scan(self, *a)))
+    return scans
+
+
+def save_items(store, n, seed):
+    rng = random.Random(seed)
+    for i in range(n):
+        store.save(f"saved_{seed}_{i:03d}", random_attributes(rng), b"png", ".png")
+
+
+def test_other_processes_replay_delta_log(tmp_path, count_scans):
+    output_dir = write_wardrobe(str(tmp_path / "wardrobe"), 20, seed=7, images=False)
+    writer = api_server.WardrobeStore(output_dir, refresh_interval=0)
+    reader = api_server.WardrobeStore(output_dir, refresh_interval=0)
+    writer.refresh()
+    reader.refresh()
+    del count_scans[:]
+
+    save_items(writer, 5, seed=8)
+    assert listing(reader) == listing(writer)
+    # A worker started now opens the (older) snapshot and replays the log
+    assert listing(api_server.WardrobeStore(output_dir, refresh_interval=0)) == listing(writer)
+    assert count_scans == []
+
+
+def test_compaction_folds_delta_into_snapshot(tmp_path, count_scans):
+    output_dir = write_wardrobe(str(tmp_path / "wardrobe"), 20, seed=9, images=False)
+    store = api_server.WardrobeStore(output_dir, refresh_interval=0)
+    store.refresh()
+    del count_scans[:]
+    save_items(store, 6, seed=10)
+
+    store._compact()
+    snap = api_server.WardrobeSnapshot.open(store.snapshot_path)
+    assert snap.dir_mtime == os.stat(output_dir).st_mtime_ns
+    assert snap.count == 26
+    assert os.path.getsize(store.delta_path) == 0
+
+    save_items(store, 2, seed=11)  # logged against the compacted snapshot
+    assert listing(api_server.WardrobeStore(output_dir, refresh_interval=0)) == listing(store)
+    assert count_scans == []
+
+
+def test_compaction_keeps_saves_made_while_building(tmp_path, monkeypatch):
+    output_dir = write_wardrobe(str(tmp_path / "wardrobe"), 10, seed=12, images=False)
+    store = api_server.WardrobeStore(output_dir, refresh_interval=0)
+    other = api_server.WardrobeStore(output_dir, refresh_interval=0)
+    store.refresh()
+    save_items(store, 3, seed=13)
+
+    build = api_server.WardrobeSnapshot.build
+
+    def build_during_save(*args, **kwargs):
+        save_items(other, 2, seed=14)
+        return build(*args, **kwargs)
+
+    monkeypatch.setattr(api_server.WardrobeSnapshot, "build", build_during_save)
+    store._compact()
+    monkeypatch.setattr(api_server.WardrobeSnapshot, "build", build)
+
+    with open(store.delta_path, encoding="utf-8") as f:
+        assert [json.loads(line)["id"] for line in f] == ["saved_14_000", "saved_14_001"]
+    assert listing(store) == listing(other)
+    scanned = api_server.WardrobeStore(output_dir, use_snapshot=False)
+    assert [item["id"] for item in store.items()] == [item["id"] for item in scanned.items()]
+
+
+def test_change_outside_delta_log_falls_back_to_scan(tmp_path, count_scans):
+    output_dir = write_wardrobe(str(tmp_path / "wardrobe"), 10, seed=15, images=False)
+    store = api_server.WardrobeStore(output_dir, refresh_interval=0)
+    save_items(store, 2, seed=16)
+    os.remove(os.path.join(output_dir, "attributes_0000003.json"))
+    assert "attributes_0000003" not in [item["id"] for item in store.items()]
+    assert count_scans
+
+
+def test_save_starts_background_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(api_server, "WARDROBE_DELTA_COMPACT_BYTES", 1)
+    output_dir = write_wardrobe(str(tmp_path / "wardrobe"), 10, seed=17, images=False)
+    store = api_server.WardrobeStore(output_dir, refresh_interval=0)
+    store.refresh()
+    save_items(store, 1, seed=18)
+    for thread in threading.enumerate():
+        if thread.name == "wardrobe-compact":
+            thread.join()
+    assert api_server.WardrobeSnapshot.open(store.snapshot_path).count == 11
+    assert os.path.getsize(store.delta_path) == 0